@@ -0,0 +1,207 @@
+"""
+Async versions of the read-heavy endpoints, served under /api/async/, and
+the live event stream that replaces polling them.
+
+They return the same data as their sync counterparts in core/views.py but
+query through Django's async ORM, so under an ASGI server (see
+gunicorn.conf.py) a worker keeps serving other requests while one waits on
+the database or on a slow client. Only GETs live here; writes stay on the
+sync views.
+
+DRF's views are sync-only, so authentication (scoped JWT, as configured for
+the API) and error responses are done by ``async_api_view`` below.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django_filters.utils import translate_validation
+from rest_framework import exceptions, status
+from rest_framework.filters import OrderingFilter
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .authentication import (
+    SCOPE_VERSION_CLAIM, ScopedJWTAuthentication, acurrent_fingerprint, is_scoped, user_from_claims,
+)
+from . import events
+from .filters import IssueFilter
+from .models import Comment, Issue, Project
+from .pagination import apaginate, apaginate_nested
+from .serializers import CommentSerializer, IssueSerializer, UserSerializer
+from .views import IssueViewSet
+from .visibility import get_visibility
+
+User = get_user_model()
+
+
+def renderers():
+    """The API's renderers (REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES']) but the browsable one, which needs a DRF view."""
+    return [
+        renderer() for renderer in api_settings.DEFAULT_RENDERER_CLASSES
+        if not issubclass(renderer, BrowsableAPIRenderer)
+    ]
+
+
+def api_response(request, data, status_code=status.HTTP_200_OK, headers=None):
+    """
+    ``data`` rendered the way the sync views render it: the renderer is
+    negotiated from ``Accept`` / ``?format=`` (orjson, or MessagePack), so
+    both return identical bytes.
+    """
+    available = renderers()
+    try:
+        renderer, media_type = DefaultContentNegotiation().select_renderer(request, available)
+    except (exceptions.NotAcceptable, Http404):
+        # Nothing the client asked for (or an unknown ?format=): JSON
+        renderer, media_type = available[0], available[0].media_type
+    content_type = f'{renderer.media_type}; charset={renderer.charset}' if renderer.charset else renderer.media_type
+    return HttpResponse(
+        renderer.render(data, media_type, {}), status=status_code,
+        content_type=content_type, headers=headers
+    )
+
+
+async def authenticate(request):
+    """ScopedJWTAuthentication.authenticate(), loading the user (if it has to) with the async ORM."""
+    auth = ScopedJWTAuthentication()
+    header = auth.get_header(request)
+    raw_token = auth.get_raw_token(header) if header is not None else None
+    if raw_token is None:
+        raise exceptions.NotAuthenticated()
+
+    token = auth.get_validated_token(raw_token)
+    try:
+        user_id = token[jwt_settings.USER_ID_CLAIM]
+    except KeyError:
+        raise InvalidToken('Token contained no recognizable user identification')
+
+    if is_scoped(token):
+        return user_from_claims(token, await acurrent_fingerprint(user_id, token[SCOPE_VERSION_CLAIM]))
+
+    try:
+        user = await User.objects.aget(**{jwt_settings.USER_ID_FIELD: user_id})
+    except User.DoesNotExist:
+        raise exceptions.AuthenticationFailed('User not found', code='user_not_found')
+    if not user.is_active:
+        raise exceptions.AuthenticationFailed('User is inactive', code='user_inactive')
+    return user
+
+
+def async_api_view(view):
+    """
+    What @api_view + IsAuthenticated do for the sync views: GET only,
+    authenticate, wrap the request for ``query_params``, and turn API
+    exceptions into error responses.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        api_request = Request(request)
+        if request.method not in ('GET', 'HEAD'):
+            return api_response(
+                api_request,
+                {'detail': f'Method "{request.method}" not allowed.'},
+                status.HTTP_405_METHOD_NOT_ALLOWED, headers={'Allow': 'GET, HEAD'}
+            )
+        try:
+            api_request.user = await authenticate(request)
+            return await view(api_request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            headers = {}
+            if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+                headers['WWW-Authenticate'] = ScopedJWTAuthentication().authenticate_header(request)
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            return api_response(api_request, data, exc.status_code, headers)
+    return wrapper
+
+
+def visible_issues(user):
+    """The issues ``user`` can see. A sub-contractor's may have to reload core.trades, so run this in a thread."""
+    return get_visibility(user).issue_queryset()
+
+
+def filter_issues(request, issues):
+    """IssueViewSet's filter backends. ?trade= may have to reload core.trades, so run this in a thread."""
+    filterset = IssueFilter(request.query_params, queryset=issues, request=request)
+    if not filterset.is_valid():
+        raise translate_validation(filterset.errors)
+    return OrderingFilter().filter_queryset(request, filterset.qs, IssueViewSet)
+
+
+@async_api_view
+async def user_profile(request):
+    """GET /api/async/auth/profile/"""
+    return api_response(request, UserSerializer(request.user).data)
+
+
+@async_api_view
+async def issue_list(request):
+    """GET /api/async/issues/ - same filters, ordering and pagination as /api/issues/"""
+    issues = IssueSerializer.setup_sparse_loading(await sync_to_async(visible_issues)(request.user), request)
+    issues = await sync_to_async(filter_issues)(request, issues)
+    return api_response(request, await apaginate(request, issues, IssueSerializer, view=IssueViewSet))
+
+
+@async_api_view
+async def issue_detail(request, issue_id):
+    """GET /api/async/issues/15/"""
+    issues = IssueSerializer.setup_sparse_loading(await sync_to_async(visible_issues)(request.user), request)
+    issue = await issues.filter(id=issue_id).afirst()
+    if issue is None:
+        raise exceptions.NotFound()
+    return api_response(request, IssueSerializer(issue, context={'request': request}).data)
+
+
+@async_api_view
+async def project_issues(request, project_id):
+    """GET /api/async/projects/5/issues/"""
+    # STEP 1: Check if project exists
+    if not await Project.objects.filter(id=project_id).aexists():
+        return api_response(request, {"error": "Project not found"}, status.HTTP_404_NOT_FOUND)
+
+    # STEP 2: Get its issues, a page at a time with ?pagination=cursor
+    issues = IssueSerializer.setup_sparse_loading(Issue.objects.filter(project_id=project_id), request)
+    paginated = await apaginate_nested(request, issues, IssueSerializer, ordering=['-created_at'])
+    if paginated is not None:
+        return api_response(request, paginated)
+
+    issues = [issue async for issue in issues]
+    return api_response(request, IssueSerializer(issues, many=True, context={'request': request}).data)
+
+
+@async_api_view
+async def issue_comments(request, issue_id):
+    """GET /api/async/issues/15/comments/"""
+    # STEP 1: Check if issue exists
+    if not await Issue.objects.filter(id=issue_id).aexists():
+        return api_response(request, {"error": "Issue not found"}, status.HTTP_404_NOT_FOUND)
+
+    # STEP 2: Get its comments, newest first
+    comments = CommentSerializer.setup_sparse_loading(Comment.objects.filter(issue_id=issue_id).order_by('-timestamp'), request)
+    paginated = await apaginate_nested(request, comments, CommentSerializer, ordering=['-timestamp'])
+    if paginated is not None:
+        return api_response(request, paginated)
+
+    comments = [comment async for comment in comments]
+    return api_response(request, CommentSerializer(comments, many=True, context={'request': request}).data)
+
+
+@async_api_view
+async def event_stream(request):
+    """
+    GET /api/async/events/ - Server-Sent Events as issues, comments and attachments the user can see change
+    event: issue
+    data: {"type": "issue", "action": "updated", "id": 15, "issue": 15, "project": 5}
+    Call /api/sync/ on connecting and on a "resync" event to catch up on anything missed.
+    """
+    scope = await sync_to_async(get_visibility)(request.user)
+    response = StreamingHttpResponse(events.stream(scope), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Don't let nginx hold the events back
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,102 @@
+"""
+Issue audit log.
+
+Every saved change to an audited field of an Issue becomes an IssueHistory
+row holding the field's old and new value (``<field>_changed``), every
+new issue gets a ``created`` row and every deleted one a ``deleted`` row. The diff comes from the values the issue
+remembers since it was loaded (Issue.snapshot()), so working it out costs
+no query, and all the rows for one save go in with a single INSERT.
+
+Inside ``batch()`` nothing is written until the block ends, then everything
+recorded in it goes in with one bulk insert. The bulk issue paths in
+core/bulk.py run inside a batch, within their transaction, so auditing a
+whole punch list costs one INSERT per BATCH_SIZE rows instead of one per
+field per issue.
+
+The table is append-only: deleting an issue or a project leaves its rows
+(IssueHistory has no foreign key constraints). Rows carry their project so
+the per-project history reads one index, and old months are removed with
+the prune_issue_history command.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from .middleware import get_current_user
+from .models import IssueHistory
+
+# Issue attribute -> name used in the action ("status" -> "status_changed")
+AUDITED_FIELDS = {
+    'status': 'status',
+    'priority': 'priority',
+    'due_date': 'due_date',
+    'assigned_to_id': 'assigned_to',
+    'trade_id': 'trade',
+}
+
+BATCH_SIZE = 1000
+
+_buffer = ContextVar('audit_buffer', default=None)
+
+
+def as_text(value):
+    return None if value is None else str(value)
+
+
+def diff(issue, created=False, actor=None, deleted=False):
+    """
+    Unsaved IssueHistory rows for what changed in ``issue`` since its last
+    snapshot, made by ``actor`` (default: the user of the current request).
+    """
+    actor = actor or get_current_user()
+    common = {'issue_id': issue.pk, 'project_id': issue.project_id, 'user_id': actor.pk if actor else None}
+    if created:
+        return [IssueHistory(action='created', new_value=issue.status, **common)]
+    if deleted:
+        return [IssueHistory(action='deleted', old_value=issue.status, **common)]
+
+    rows = []
+    for attribute, name in AUDITED_FIELDS.items():
+        old, new = issue.previous_value(attribute), getattr(issue, attribute)
+        # Fields not loaded (deferred) have nothing to compare with
+        if attribute not in getattr(issue, '_loaded_values', {}) or old == new:
+            continue
+        rows.append(IssueHistory(
+            action=f'{name}_changed', old_value=as_text(old), new_value=as_text(new), **common
+        ))
+    return rows
+
+
+def record(issue, created=False, actor=None, deleted=False):
+    """Log ``issue``'s changes, straight away or at the end of the current batch()."""
+    rows = diff(issue, created, actor, deleted)
+    if not rows:
+        return
+    buffer = _buffer.get()
+    if buffer is not None:
+        buffer.extend(rows)
+    else:
+        write(rows)
+
+
+def write(rows):
+    if rows:
+        IssueHistory.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+@contextmanager
+def batch():
+    """
+    Hold the rows recorded inside the block and insert them together when it
+    ends. Use it inside the transaction that makes the changes; nested
+    batches join the outer one.
+    """
+    if _buffer.get() is not None:
+        yield
+        return
+    rows = []
+    token = _buffer.set(rows)
+    try:
+        yield
+    finally:
+        _buffer.reset(token)
+    write(rows)
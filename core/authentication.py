@@ -0,0 +1,232 @@
+"""
+Stateless JWT authentication.
+
+Access tokens issued at login (and by the refresh endpoint) carry the
+user's scope as claims: email, username, role, specialty, the ids of the
+projects they are assigned to, and ``scope_version``, a fingerprint of all
+of that plus the password hash. ScopedJWTAuthentication builds the request user from those
+claims instead of loading the user row, and get_visibility() uses the
+claims instead of querying ``assigned_projects``, so an authenticated read
+costs no queries for auth at all.
+
+The only thing checked against the database is the fingerprint, and that
+is kept in a dict in the process for SCOPED_TOKEN_RECHECK_SECONDS. When a
+user's email, username, role, specialty, password, active flag or project
+assignments change (see core/signals.py) their entry is dropped, the fingerprint no
+longer matches and every access token issued before the change is
+rejected with ``token_not_valid``: the client has to refresh it, which
+puts the current scope in the new token. Other processes notice within
+SCOPED_TOKEN_RECHECK_SECONDS, and a token that doesn't match the cached
+fingerprint is always checked against the database before it is refused.
+
+Tokens without the scope claims (issued before this existed, or for users
+assigned to more than SCOPED_TOKEN_MAX_PROJECTS projects) are authenticated
+the usual way, loading the user.
+"""
+import hashlib
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from .visibility import Visibility
+
+User = get_user_model()
+
+SCOPE_VERSION_CLAIM = 'scope_version'
+SCOPE_CLAIMS = ('email', 'username', 'role', 'specialty', 'projects', SCOPE_VERSION_CLAIM)
+
+# user id -> (fingerprint or None for missing/inactive users, checked at)
+_fingerprints = {}
+_lock = threading.Lock()
+MAX_CACHED_USERS = 50_000
+
+
+def encode_ids(ids):
+    """Sorted ids as ranges, e.g. [1, 2, 3, 7, 9, 10] -> '1-3,7,9-10'."""
+    runs = []
+    for value in sorted(ids):
+        if runs and value == runs[-1][1] + 1:
+            runs[-1][1] = value
+        else:
+            runs.append([value, value])
+    return ','.join(str(start) if start == end else f'{start}-{end}' for start, end in runs)
+
+
+def decode_ids(encoded):
+    ids = set()
+    for part in filter(None, encoded.split(',')):
+        start, _, end = part.partition('-')
+        ids.update(range(int(start), int(end or start) + 1))
+    return frozenset(ids)
+
+
+def fingerprint(user, project_ids):
+    """Changes whenever anything the token vouches for does."""
+    parts = [user.email, user.username, user.role, user.specialty or '', user.password, encode_ids(project_ids)]
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()[:16]
+
+
+def assigned_project_ids(user):
+    """
+    The user's projects, from the database: get_visibility() may not have
+    heard yet of a change made through another process.
+    """
+    return frozenset(user.assigned_projects.values_list('id', flat=True))
+
+
+def add_scope_claims(token, user):
+    """Put ``user``'s scope in ``token``. Skipped for users in too many projects to fit."""
+    scope = Visibility(role=user.role, specialty=user.specialty, assigned_project_ids=assigned_project_ids(user))
+    project_ids = () if scope.see_all else scope.assigned_project_ids
+    if len(project_ids) > settings.SCOPED_TOKEN_MAX_PROJECTS:
+        return
+    token['email'] = user.email
+    token['username'] = user.username
+    token['role'] = user.role
+    token['specialty'] = user.specialty
+    token['projects'] = encode_ids(project_ids)
+    token[SCOPE_VERSION_CLAIM] = fingerprint(user, scope.assigned_project_ids)
+
+
+class ScopedAccessToken(AccessToken):
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        add_scope_claims(token, user)
+        return token
+
+
+class ScopedRefreshToken(RefreshToken):
+    """Refresh token whose access tokens carry the user's current scope."""
+    access_token_class = ScopedAccessToken
+    no_copy_claims = RefreshToken.no_copy_claims + SCOPE_CLAIMS
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token.user = user  # saves loading it again for the first access token
+        return token
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        user = getattr(self, 'user', None)
+        if user is None:
+            user = User.objects.filter(
+                **{jwt_settings.USER_ID_FIELD: self[jwt_settings.USER_ID_CLAIM]}, is_active=True
+            ).first()
+            if user is None:
+                raise TokenError('User not found or inactive')
+        add_scope_claims(access, user)
+        return access
+
+
+class ScopedTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = ScopedRefreshToken
+
+
+class ScopedTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = ScopedRefreshToken
+
+
+def load_fingerprint(user_id):
+    """The fingerprint a token for this user must carry right now, None if they can't log in."""
+    user = User.objects.filter(**{jwt_settings.USER_ID_FIELD: user_id}).first()
+    if user is None or not user.is_active:
+        return None
+    return fingerprint(user, assigned_project_ids(user))
+
+
+def cached_fingerprint(user_id):
+    """(found, fingerprint) from this process's cache."""
+    entry = _fingerprints.get(user_id)
+    if entry is not None and time.monotonic() - entry[1] < settings.SCOPED_TOKEN_RECHECK_SECONDS:
+        return True, entry[0]
+    return False, None
+
+
+def remember_fingerprint(user_id, value):
+    with _lock:
+        if len(_fingerprints) >= MAX_CACHED_USERS:
+            _fingerprints.clear()
+        _fingerprints[user_id] = (value, time.monotonic())
+
+
+def current_fingerprint(user_id, claimed):
+    """
+    The user's fingerprint, from the cache unless it differs from the
+    ``claimed`` one: the token may have been issued by another process
+    after a change this one hasn't heard of, so look again before refusing it.
+    """
+    found, value = cached_fingerprint(user_id)
+    if not found or value != claimed:
+        value = load_fingerprint(user_id)
+        remember_fingerprint(user_id, value)
+    return value
+
+
+async def acurrent_fingerprint(user_id, claimed):
+    found, value = cached_fingerprint(user_id)
+    if not found or value != claimed:
+        value = await sync_to_async(load_fingerprint)(user_id)
+        remember_fingerprint(user_id, value)
+    return value
+
+
+def forget(*user_ids):
+    """Check these users' tokens against the database again on their next request."""
+    with _lock:
+        for user_id in user_ids:
+            _fingerprints.pop(user_id, None)
+
+
+def user_from_claims(token, current):
+    """
+    An unsaved CustomUser built from the token's claims, after checking them
+    against ``current`` (the user's fingerprint now). Good for permission
+    checks, filtering and as a foreign key value; views that change the user
+    itself must load the real row.
+    """
+    if current is None:
+        raise InvalidToken('User not found or inactive')
+    if token[SCOPE_VERSION_CLAIM] != current:
+        raise InvalidToken('Role or project access changed, refresh the token')
+
+    user = User(
+        **{jwt_settings.USER_ID_FIELD: token[jwt_settings.USER_ID_CLAIM]},
+        email=token['email'],
+        username=token['username'],
+        role=token['role'],
+        specialty=token['specialty'],
+        is_active=True,
+    )
+    user._state.adding = False
+    user.token_visibility = Visibility(
+        role=user.role,
+        specialty=user.specialty,
+        assigned_project_ids=decode_ids(token['projects']),
+    )
+    return user
+
+
+def is_scoped(token):
+    return SCOPE_VERSION_CLAIM in token
+
+
+class ScopedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that trusts the scope claims of tokens that have them (see the module docstring)."""
+
+    def get_user(self, validated_token):
+        if not is_scoped(validated_token):
+            return super().get_user(validated_token)
+        user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        current = current_fingerprint(user_id, validated_token[SCOPE_VERSION_CLAIM])
+        return user_from_claims(validated_token, current)
@@ -0,0 +1,223 @@
+"""
+Load generation helpers for the benchmark commands.
+
+The client is plain asyncio sockets speaking HTTP/1.1, so no HTTP client
+library is needed and a client can be made deliberately slow: a "slow
+client" trickles its request out line by line the way a phone on a poor
+site connection does. Against sync workers every slow client holds a whole
+worker until its request is in; against an event loop it costs next to
+nothing.
+"""
+import asyncio
+import contextlib
+import json
+import math
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+
+from django.conf import settings
+
+from .authentication import ScopedAccessToken
+
+# How each server is started for a benchmark, with gunicorn.conf.py
+SERVERS = {
+    'wsgi': ('siteflow.wsgi:application', 'sync'),
+    'asgi': ('siteflow.asgi:application', 'uvicorn_worker.UvicornWorker'),
+}
+
+
+@dataclass
+class LoadResult:
+    latencies: list = field(default_factory=list)  # seconds, per successful request
+    queries: list = field(default_factory=list)  # per request, from the Server-Timing header
+    errors: int = 0
+    duration: float = 0.0
+
+    @property
+    def throughput(self):
+        return len(self.latencies) / self.duration if self.duration else 0.0
+
+    def percentile(self, p):
+        return percentile(self.latencies, p)
+
+    @classmethod
+    def combine(cls, results):
+        """One result for runs that happened at the same time."""
+        return cls(
+            latencies=[value for result in results for value in result.latencies],
+            queries=[value for result in results for value in result.queries],
+            errors=sum(result.errors for result in results),
+            duration=max((result.duration for result in results), default=0.0),
+        )
+
+    def as_dict(self):
+        return {
+            'requests': len(self.latencies),
+            'errors': self.errors,
+            'duration_s': round(self.duration, 3),
+            'throughput_rps': round(self.throughput, 1),
+            'p50_ms': round(self.percentile(50) * 1000, 2),
+            'p95_ms': round(self.percentile(95) * 1000, 2),
+            'p99_ms': round(self.percentile(99) * 1000, 2),
+            'queries_per_request': round(sum(self.queries) / len(self.queries), 2) if self.queries else None,
+            'max_queries': max(self.queries) if self.queries else None,
+        }
+
+
+def percentile(values, p):
+    """Nearest-rank percentile, 0 for no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(p / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def auth_headers(user):
+    # The kind of token login hands out
+    return {'Authorization': f'Bearer {ScopedAccessToken.for_user(user)}'}
+
+
+def query_count(server_timing):
+    """The query count core.metrics puts in Server-Timing, or None."""
+    match = re.search(r'db;desc="(\d+) queries"', server_timing or '')
+    return int(match.group(1)) if match else None
+
+
+async def fetch(host, port, path, headers=None, send_delay=0.0, timeout=30, method='GET', body=None):
+    """
+    Make one request and read the whole response. Returns ``(status, headers)``
+    with lower-cased header names. ``body`` is sent as JSON. With
+    ``send_delay`` the request goes out one header line at a time with that
+    many seconds between lines.
+    """
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        payload = json.dumps(body).encode() if body is not None else b''
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {host}:{port}', 'Connection: close']
+        lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+        if body is not None:
+            lines += ['Content-Type: application/json', f'Content-Length: {len(payload)}']
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode() + payload
+
+        if send_delay:
+            for line in request.splitlines(keepends=True):
+                writer.write(line)
+                await writer.drain()
+                await asyncio.sleep(send_delay)
+        else:
+            writer.write(request)
+            await writer.drain()
+
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        while await asyncio.wait_for(reader.read(64 * 1024), timeout):
+            pass
+        return status, response_headers
+    finally:
+        writer.close()
+        with contextlib.suppress(OSError):
+            await writer.wait_closed()
+
+
+async def run_load(host, port, paths, headers=None, clients=10, duration=10.0,
+                   slow_clients=0, slow_delay=0.5, method='GET', body=None):
+    """
+    ``clients`` concurrent clients request ``paths`` round robin as fast as
+    they can for ``duration`` seconds while ``slow_clients`` others do the
+    same slowly. Only the fast clients' requests are measured.
+    """
+    result = LoadResult()
+    deadline = time.monotonic() + duration
+
+    async def fast_client(offset):
+        index = offset
+        while time.monotonic() < deadline:
+            path = paths[index % len(paths)]
+            index += 1
+            started = time.perf_counter()
+            try:
+                status, response_headers = await fetch(host, port, path, headers, method=method, body=body)
+            except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+                status, response_headers = None, {}
+            if status is not None and status < 400:
+                result.latencies.append(time.perf_counter() - started)
+                queries = query_count(response_headers.get('server-timing'))
+                if queries is not None:
+                    result.queries.append(queries)
+            else:
+                result.errors += 1
+
+    async def slow_client(offset):
+        index = offset
+        while time.monotonic() < deadline:
+            with contextlib.suppress(OSError, asyncio.TimeoutError, ValueError, IndexError):
+                await fetch(host, port, paths[index % len(paths)], headers, send_delay=slow_delay)
+            index += 1
+
+    started = time.monotonic()
+    await asyncio.gather(
+        *(fast_client(n) for n in range(clients)),
+        *(slow_client(n) for n in range(slow_clients)),
+    )
+    result.duration = time.monotonic() - started
+    return result
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(host, port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with contextlib.suppress(OSError):
+            with socket.create_connection((host, port), timeout=1):
+                return
+        time.sleep(0.2)
+    raise TimeoutError(f'Nothing listening on {host}:{port} after {timeout}s')
+
+
+@contextlib.contextmanager
+def serve(kind, port, workers=2, host='127.0.0.1', env=None):
+    """
+    Run the app under gunicorn (``kind`` is 'wsgi' or 'asgi') for the
+    duration of the block. ``env`` adds to the server's environment.
+    """
+    app, worker_class = SERVERS[kind]
+    env = dict(
+        os.environ,
+        **(env or {}),
+        GUNICORN_BIND=f'{host}:{port}',
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_WORKER_CLASS=worker_class,
+        GUNICORN_RELOAD='False',
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', app, '-c', 'gunicorn.conf.py', '--access-logfile', '/dev/null'],
+        cwd=settings.BASE_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(host, port)
+        yield host, port
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
@@ -0,0 +1,123 @@
+"""
+Garbage collection of attachment blobs (see core.storage).
+
+A blob is referenced by every Attachment whose ``file`` is its name; when
+the last one is deleted nothing else ever will be, so it is removed, along
+with its thumbnails and previews (core.derivatives).
+
+Deleting an attachment hands its blob to ``release()`` once the delete
+commits, and a background thread removes it if no row refers to it any
+more. The ``gc_blobs`` command sweeps the whole store for what that misses
+(blobs whose last reference went while the server was restarting, or was
+replaced rather than deleted); run it daily.
+
+A blob stored or reused less than BLOB_GC_GRACE_SECONDS ago is left alone:
+the row that is about to refer to it may not have committed yet.
+
+With BLOB_GC_ASYNC off no thread is started and released blobs are
+collected immediately (used by the tests).
+"""
+import logging
+import posixpath
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import derivatives, imaging
+from .models import Attachment
+from .storage import DIGEST, digest_of
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+_released = queue.SimpleQueue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def storage():
+    return Attachment._meta.get_field('file').storage
+
+
+def referenced(names):
+    """The ones of ``names`` some attachment still refers to."""
+    return set(Attachment.objects.filter(file__in=list(names)).values_list('file', flat=True))
+
+
+def stored():
+    """Names of all the blobs in the store."""
+    directory = posixpath.dirname(Attachment._meta.get_field('file').upload_to)
+    store = storage()
+    if not store.exists(directory):
+        return
+    for prefix in store.listdir(directory)[0]:
+        for name in store.listdir(posixpath.join(directory, prefix))[1]:
+            if DIGEST.fullmatch(name) and name[:2] == prefix:
+                yield posixpath.join(directory, prefix, name)
+
+
+def collect(names):
+    """Delete the blobs of ``names`` nothing refers to. Returns how many were deleted."""
+    names = {name for name in names if digest_of(name)}
+    store = storage()
+    deleted = 0
+    for name in names - referenced(names):
+        if not store.discard(name, settings.BLOB_GC_GRACE_SECONDS):
+            continue
+        deleted += 1
+        digest = digest_of(name)
+        for size in derivatives.SIZES:
+            imaging.derivative_path(settings.DERIVATIVE_DIR, digest, size).unlink(missing_ok=True)
+    return deleted
+
+
+def sweep():
+    """Collect every unreferenced blob in the store (the gc_blobs command)."""
+    deleted, batch = 0, []
+    for name in stored():
+        batch.append(name)
+        if len(batch) == BATCH_SIZE:
+            deleted += collect(batch)
+            batch = []
+    return deleted + collect(batch)
+
+
+# Background collection
+
+def release(name):
+    """Collect blob ``name`` if nothing refers to it any more. Call once the delete has committed."""
+    if not digest_of(name):
+        return
+    if not settings.BLOB_GC_ASYNC:
+        collect([name])
+        return
+    _released.put(name)
+    _start_worker()
+
+
+def _start_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name='blob-collector', daemon=True)
+            _worker.start()
+
+
+def _run():
+    while True:
+        # Whatever else was released meanwhile goes in the same query
+        names = {_released.get()}
+        while len(names) < BATCH_SIZE:
+            try:
+                names.add(_released.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            collect(names)
+        except Exception:
+            logger.exception('Could not collect %d released blob(s)', len(names))
+        finally:
+            close_old_connections()
@@ -0,0 +1,132 @@
+"""
+Bulk issue creation and updates for ``project_issues``.
+
+Site officers log punch lists of hundreds of items after a walkthrough. The
+whole list is validated in one pass (trades are loaded once instead of once
+per item) and written with batched INSERT / UPDATE statements inside a single
+transaction. Invalid items are reported by index; the valid ones are still
+saved unless the caller asked for all-or-nothing.
+
+bulk_create / bulk_update don't send model signals, so anything that hangs
+off Issue saves must also be called from here.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from . import audit, events, notifications, response_cache, summary, sync
+from .middleware import get_current_user
+from .models import Issue
+from .serializers import IssueSerializer
+
+BULK_LIMIT = 500
+BATCH_SIZE = 200
+
+# What a bulk PATCH may change
+BULK_UPDATE_FIELDS = ('status', 'priority', 'due_date')
+
+
+def create_issues(project, items, atomic=False):
+    """
+    Validate and insert ``items`` into ``project``.
+    Returns ``(created_issues, errors)``, errors being ``[{'index', 'errors'}]``.
+    """
+    issues, errors = [], []
+
+    for index, item in enumerate(items):
+        serializer = IssueSerializer(data=item)
+        if serializer.is_valid():
+            issues.append(Issue(project=project, **serializer.validated_data))
+        else:
+            errors.append({'index': index, 'errors': serializer.errors})
+
+    if errors and atomic:
+        return [], errors
+
+    actor = get_current_user()
+    with transaction.atomic(), audit.batch():
+        created = Issue.objects.bulk_create(issues, batch_size=BATCH_SIZE)
+        summary.issues_created(created)
+        sync.record_many('issue', [(issue.pk, *sync.issue_scope(issue)) for issue in created])
+        events.publish(*[events.issue_event(issue, 'created') for issue in created])
+        response_cache.changed('issue')
+        for issue in created:
+            notifications.notify(issue, 'created', f'"{issue.issue_title}" was reported', actor=actor)
+            audit.record(issue, created=True)
+            issue.snapshot()
+
+    return created, errors
+
+
+def is_id(value):
+    # JSON true / false are ints to Python, but not issue ids
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def update_issues(project, items, atomic=False):
+    """
+    Apply ``[{'id': ..., 'status' / 'priority' / 'due_date': ...}]`` to issues of
+    ``project``. Returns ``(updated_issues, errors)``.
+    """
+    ids = [item['id'] for item in items if isinstance(item, dict) and is_id(item.get('id'))]
+    instances = Issue.objects.select_related('project').filter(project=project, id__in=ids).in_bulk()
+
+    updated, errors = [], []
+    changed_fields = set()
+
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or 'id' not in item:
+            errors.append({'index': index, 'errors': {'id': ['This field is required.']}})
+            continue
+        if not is_id(item['id']):
+            errors.append({'index': index, 'errors': {'id': ['A valid integer is required.']}})
+            continue
+
+        issue = instances.get(item['id'])
+        if issue is None:
+            errors.append({'index': index, 'errors': {'id': ['Issue not found in this project.']}})
+            continue
+
+        changes = {key: value for key, value in item.items() if key != 'id'}
+        not_allowed = sorted(set(changes) - set(BULK_UPDATE_FIELDS))
+        if not_allowed:
+            errors.append({'index': index, 'errors': {
+                field: ['This field cannot be changed in bulk.'] for field in not_allowed
+            }})
+            continue
+
+        serializer = IssueSerializer(issue, data=changes, partial=True)
+        if not serializer.is_valid():
+            errors.append({'index': index, 'errors': serializer.errors})
+            continue
+
+        for field, value in serializer.validated_data.items():
+            setattr(issue, field, value)
+            changed_fields.add(field)
+        updated.append(issue)
+
+    if errors and atomic:
+        return [], errors
+
+    if updated:
+        # bulk_update doesn't apply auto_now
+        now = timezone.now()
+        for issue in updated:
+            issue.updated_at = now
+        actor = get_current_user()
+        with transaction.atomic(), audit.batch():
+            Issue.objects.bulk_update(updated, sorted(changed_fields) + ['updated_at'], batch_size=BATCH_SIZE)
+            summary.issues_updated(updated)
+            sync.record_many('issue', [change for issue in updated for change in sync.issue_changes(issue)])
+            events.publish(*[events.issue_event(issue, 'updated') for issue in updated])
+            response_cache.changed('issue')
+            for issue in updated:
+                if issue.previous_value('status') != issue.status:
+                    notifications.notify(
+                        issue, 'status_changed',
+                        f'"{issue.issue_title}" moved from {issue.previous_value("status")} to {issue.status}',
+                        actor=actor
+                    )
+                audit.record(issue)
+                issue.snapshot()
+
+    return updated, errors
@@ -0,0 +1,148 @@
+"""
+Thumbnails and previews of image attachments.
+
+When an image is uploaded its derivatives (SIZES) are rendered by a pool of
+worker processes once the upload commits, so neither the request nor the
+server's threads spend CPU on resizing. They are cached on disk under
+DERIVATIVE_DIR, named after the sha256 of the original's content (the
+attachment's ``sha256``, see core.storage), so the same photo uploaded
+twice is only rendered once.
+
+``GET /api/attachments/<id>/derivatives/<size>/`` serves them. A size that
+isn't there yet (older attachments, a cleared cache) is rendered on that
+first request, by the pool, waiting at most DERIVATIVE_WAIT_SECONDS.
+
+With DERIVATIVE_WORKERS = 0 there is no pool and rendering happens in the
+calling thread (used by the tests).
+"""
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.db import connection
+
+from . import imaging
+from .models import Attachment
+
+logger = logging.getLogger(__name__)
+
+# name -> longest side in pixels
+SIZES = {
+    'thumb': 320,
+    'preview': 1280,
+}
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff')
+
+
+class NotReady(Exception):
+    """Rendering took longer than DERIVATIVE_WAIT_SECONDS (it carries on in the pool)."""
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def has_derivatives(attachment):
+    # The stored file is named after its content, the uploaded name has the extension
+    return os.path.splitext(attachment.file_name or attachment.file.name or '')[1].lower() in IMAGE_EXTENSIONS
+
+
+def pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned, not forked: the workers only need core.imaging, not
+            # copies of this process's threads and connections
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.DERIVATIVE_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pool
+
+
+def source_of(attachment):
+    """A path the worker can open, or the file's bytes for storages that aren't local."""
+    try:
+        return attachment.file.path
+    except NotImplementedError:
+        with attachment.file.open('rb') as original:
+            return original.read()
+
+
+def reset_pool():
+    # A worker died (e.g. killed for memory), the next job starts a new pool
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def submit(attachment):
+    """Future for rendering whatever sizes of ``attachment`` are missing; its result is the sha256."""
+    args = (imaging.render, source_of(attachment), settings.DERIVATIVE_DIR, SIZES)
+    try:
+        return pool().submit(*args)
+    except BrokenProcessPool:
+        reset_pool()
+        return pool().submit(*args)
+
+
+def save_digest(attachment_id, digest):
+    Attachment.objects.filter(pk=attachment_id).update(sha256=digest)
+
+
+def rendered(attachment_id, future):
+    """Done callback of schedule(), runs on the pool's management thread."""
+    try:
+        save_digest(attachment_id, future.result())
+    except BrokenProcessPool:
+        reset_pool()
+    except Exception:
+        logger.exception('Could not render derivatives of attachment %s', attachment_id)
+    finally:
+        connection.close()
+
+
+def schedule(attachment):
+    """Render ``attachment``'s derivatives in the background (after an upload)."""
+    if not has_derivatives(attachment):
+        return
+    if not settings.DERIVATIVE_WORKERS:
+        try:
+            save_digest(attachment.pk, imaging.render(source_of(attachment), settings.DERIVATIVE_DIR, SIZES))
+        except Exception:
+            logger.exception('Could not render derivatives of attachment %s', attachment.pk)
+        return
+    submit(attachment).add_done_callback(functools.partial(rendered, attachment.pk))
+
+
+def get(attachment, name):
+    """
+    Path of derivative ``name`` of ``attachment``, rendering it first if it
+    is missing. Raises NotReady if that takes too long, and the Pillow
+    error if the file isn't a readable image.
+    """
+    if attachment.sha256:
+        path = imaging.derivative_path(settings.DERIVATIVE_DIR, attachment.sha256, name)
+        if path.exists():
+            return path
+
+    if settings.DERIVATIVE_WORKERS:
+        try:
+            digest = submit(attachment).result(timeout=settings.DERIVATIVE_WAIT_SECONDS)
+        except FutureTimeout:
+            raise NotReady()
+        except BrokenProcessPool:
+            reset_pool()
+            raise NotReady()
+    else:
+        digest = imaging.render(source_of(attachment), settings.DERIVATIVE_DIR, SIZES)
+    if digest != attachment.sha256:
+        attachment.sha256 = digest
+        save_digest(attachment.pk, digest)
+    return imaging.derivative_path(settings.DERIVATIVE_DIR, digest, name)
@@ -0,0 +1,167 @@
+"""
+Attachment downloads.
+
+``GET /api/attachments/<id>/download/`` checks the user can see the
+attachment's issue (core.visibility) and sends the file.
+AttachmentSerializer also hands out ``download_url``: a signed URL,
+``/api/files/<token>/``, that works without authentication until it
+expires (DOWNLOAD_URL_SECONDS). The token carries everything needed to
+send the file, so repeat downloads cost no database query at all.
+
+The bytes themselves are sent by, depending on DOWNLOAD_OFFLOAD:
+
+- ``'nginx'``: an ``X-Accel-Redirect`` to DOWNLOAD_ACCEL_PREFIX + the file's
+  name; nginx serves it (ranges included) from an internal location, e.g.
+
+      location /protected/ { internal; alias /app/media/; }
+
+- ``'sendfile'``: an ``X-Sendfile`` header with the file's path (Apache
+  mod_xsendfile, lighttpd)
+- ``''`` (default): Django. A whole file goes out through the server's
+  file wrapper (sendfile(2) under a WSGI server); a single ``Range`` is
+  answered with 206 and just those bytes, so interrupted downloads of
+  large drawings resume where they stopped.
+"""
+import math
+import mimetypes
+import os
+import time
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import content_disposition_header
+
+SALT = 'core.downloads'
+# Signed URLs are minted for the next full minute, so the same URL (and the
+# client's cached copy of it) is reused for a minute
+EXPIRY_STEP = 60
+BLOCK_SIZE = 256 * 1024
+
+
+class Unsatisfiable(Exception):
+    pass
+
+
+# Signed URLs
+
+def signed_token(attachment):
+    expires = math.ceil((time.time() + settings.DOWNLOAD_URL_SECONDS) / EXPIRY_STEP) * EXPIRY_STEP
+    return signing.Signer(salt=SALT).sign_object({
+        'n': attachment.file.name, 'f': attachment.file_name, 't': attachment.content_type,
+        'h': attachment.sha256, 'e': expires,
+    }, compress=True)
+
+
+def signed_url(attachment, request=None):
+    url = reverse('signed-download', args=[signed_token(attachment)])
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def read_token(token):
+    """
+    ``(stored name, file name, content type, sha256, expires)`` from a signed
+    token, None if it is forged or expired.
+    """
+    try:
+        payload = signing.Signer(salt=SALT).unsign_object(token)
+    except signing.BadSignature:
+        return None
+    if payload['e'] < time.time():
+        return None
+    return payload['n'], payload['f'], payload['t'], payload['h'], payload['e']
+
+
+# Sending
+
+def parse_range(header, size):
+    """
+    ``(first, last)`` byte of a single ``bytes=`` range, None to send the
+    whole file (no range, several ranges, or one we don't understand).
+    Raises Unsatisfiable if the range starts past the end of the file.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, dash, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if not dash:
+            return None
+        if not first:
+            # bytes=-500: the last 500 bytes
+            length = int(last)
+            if length <= 0:
+                raise Unsatisfiable()
+            return max(size - length, 0), size - 1
+        first = int(first)
+        last = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if first >= size or first > last:
+        raise Unsatisfiable()
+    return first, last
+
+
+def read_range(opened, first, length):
+    try:
+        opened.seek(first)
+        while length > 0:
+            block = opened.read(min(BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        opened.close()
+
+
+def send(request, name, filename='', content_type='', sha256='', max_age=0):
+    """Response sending the stored file ``name`` as a download called ``filename``."""
+    filename = filename or os.path.basename(name)
+    content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    etag = f'"{sha256}"' if sha256 else None
+
+    if etag and request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+    elif settings.DOWNLOAD_OFFLOAD == 'nginx':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.DOWNLOAD_ACCEL_PREFIX + quote(name)
+    elif settings.DOWNLOAD_OFFLOAD == 'sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = default_storage.path(name)
+    else:
+        response = send_from_storage(request, name, content_type, etag)
+
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Cache-Control'] = f'private, max-age={max_age}'
+    if etag:
+        response['ETag'] = etag
+    return response
+
+
+def send_from_storage(request, name, content_type, etag):
+    size = default_storage.size(name)
+    if_range = request.headers.get('If-Range')
+    try:
+        # If-Range: only resume if the file is still the one the client has part of
+        byte_range = parse_range(request.headers.get('Range'), size) if not if_range or if_range == etag else None
+    except Unsatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    opened = default_storage.open(name, 'rb')
+    if byte_range is None:
+        response = FileResponse(opened, content_type=content_type)
+        response.block_size = BLOCK_SIZE
+    else:
+        first, last = byte_range
+        response = StreamingHttpResponse(
+            read_range(opened, first, last - first + 1), status=206, content_type=content_type
+        )
+        response['Content-Length'] = last - first + 1
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,261 @@
+"""
+Live issue, comment and attachment events for connected clients.
+
+Saves and deletes publish an event once their transaction commits (from
+core.signals, and from core.bulk / core.importer for the paths that send no
+signals). ``GET /api/async/events/`` (core.async_views) keeps a Server-Sent
+Events stream open and writes out every event the user may see under the
+same rules as IssueViewSet.get_queryset, so clients no longer need to poll
+the issue and comment lists.
+
+Events only say what changed: ``{"type", "action", "id", "issue",
+"project"}``. Clients fetch what they need, or catch up through /api/sync/
+when they (re)connect and whenever a ``resync`` event arrives (the stream
+fell too far behind, or the broker lost events).
+
+The broker is picked by EVENTS_BACKEND:
+
+- LocalBroker: events stay in the process that published them. For tests,
+  runserver and single-worker deployments.
+- PostgresBroker: events go through LISTEN / NOTIFY, so every worker of
+  every container on the same database gets all of them. One listening
+  connection per process, started with the first stream.
+
+Any class with ``publish(event)`` and ``subscribe()`` will do.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+from . import trades
+from .models import Issue
+
+logger = logging.getLogger(__name__)
+
+# Events a slow stream may have waiting before it is told to resync instead
+QUEUE_SIZE = 1000
+HEARTBEAT_SECONDS = 15
+RETRY_MS = 5000
+
+RESYNC = {'type': 'resync'}
+
+# What clients get, the rest of an event is for scoping
+PUBLIC_FIELDS = ('type', 'action', 'id', 'issue', 'project')
+
+
+class Subscription:
+    """One open stream's queue. ``put()`` may be called from any thread."""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+
+    def put(self, event):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        if self.queue.full():
+            # Whatever is waiting is stale, the client catches up through /api/sync/
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = RESYNC
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        self.deliver(event)
+
+    def deliver(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.put(event)
+            except RuntimeError:
+                # Its event loop is closed
+                self.unsubscribe(subscription)
+
+    def subscribe(self):
+        subscription = Subscription(self)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+
+class PostgresBroker(LocalBroker):
+    channel = 'siteflow_events'
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+
+    def publish(self, event):
+        # Comes back to this process through the listener like everyone else's
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, json.dumps(event)])
+
+    def subscribe(self):
+        subscription = super().subscribe()
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='event-listener', daemon=True)
+                self._listener.start()
+        return subscription
+
+    def _listen(self):
+        reconnecting = False
+        while True:
+            try:
+                raw = connection.get_new_connection(connection.get_connection_params())
+                raw.autocommit = True
+                raw.cursor().execute(f'LISTEN {self.channel}')
+                if reconnecting:
+                    # Whatever was published while disconnected is lost
+                    self.deliver(RESYNC)
+                if hasattr(raw, 'poll'):  # psycopg2
+                    while True:
+                        if select.select([raw], [], [], HEARTBEAT_SECONDS) != ([], [], []):
+                            raw.poll()
+                            while raw.notifies:
+                                self.deliver(json.loads(raw.notifies.pop(0).payload))
+                else:  # psycopg 3
+                    for notify in raw.notifies():
+                        self.deliver(json.loads(notify.payload))
+            except Exception:
+                logger.exception('Event listener lost its database connection, reconnecting')
+                reconnecting = True
+                time.sleep(1)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            path = settings.EVENTS_BACKEND
+            if not path:
+                path = 'core.events.PostgresBroker' if connection.vendor == 'postgresql' else 'core.events.LocalBroker'
+            _broker = import_string(path)()
+        return _broker
+
+
+# Publishing
+
+def publish(*events):
+    """Send these events once the current transaction commits."""
+    def send():
+        for event in events:
+            try:
+                broker().publish(event)
+            except Exception:
+                # Clients resync on reconnect, a lost event must not fail the write
+                logger.exception('Could not publish %s event', event.get('type'))
+    if events:
+        transaction.on_commit(send)
+
+
+def issue_event(issue, action):
+    """
+    Event for a saved or deleted issue. It is scoped by the issue's values
+    before and after the change, so users who can no longer see it hear
+    about it too.
+    """
+    scopes = [(issue.project_id, issue.trade_id, issue.priority)]
+    if action == 'updated':
+        before = (
+            issue.previous_value('project_id'), issue.previous_value('trade_id'), issue.previous_value('priority')
+        )
+        if None not in before and before != scopes[0]:
+            scopes.append(before)
+    return {
+        'type': 'issue', 'action': action, 'id': issue.pk, 'issue': issue.pk,
+        'project': issue.project_id, 'scopes': scopes,
+    }
+
+
+def issue_content_event(kind, instance, action):
+    """Event for a comment or attachment, scoped like its issue. None if the issue is gone."""
+    if type(instance).issue.is_cached(instance):
+        issue = instance.issue
+        values = (issue.project_id, issue.trade_id, issue.priority)
+    else:
+        values = Issue.objects.filter(pk=instance.issue_id).values_list('project_id', 'trade_id', 'priority').first()
+        if values is None:
+            return None
+    return {
+        'type': kind, 'action': action, 'id': instance.pk, 'issue': instance.issue_id,
+        'project': values[0], 'scopes': [values],
+    }
+
+
+def project_event(project_id, action):
+    """Event for everyone who can open the project (e.g. a batch of issues was imported)."""
+    return {'type': 'project', 'action': action, 'id': project_id, 'issue': None, 'project': project_id}
+
+
+# Streaming
+
+def can_see(scope, event, trade_names):
+    if event.get('scopes') is None:
+        return scope.see_all or event['project'] in scope.assigned_project_ids
+    return any(
+        scope.can_see(project_id, trade_names.get(trade_id), priority)
+        for project_id, trade_id, priority in event['scopes']
+    )
+
+
+def message(event):
+    if event['type'] == 'resync':
+        return 'event: resync\ndata: {}\n\n'
+    data = json.dumps({name: event[name] for name in PUBLIC_FIELDS})
+    return f'event: {event["type"]}\ndata: {data}\n\n'
+
+
+async def stream(scope):
+    """
+    Server-Sent Events for one user, until EVENTS_STREAM_SECONDS are up (the
+    client reconnects, and so is authenticated and scoped again).
+    """
+    # Scoping events by trade name needs no query each (core.trades)
+    trade_names = await sync_to_async(trades.names)()
+    subscription = broker().subscribe()
+    deadline = time.monotonic() + settings.EVENTS_STREAM_SECONDS
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                event = await asyncio.wait_for(subscription.get(), min(HEARTBEAT_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if event['type'] == 'resync' or can_see(scope, event, trade_names):
+                yield message(event)
+    finally:
+        subscription.close()
@@ -0,0 +1,173 @@
+"""
+Streaming exports of issues, comments and issue history as CSV or NDJSON.
+
+Rows are read as plain tuples (no model instances, no serializers) with
+``QuerySet.iterator()``, which on PostgreSQL is a server-side cursor, and
+written out a chunk at a time through a StreamingHttpResponse. Nothing holds
+more than CHUNK_SIZE rows, so memory stays flat whatever the size of
+the export.
+
+Under ASGI the response gets an async iterator that fetches each chunk in
+a thread: given a synchronous one Django would read the whole export into
+a list before sending any of it.
+"""
+import csv
+import datetime
+import io
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.negotiation import BaseContentNegotiation
+
+from .models import Comment, Issue, IssueHistory
+
+CHUNK_SIZE = 2000
+# Rows per write to the client
+ROWS_PER_WRITE = 500
+
+# resource -> (model, [(column header, field lookup)])
+RESOURCES = {
+    'issues': (Issue, [
+        ('id', 'id'),
+        ('project_id', 'project_id'),
+        ('project', 'project__project_name'),
+        ('trade', 'trade__name'),
+        ('issue_title', 'issue_title'),
+        ('detailed_description', 'detailed_description'),
+        ('priority', 'priority'),
+        ('status', 'status'),
+        ('due_date', 'due_date'),
+        ('assigned_to', 'assigned_to__email'),
+        ('created_at', 'created_at'),
+        ('updated_at', 'updated_at'),
+    ]),
+    'comments': (Comment, [
+        ('id', 'id'),
+        ('issue_id', 'issue_id'),
+        ('project_id', 'issue__project_id'),
+        ('user', 'user__email'),
+        ('content', 'content'),
+        ('timestamp', 'timestamp'),
+    ]),
+    'history': (IssueHistory, [
+        ('id', 'id'),
+        ('issue_id', 'issue_id'),
+        ('project_id', 'project_id'),
+        ('user', 'user__email'),
+        ('action', 'action'),
+        ('old_value', 'old_value'),
+        ('new_value', 'new_value'),
+        ('timestamp', 'timestamp'),
+    ]),
+}
+
+OUTPUTS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+# Spreadsheets run cells starting with these as formulas
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """The export format comes from ?output=, whatever the Accept header says (errors are JSON)."""
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class CSVFormat:
+    def __init__(self, headers):
+        self.headers = headers
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def header(self):
+        return self.line(self.headers, escape=False)
+
+    def line(self, row, escape=True):
+        self.writer.writerow([self.cell(value) if escape else value for value in row])
+        text = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return text
+
+    def cell(self, value):
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            return value.isoformat()
+        if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+            return "'" + value
+        return value
+
+
+class NDJSONFormat:
+    def __init__(self, headers):
+        self.headers = headers
+
+    def header(self):
+        return ''
+
+    def line(self, row):
+        return json.dumps(dict(zip(self.headers, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+FORMATS = {'csv': CSVFormat, 'ndjson': NDJSONFormat}
+
+
+def export_queryset(resource, queryset):
+    """``queryset`` reduced to the export columns as tuples, in primary key order."""
+    columns = RESOURCES[resource][1]
+    return queryset.order_by('pk').values_list(*[lookup for header, lookup in columns])
+
+
+def stream(rows, output_format):
+    lines = [output_format.header()]
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        lines.append(output_format.line(row))
+        if len(lines) >= ROWS_PER_WRITE:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+async def astream(rows, output_format):
+    # QuerySet.aiterator() runs values_list() queries in the event loop, so
+    # take the chunks from the sync iterator in a thread (always the same
+    # one, it holds the cursor)
+    iterator = rows.iterator(chunk_size=CHUNK_SIZE)
+    next_chunk = sync_to_async(lambda: list(islice(iterator, CHUNK_SIZE)))
+    lines = [output_format.header()]
+    while chunk := await next_chunk():
+        lines += [output_format.line(row) for row in chunk]
+        yield ''.join(lines)
+        lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def export_response(request, resource, queryset, output):
+    """StreamingHttpResponse with ``queryset`` exported as ``output`` ('csv' or 'ndjson')."""
+    columns = RESOURCES[resource][1]
+    rows = export_queryset(resource, queryset)
+    output_format = FORMATS[output]([header for header, lookup in columns])
+
+    django_request = getattr(request, '_request', request)
+    if isinstance(django_request, ASGIRequest):
+        content = astream(rows, output_format)
+    else:
+        content = stream(rows, output_format)
+
+    response = StreamingHttpResponse(content, content_type=OUTPUTS[output])
+    filename = f'{resource}-{timezone.localdate():%Y%m%d}.{output}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
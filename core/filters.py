@@ -1,19 +1,40 @@
 import django_filters
-from django.db.models import Q
+from datetime import timedelta
+from django import forms
+from django.utils import timezone
+from . import trades
 from .models import Comment, Issue 
+from .search import search
+
+class TradeChoiceField(forms.Field):
+    """A trade's id or name, looked up in core.trades instead of the database."""
+    default_error_messages = {
+        'invalid_choice': 'Select a valid choice. That choice is not one of the available choices.',
+    }
+    
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        trade = trades.get(value)
+        if trade is None:
+            raise forms.ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+        return trade
+
+class TradeFilter(django_filters.Filter):
+    field_class = TradeChoiceField
 
 class IssueFilter(django_filters.FilterSet):
     search = django_filters.CharFilter(method='filter_search')
+    # ?trade=3 or ?trade=ELECTRICAL
+    trade = TradeFilter()
     
     class Meta:
         model = Issue
         fields = ['trade', 'priority', 'status']
     
     def filter_search(self, queryset, name, value):
-        return queryset.filter(
-            Q(issue_title__icontains=value) | 
-            Q(detailed_description__icontains=value)
-        )
+        # Full-text index on title + description, ranked best match first
+        return search(queryset, value)
         
 class CommentFilter(django_filters.FilterSet):
     search = django_filters.CharFilter(method='filter_search')
@@ -35,36 +56,37 @@ class CommentFilter(django_filters.FilterSet):
     
     # 👇 CUSTOM SEARCH METHOD - HOW TO SEARCH COMMENT TEXT
     def filter_search(self, queryset, name, value):
-        return queryset.filter(
-            Q(content__icontains=value)  # Search in comment content
-        )
+        return search(queryset, value)  # Full-text search in comment content
         # What it does: When you search "safety", it finds comments containing "safety"
+        # (or "safe*" for anything starting with safe, "\"safety rail\"" for the phrase)
     
     #  CUSTOM DATE FILTERING METHOD
+    # Compares timestamp against day boundaries instead of using
+    # timestamp__date, which casts every row and can't use the index
     def filter_date(self, queryset, name, value):
-        today = timezone.now().date()  # Get today's date
+        start_of_today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
         
         #  FILTER FOR TODAY'S COMMENTS
         if value == 'today':
-            return queryset.filter(timestamp__date=today)
+            return queryset.filter(timestamp__gte=start_of_today)
             # What it does: Show only comments from today
         
         #  FILTER FOR YESTERDAY'S COMMENTS  
         elif value == 'yesterday':
-            yesterday = today - timedelta(days=1)
-            return queryset.filter(timestamp__date=yesterday)
+            yesterday = start_of_today - timedelta(days=1)
+            return queryset.filter(timestamp__gte=yesterday, timestamp__lt=start_of_today)
             # What it does: Show only comments from yesterday
         
         #  FILTER FOR LAST WEEK'S COMMENTS
         elif value == 'week':
-            week_ago = today - timedelta(days=7)
-            return queryset.filter(timestamp__date__gte=week_ago)
+            week_ago = start_of_today - timedelta(days=7)
+            return queryset.filter(timestamp__gte=week_ago)
             # What it does: Show comments from last 7 days
         
         # FILTER FOR LAST MONTH'S COMMENTS
         elif value == 'month':
-            month_ago = today - timedelta(days=30)
-            return queryset.filter(timestamp__date__gte=month_ago)
+            month_ago = start_of_today - timedelta(days=30)
+            return queryset.filter(timestamp__gte=month_ago)
             # What it does: Show comments from last 30 days
         
-        return queryset  # If no date filter, return all comments
\ No newline at end of file
+        return queryset  # If no date filter, return all comments
@@ -0,0 +1,58 @@
+"""
+Image resizing for attachment derivatives (see core.derivatives).
+
+Runs in the derivative process pool, so it only depends on Pillow and
+never touches Django: it gets a file (path or bytes) and a directory, and
+writes JPEGs named after the sha256 of the file's content.
+"""
+import hashlib
+import io
+import os
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+QUALITY = 80
+
+
+def derivative_path(directory, digest, name):
+    return Path(directory) / digest[:2] / f'{digest}-{name}.jpg'
+
+
+def render(source, directory, sizes):
+    """
+    Write the ``{name: longest side in px}`` sizes of the image in ``source``
+    that aren't in ``directory`` yet. Returns the sha256 of the source.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as original:
+            source = original.read()
+    digest = hashlib.sha256(source).hexdigest()
+
+    missing = {name: side for name, side in sizes.items() if not derivative_path(directory, digest, name).exists()}
+    if not missing:
+        return digest
+
+    with Image.open(io.BytesIO(source)) as image:
+        # JPEGs decode straight at (about) the largest size needed, much faster than full size
+        largest = max(missing.values())
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        # Largest first, each smaller size is scaled down from the one before
+        for name, side in sorted(missing.items(), key=lambda item: -item[1]):
+            image.thumbnail((side, side), Image.LANCZOS)
+            path = derivative_path(directory, digest, name)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            partial = path.with_suffix(f'.{os.getpid()}.part')
+            image.save(partial, 'JPEG', quality=QUALITY, optimize=True, progressive=True)
+            os.replace(partial, path)
+
+    return digest
@@ -0,0 +1,386 @@
+"""
+Bulk import of issues from CSV.
+
+Used by the import_issues command and ``POST /api/import/issues/``. Rows
+are read a batch at a time, the projects and assignees a batch refers to
+are looked up with one query each (trades come from core.trades), and every row
+is checked against the same rules as IssueSerializer without going through
+a serializer. Valid rows are loaded:
+
+- on PostgreSQL with ``COPY`` into a temporary staging table, then moved
+  into core_issue with a single INSERT ... SELECT that also writes the
+  issues' "created" history rows and sync feed entries
+- elsewhere with bulk_create, BATCH_SIZE rows per INSERT
+
+Invalid rows are skipped and written to an error file (the original row
+plus its line number and what was wrong with it), or with ``atomic`` the
+whole import is rolled back if any row is invalid. Afterwards the project
+summary of every project touched is rebuilt, cached issue responses are
+invalidated and connected clients get one event per project (core.events).
+Imports don't send notifications.
+
+Through the API the error file is kept in storage under ``imports/`` and
+handed out as a signed URL only the importing user can open, for
+IMPORT_ERROR_FILE_SECONDS; files older than that are deleted.
+"""
+import csv
+import datetime
+import io
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from . import audit, events, response_cache, summary, sync, trades
+from .models import Issue, Project
+
+User = get_user_model()
+
+BATCH_SIZE = 5000
+
+ERROR_FILE_DIR = 'imports'
+ERROR_FILE_SALT = 'core.importer.errors'
+
+FIELDS = ('project', 'trade', 'issue_title', 'detailed_description', 'priority', 'status', 'due_date', 'assigned_to')
+REQUIRED = ('trade', 'issue_title', 'detailed_description', 'priority', 'due_date')
+
+# Other column headers understood without a mapping (the export's are understood as they are)
+ALIASES = {
+    'project_id': 'project',
+    'title': 'issue_title',
+    'description': 'detailed_description',
+    'assignee': 'assigned_to',
+    'assigned_to_email': 'assigned_to',
+    'due': 'due_date',
+}
+
+PRIORITIES = {value for value, label in Issue.PRIORITY_STATUS}
+STATUSES = {value for value, label in Issue.STATUS_CHOICES}
+TITLE_LENGTH = Issue._meta.get_field('issue_title').max_length
+
+STAGING_COLUMNS = (
+    'line', 'project_id', 'trade_id', 'issue_title', 'detailed_description',
+    'priority', 'status', 'due_date', 'assigned_to_id',
+)
+
+
+class ImportFileError(Exception):
+    """The file can't be imported at all (as opposed to some of its rows)."""
+
+
+@dataclass
+class ImportResult:
+    total: int = 0
+    imported: int = 0
+    errors: int = 0
+    project_ids: set = field(default_factory=set)
+    duration: float = 0.0
+    rolled_back: bool = False
+
+    def as_dict(self):
+        return {
+            'total': self.total,
+            'imported': self.imported,
+            'errors': self.errors,
+            'projects': sorted(self.project_ids),
+            'duration_s': round(self.duration, 3),
+            'rolled_back': self.rolled_back,
+        }
+
+
+class Rollback(Exception):
+    pass
+
+
+class IssueImporter:
+    """
+    ``projects`` limits the projects rows may go into (a Project queryset,
+    e.g. the user's visible ones), ``default_project`` is used for rows
+    with no project column. ``mapping`` maps column headers to FIELDS.
+    ``progress(result)`` is called after every batch.
+    """
+
+    def __init__(self, projects=None, default_project=None, mapping=None, actor=None,
+                 allow_past_due=False, atomic=False, batch_size=BATCH_SIZE, progress=None):
+        self.projects = projects if projects is not None else Project.objects.all()
+        self.default_project = default_project
+        self.mapping = mapping or {}
+        self.actor = actor
+        self.allow_past_due = allow_past_due
+        self.atomic = atomic
+        self.batch_size = batch_size
+        self.progress = progress
+        self.use_copy = connection.vendor == 'postgresql'
+
+    def run(self, text_file, error_file=None):
+        """Import the CSV in ``text_file``. Failed rows are written to ``error_file`` if given."""
+        started = time.perf_counter()
+        reader = csv.DictReader(text_file)
+        columns = self.columns(reader.fieldnames)
+        error_writer = None
+        if error_file is not None:
+            error_writer = csv.writer(error_file)
+            error_writer.writerow(['line', 'errors', *reader.fieldnames])
+
+        self.trades = {}
+        for trade in trades.all():
+            self.trades[trade.name.upper()] = trade.id
+            self.trades[str(trade.id)] = trade.id
+        self.today = timezone.localdate()
+
+        result = ImportResult()
+        try:
+            with transaction.atomic():
+                if self.use_copy:
+                    self.create_staging()
+                batch = []
+                # Line 1 is the header
+                for line, row in enumerate(reader, start=2):
+                    batch.append((line, row))
+                    if len(batch) >= self.batch_size:
+                        self.load_batch(batch, columns, result, error_writer)
+                        batch = []
+                if batch:
+                    self.load_batch(batch, columns, result, error_writer)
+
+                if result.errors and self.atomic:
+                    raise Rollback()
+                if self.use_copy:
+                    result.imported = self.insert_from_staging()
+
+                summary.rebuild(sorted(result.project_ids))
+                response_cache.changed('issue')
+                # One event per project rather than one per row
+                events.publish(*[events.project_event(project_id, 'imported') for project_id in sorted(result.project_ids)])
+        except Rollback:
+            result.imported = 0
+            result.rolled_back = True
+
+        result.duration = time.perf_counter() - started
+        return result
+
+    def columns(self, headers):
+        """{header: field} for the headers that are imported."""
+        if not headers:
+            raise ImportFileError('The file is empty')
+        columns = {}
+        for header in headers:
+            name = self.mapping.get(header) or ALIASES.get(header.strip().lower()) or header.strip().lower()
+            if name in FIELDS:
+                columns[header] = name
+        missing = [name for name in REQUIRED if name not in columns.values()]
+        if 'project' not in columns.values() and self.default_project is None:
+            missing.insert(0, 'project')
+        if missing:
+            raise ImportFileError(f'Missing column(s): {", ".join(missing)}')
+        return columns
+
+    def load_batch(self, batch, columns, result, error_writer):
+        rows = [(line, {name: (raw.get(header) or '').strip() for header, name in columns.items()}, raw)
+                for line, raw in batch]
+
+        # Everything the batch refers to, one query each
+        project_ids = {self.as_int(values.get('project')) for line, values, raw in rows} - {None}
+        if self.default_project is not None:
+            project_ids.add(self.default_project.id)
+        projects = set(self.projects.filter(id__in=project_ids).values_list('id', flat=True))
+        emails = {values['assigned_to'] for line, values, raw in rows if values.get('assigned_to')}
+        users = {
+            email.lower(): user_id
+            for email, user_id in User.objects.filter(
+                email__in=emails | {email.lower() for email in emails}
+            ).values_list('email', 'id')
+        } if emails else {}
+
+        valid = []
+        for line, values, raw in rows:
+            issue, errors = self.validate(values, projects, users)
+            if errors:
+                result.errors += 1
+                if error_writer is not None:
+                    error_writer.writerow([line, '; '.join(errors), *raw.values()])
+            else:
+                valid.append((line, issue))
+                result.project_ids.add(issue['project_id'])
+        result.total += len(rows)
+
+        if valid:
+            if self.use_copy:
+                self.copy_to_staging(valid)
+            else:
+                result.imported += self.bulk_insert(valid)
+        if self.progress is not None:
+            self.progress(result)
+
+    def as_int(self, value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def validate(self, values, projects, users):
+        """(issue field values, []) or (None, [error messages]) for one row."""
+        errors = []
+        for name in REQUIRED:
+            if not values.get(name):
+                errors.append(f'{name}: This field is required.')
+        if errors:
+            return None, errors
+
+        if values.get('project'):
+            project_id = self.as_int(values['project'])
+            if project_id not in projects:
+                errors.append(f'project: Project "{values["project"]}" not found.')
+        else:
+            project_id = self.default_project.id if self.default_project is not None else None
+            if project_id not in projects:
+                errors.append('project: This field is required.')
+
+        trade_id = self.trades.get(values['trade'].upper())
+        if trade_id is None:
+            errors.append(f'trade: Trade "{values["trade"]}" not found.')
+
+        if len(values['issue_title']) > TITLE_LENGTH:
+            errors.append(f'issue_title: Ensure this field has no more than {TITLE_LENGTH} characters.')
+
+        priority = values['priority'].upper()
+        if priority not in PRIORITIES:
+            errors.append(f'priority: "{values["priority"]}" is not a valid choice.')
+
+        status = (values.get('status') or 'OPEN').upper().replace(' ', '_')
+        if status not in STATUSES:
+            errors.append(f'status: "{values["status"]}" is not a valid choice.')
+
+        try:
+            due_date = datetime.date.fromisoformat(values['due_date'])
+        except ValueError:
+            due_date = None
+            errors.append('due_date: Date has wrong format. Use YYYY-MM-DD.')
+        if due_date is not None and due_date < self.today and not self.allow_past_due:
+            errors.append('due_date: Due date cannot be in the past')
+
+        assigned_to_id = None
+        if values.get('assigned_to'):
+            assigned_to_id = users.get(values['assigned_to'].lower())
+            if assigned_to_id is None:
+                errors.append(f'assigned_to: No user with email "{values["assigned_to"]}".')
+
+        if errors:
+            return None, errors
+        return {
+            'project_id': project_id,
+            'trade_id': trade_id,
+            'issue_title': values['issue_title'],
+            'detailed_description': values['detailed_description'],
+            'priority': priority,
+            'status': status,
+            'due_date': due_date,
+            'assigned_to_id': assigned_to_id,
+        }, []
+
+    def bulk_insert(self, valid):
+        with audit.batch():
+            created = Issue.objects.bulk_create([Issue(**issue) for line, issue in valid], batch_size=BATCH_SIZE)
+            for issue in created:
+                audit.record(issue, created=True, actor=self.actor)
+        sync.record_many('issue', [(issue.pk, *sync.issue_scope(issue)) for issue in created])
+        return len(created)
+
+    # PostgreSQL
+
+    def create_staging(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE issue_import ('
+                ' line integer, project_id integer, trade_id integer, issue_title varchar(100),'
+                ' detailed_description text, priority varchar(100), status varchar(50), due_date date,'
+                ' assigned_to_id integer'
+                ') ON COMMIT DROP'
+            )
+
+    def copy_to_staging(self, valid):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for line, issue in valid:
+            writer.writerow([line, *(issue[column] for column in STAGING_COLUMNS[1:])])
+        buffer.seek(0)
+        sql = f'COPY issue_import ({", ".join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)'
+        with connection.cursor() as cursor:
+            raw = cursor.cursor
+            if hasattr(raw, 'copy_expert'):  # psycopg2
+                raw.copy_expert(sql, buffer)
+            else:  # psycopg 3
+                with raw.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
+
+    def insert_from_staging(self):
+        """
+        Move the staged rows into core_issue, with their "created" history
+        rows and sync feed entries. Returns the count.
+        """
+        columns = ', '.join(STAGING_COLUMNS[1:])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'WITH inserted AS ('
+                f' INSERT INTO core_issue ({columns}, created_at, updated_at)'
+                f' SELECT {columns}, now(), now() FROM issue_import ORDER BY line'
+                f' RETURNING id, project_id, status, trade_id, priority'
+                f'), history AS ('
+                f' INSERT INTO core_issuehistory (issue_id, project_id, user_id, action, new_value, "timestamp")'
+                f" SELECT id, project_id, %s, 'created', status, now() FROM inserted"
+                f') INSERT INTO core_change (kind, object_id, project_id, trade_id, priority, changed_at)'
+                f" SELECT 'issue', id, project_id, trade_id, priority, now() FROM inserted ORDER BY id",
+                [self.actor.pk if self.actor else None],
+            )
+            return cursor.rowcount
+
+
+# Error files
+
+def save_error_file(error_file):
+    """Store the rejected rows in ``error_file`` (read from the start). Returns the stored name."""
+    error_file.seek(0)
+    name = default_storage.save(f'{ERROR_FILE_DIR}/{uuid.uuid4()}-errors.csv', ContentFile(error_file.read()))
+    clean_error_files()
+    return name
+
+
+def error_file_url(name, user, request=None):
+    token = signing.TimestampSigner(salt=ERROR_FILE_SALT).sign_object({'n': name, 'u': user.pk}, compress=True)
+    url = reverse('import-errors', args=[token])
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def read_error_token(token, user):
+    """The stored name in a signed error file URL, None if it is forged, expired or someone else's."""
+    try:
+        payload = signing.TimestampSigner(salt=ERROR_FILE_SALT).unsign_object(
+            token, max_age=settings.IMPORT_ERROR_FILE_SECONDS
+        )
+    except signing.BadSignature:
+        return None
+    if payload['u'] != user.pk or not payload['n'].startswith(f'{ERROR_FILE_DIR}/'):
+        return None
+    return payload['n']
+
+
+def clean_error_files():
+    """Delete the error files nobody can download any more."""
+    if not default_storage.exists(ERROR_FILE_DIR):
+        return
+    expired = timezone.now() - datetime.timedelta(seconds=settings.IMPORT_ERROR_FILE_SECONDS)
+    for filename in default_storage.listdir(ERROR_FILE_DIR)[1]:
+        name = f'{ERROR_FILE_DIR}/{filename}'
+        try:
+            if default_storage.get_modified_time(name) < expired:
+                default_storage.delete(name)
+        except FileNotFoundError:
+            pass  # cleaned by another request meanwhile
@@ -0,0 +1,86 @@
+import asyncio
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core import bench
+from core.models import Comment, Issue
+
+User = get_user_model()
+
+# The sync issue detail is served from the response cache, which the async
+# views don't have: a timeout of 0 stores nothing, so both sides build
+# every response
+UNCACHED = {'RESPONSE_CACHE_TIMEOUT': '0'}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare throughput and p99 latency of the hot read endpoints served by '
+        'gunicorn sync workers (WSGI) and by uvicorn workers (ASGI, the async views) '
+        'on this machine, with slow clients holding connections open and the response '
+        'cache off on both'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='Username or email to make the requests as')
+        parser.add_argument('--workers', type=int, default=2, help='Worker processes per server (default 2)')
+        parser.add_argument('--clients', type=int, default=20, help='Concurrent measured clients (default 20)')
+        parser.add_argument('--slow-clients', type=int, default=20,
+                            help='Concurrent slow clients, not measured (default 20)')
+        parser.add_argument('--slow-delay', type=float, default=0.5,
+                            help='Seconds between the header lines a slow client sends (default 0.5)')
+        parser.add_argument('--duration', type=float, default=15.0, help='Seconds per run (default 15)')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['user']).first() or \
+            User.objects.filter(email=options['user']).first()
+        if user is None:
+            raise CommandError(f'No user "{options["user"]}"')
+
+        issue = Issue.objects.order_by('id').first()
+        if issue is None:
+            raise CommandError('No issues to request, load some data first (seed_data)')
+        comment_issue_id = Comment.objects.values_list('issue_id', flat=True).first() or issue.id
+
+        # The same requests, on the sync views and on their async versions
+        paths = [
+            '/auth/profile/',
+            '/issues/',
+            f'/issues/{issue.id}/',
+            f'/projects/{issue.project_id}/issues/?pagination=cursor',
+            f'/issues/{comment_issue_id}/comments/?pagination=cursor',
+        ]
+        targets = {
+            'wsgi': [f'/api{path}' for path in paths],
+            'asgi': [f'/api/async{path}' for path in paths],
+        }
+
+        headers = bench.auth_headers(user)
+        results = {}
+        for kind, kind_paths in targets.items():
+            self.stderr.write(f'{kind}: {options["workers"]} worker(s), {options["duration"]:g}s ...')
+            with bench.serve(kind, bench.free_port(), workers=options['workers'], env=UNCACHED) as (host, port):
+                result = asyncio.run(bench.run_load(
+                    host, port, kind_paths, headers,
+                    clients=options['clients'], duration=options['duration'],
+                    slow_clients=options['slow_clients'], slow_delay=options['slow_delay'],
+                ))
+            results[kind] = result.as_dict()
+
+        if options['json']:
+            self.stdout.write(json.dumps({
+                'workers': options['workers'],
+                'clients': options['clients'],
+                'slow_clients': options['slow_clients'],
+                'results': results,
+            }, indent=2))
+            return
+
+        self.stdout.write(f'{"server":<8}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"errors":>8}')
+        for kind, row in results.items():
+            self.stdout.write(
+                f'{kind:<8}{row["throughput_rps"]:>10}{row["p50_ms"]:>10}{row["p99_ms"]:>10}{row["errors"]:>8}'
+            )
@@ -0,0 +1,75 @@
+import gzip
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from core.middleware import BROTLI_QUALITY, GZIP_LEVEL, brotli
+from core.models import Issue
+from core.renderers import MessagePackRenderer, ORJSONRenderer, msgpack
+from core.serializers import IssueSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare render time and bytes on the wire of issue list pages for DRF\'s JSONRenderer, '
+        'the orjson renderer and MessagePack, uncompressed and compressed as CompressionMiddleware does'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-sizes', type=int, nargs='+', default=[20, 50, 100],
+                            help='Issues per page (default 20 50 100)')
+        parser.add_argument('--repeat', type=int, default=200, help='Renders per measurement (default 200)')
+        parser.add_argument('--description-length', type=int, default=0,
+                            help='Pad each detailed_description to this many characters (default: as stored)')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        issues = list(IssueSerializer.setup_eager_loading(Issue.objects.order_by('-created_at'))[:max(options['page_sizes'])])
+        if not issues:
+            raise CommandError('No issues to render, load some data first (seed_data)')
+        rows = IssueSerializer(issues, many=True).data
+        if options['description_length']:
+            for row in rows:
+                text = row['detailed_description'] or 'x'
+                row['detailed_description'] = (text * (options['description_length'] // len(text) + 1))[:options['description_length']]
+
+        renderers = {'drf-json': JSONRenderer(), 'orjson': ORJSONRenderer()}
+        if msgpack is not None:
+            renderers['msgpack'] = MessagePackRenderer()
+
+        results = []
+        for page_size in options['page_sizes']:
+            # Shaped like a real page, envelope included
+            page = {'count': len(issues), 'next': None, 'previous': None, 'results': rows[:page_size]}
+            for name, renderer in renderers.items():
+                body, render_ms = self.measure(lambda: renderer.render(page), options['repeat'])
+                result = {
+                    'page_size': len(page['results']), 'renderer': name,
+                    'render_ms': render_ms, 'bytes': len(body),
+                    'gzip_bytes': len(gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)),
+                    'br_bytes': len(brotli.compress(body, quality=BROTLI_QUALITY)) if brotli is not None else None,
+                }
+                results.append(result)
+
+        if options['json']:
+            self.stdout.write(json.dumps({'repeat': options['repeat'], 'results': results}, indent=2))
+            return
+
+        self.stdout.write(f'{"page":>6}  {"renderer":<10}{"render ms":>11}{"bytes":>10}{"gzip":>10}{"br":>10}')
+        for row in results:
+            self.stdout.write(
+                f'{row["page_size"]:>6}  {row["renderer"]:<10}{row["render_ms"]:>11}{row["bytes"]:>10}'
+                f'{row["gzip_bytes"]:>10}{row["br_bytes"] if row["br_bytes"] is not None else "-":>10}'
+            )
+
+    def measure(self, render, repeat):
+        """Output of ``render`` and its median time in milliseconds."""
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            body = render()
+            timings.append(time.perf_counter() - started)
+        return body, round(statistics.median(timings) * 1000, 3)
@@ -0,0 +1,287 @@
+import asyncio
+import json
+import subprocess
+from datetime import date, datetime, timedelta, timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import get_resolver
+
+from core import bench, sync
+from core.authentication import ScopedRefreshToken
+from core.models import Attachment, Change, Comment, Issue, IssueHistory, Project, Trade
+from core.visibility import get_visibility
+
+from .seed_data import SEED_PASSWORD, SEED_PREFIX
+
+User = get_user_model()
+
+# (url name, method, path, JSON body). Paths and bodies are filled in per
+# role with ids that role can see. Keep in step with core/urls.py: any url
+# name missing here and from SKIPPED shows up under "uncovered" in the report.
+ROUTES = [
+    ('dashboard', 'GET', '/dashboard/', None),
+    ('metrics', 'GET', '/metrics/', None),
+    ('login', 'POST', '/api/auth/login/', {'email': '{email}', 'password': SEED_PASSWORD}),
+    ('token-refresh', 'POST', '/api/auth/refresh/', {'refresh': '{refresh}'}),
+    ('user-profile', 'GET', '/api/auth/profile/', None),
+    ('api-root', 'GET', '/api/', None),
+    ('project-list', 'GET', '/api/projects/', None),
+    ('project-detail', 'GET', '/api/projects/{project}/', None),
+    ('project-issues', 'GET', '/api/projects/{project}/issues/?pagination=cursor', None),
+    ('project-summary', 'GET', '/api/projects/{project}/summary/', None),
+    ('project-history', 'GET', '/api/projects/{project}/history/', None),
+    ('trade-list', 'GET', '/api/trades/', None),
+    ('trade-detail', 'GET', '/api/trades/{trade}/', None),
+    ('issue-list', 'GET', '/api/issues/', None),
+    ('issue-list', 'GET', '/api/issues/?pagination=cursor&ordering=-created_at', None),
+    ('issue-list', 'GET', '/api/issues/?search=leaking', None),
+    ('issue-detail', 'GET', '/api/issues/{issue}/', None),
+    ('issue-comments', 'GET', '/api/issues/{issue}/comments/?pagination=cursor', None),
+    ('issue-history', 'GET', '/api/issues/{issue}/history/', None),
+    ('comment-list', 'GET', '/api/comments/?pagination=cursor', None),
+    ('comment-detail', 'GET', '/api/comments/{comment}/', None),
+    ('attachment-list', 'GET', '/api/attachments/?pagination=cursor', None),
+    ('attachment-detail', 'GET', '/api/attachments/{attachment}/', None),
+    ('issue-summary', 'GET', '/api/summary/', None),
+    ('sync', 'GET', '/api/sync/?since={sync_token}', None),
+    ('export', 'GET', '/api/export/issues/?project={project}', None),
+    ('export', 'GET', '/api/export/comments/?project={project}&output=ndjson', None),
+    ('test-assigned-projects', 'GET', '/api/test-assigned-projects/', None),
+    ('async-user-profile', 'GET', '/api/async/auth/profile/', None),
+    ('async-issue-list', 'GET', '/api/async/issues/', None),
+    ('async-issue-detail', 'GET', '/api/async/issues/{issue}/', None),
+    ('async-issue-comments', 'GET', '/api/async/issues/{issue}/comments/?pagination=cursor', None),
+    ('async-project-issues', 'GET', '/api/async/projects/{project}/issues/?pagination=cursor', None),
+]
+
+# Only run with --include-writes, they add rows on every request
+WRITE_ROUTES = [
+    ('project-issues', 'POST', '/api/projects/{project}/issues/', {
+        'trade': '{trade}', 'issue_title': 'Benchmark issue', 'detailed_description': 'Created by benchmark_routes',
+        'priority': 'LOW', 'due_date': '{due_date}',
+    }),
+    ('issue-comments', 'POST', '/api/issues/{issue}/comments/', {'content': 'Benchmark comment'}),
+    ('assign-issue', 'POST', '/api/issues/{issue}/assign/', {'assigned_trade': '{trade_name}'}),
+    ('add-trade-to-project', 'POST', '/api/projects/{project}/add_trade/', {'trade_name': '{trade_name}'}),
+    ('start-upload', 'POST', '/api/issues/{issue}/uploads/', {'file_name': 'benchmark.pdf', 'total_size': 1024}),
+]
+
+SKIPPED = {
+    'register': 'creates a new account per request',
+    'upload-attachment': 'multipart file upload',
+    'import-issues': 'multipart file upload',
+    'import-errors': 'needs an import with rejected rows',
+    'async-events': 'long-lived event stream',
+    'upload-session': 'needs an upload in progress',
+    'attachment-derivative': 'seeded attachments have no files',
+    'attachment-download': 'seeded attachments have no files',
+    'signed-download': 'seeded attachments have no files',
+}
+
+ROLE_IDS = ('project', 'issue', 'comment', 'attachment', 'trade')
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive every route in core/urls.py and the router as a user of each role at the same time, '
+        'and report throughput, p50/p95/p99 latency and queries per request as JSON. '
+        'Run against data from seed_data so results are comparable between commits.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='host:port of a running server (default: start one)')
+        parser.add_argument('--server', choices=sorted(bench.SERVERS), default='asgi',
+                            help='Server to start when --url is not given (default asgi)')
+        parser.add_argument('--workers', type=int, default=2, help='Workers for the started server (default 2)')
+        parser.add_argument('--clients-per-role', type=int, default=4,
+                            help='Concurrent clients per role (default 4)')
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds per route (default 5)')
+        parser.add_argument('--warmup', type=float, default=1.0,
+                            help='Unmeasured seconds per route first (default 1)')
+        parser.add_argument('--routes', nargs='*', help='Only these url names')
+        parser.add_argument('--include-writes', action='store_true', help='Also run routes that add rows')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+        parser.add_argument('--baseline', help='Earlier report to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed p95 slowdown against the baseline, as a fraction (default 0.25)')
+
+    def handle(self, *args, **options):
+        users = self.role_users()
+        routes = ROUTES + (WRITE_ROUTES if options['include_writes'] else [])
+        if options['routes']:
+            routes = [route for route in routes if route[0] in options['routes']]
+
+        report = {
+            'commit': self.commit(),
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'params': {
+                'server': options['url'] or options['server'],
+                'workers': None if options['url'] else options['workers'],
+                'clients_per_role': options['clients_per_role'],
+                'duration': options['duration'],
+                'include_writes': options['include_writes'],
+                'roles': sorted(users),
+            },
+            'dataset': self.dataset(),
+            'routes': {},
+            'skipped': {},
+            'uncovered': self.uncovered(),
+        }
+        if not options['include_writes']:
+            for name, method, path, body in WRITE_ROUTES:
+                report['skipped'][f'{method} {name}'] = 'adds rows, run with --include-writes'
+        for name, reason in SKIPPED.items():
+            report['skipped'][name] = reason
+
+        contexts = {role: self.role_context(user) for role, user in users.items()}
+
+        if options['url']:
+            host, _, port = options['url'].rpartition(':')
+            self.run_routes(report, routes, contexts, host or '127.0.0.1', int(port), options)
+        else:
+            with bench.serve(options['server'], bench.free_port(), workers=options['workers']) as (host, port):
+                self.run_routes(report, routes, contexts, host, port, options)
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                report['regressions'] = self.compare(json.load(baseline_file), report, options['tolerance'])
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if report.get('regressions'):
+            raise CommandError(f'{len(report["regressions"])} regression(s) against {options["baseline"]}')
+
+    def role_users(self):
+        users = {}
+        for role, label in User.ROLE_CHOICES:
+            slug = role.lower().replace(' ', '_')
+            user = User.objects.filter(username=f'{SEED_PREFIX}{slug}_0').first() or \
+                User.objects.filter(role=role, is_active=True).order_by('id').first()
+            if user is not None:
+                users[role] = user
+        if not users:
+            raise CommandError('No users to benchmark as, run seed_data first')
+        return users
+
+    def role_context(self, user):
+        """Auth header and the ids this user's routes are filled in with."""
+        scope = get_visibility(user)
+        issue = scope.issue_queryset().select_related('trade').order_by('id').first()
+        context = {
+            'headers': bench.auth_headers(user),
+            'email': user.email,
+            'refresh': str(ScopedRefreshToken.for_user(user)),
+            'issue': issue.id if issue else None,
+            'project': issue.project_id if issue else scope.project_queryset().values_list('id', flat=True).first(),
+            'comment': Comment.objects.values_list('id', flat=True).order_by('id').first(),
+            'attachment': Attachment.objects.values_list('id', flat=True).order_by('id').first(),
+            'trade': issue.trade_id if issue else Trade.objects.values_list('id', flat=True).first(),
+            'trade_name': issue.trade.name if issue else 'GENERAL',
+            'due_date': (date.today() + timedelta(days=30)).isoformat(),
+            # A tablet that missed the last few hundred changes
+            'sync_token': sync.make_token(max((Change.objects.order_by('-id').values_list('id', flat=True).first() or 0) - 300, 0)),
+        }
+        return context
+
+    def fill(self, value, context):
+        if isinstance(value, dict):
+            return {key: self.fill(item, context) for key, item in value.items()}
+        if isinstance(value, str):
+            if value.startswith('{') and value.endswith('}') and value[1:-1] in ROLE_IDS:
+                return context[value[1:-1]]  # keep ids as numbers
+            return value.format(**context)
+        return value
+
+    def run_routes(self, report, routes, contexts, host, port, options):
+        for name, method, path, body in routes:
+            key = f'{method} {path}'
+            runs = {}
+            for role, context in contexts.items():
+                needed = [field for field in ROLE_IDS if f'{{{field}}}' in path + json.dumps(body or {})]
+                if any(context[field] is None for field in needed):
+                    report['skipped'][f'{key} as {role}'] = f'nothing visible to fill in {", ".join(needed)}'
+                    continue
+                headers = dict(context['headers'])
+                if name == 'metrics' and settings.METRICS_TOKEN:
+                    headers['Authorization'] = f'Bearer {settings.METRICS_TOKEN}'
+                if name in ('login', 'token-refresh'):
+                    headers.pop('Authorization')
+                runs[role] = (self.fill(path, context), headers, self.fill(body, context))
+            if not runs:
+                continue
+
+            self.stderr.write(f'{key} ({len(runs)} roles) ...')
+            if options['warmup']:
+                self.load(host, port, runs, method, options['clients_per_role'], options['warmup'])
+            results = self.load(host, port, runs, method, options['clients_per_role'], options['duration'])
+            report['routes'][key] = {
+                'route': name,
+                'all': bench.LoadResult.combine(list(results.values())).as_dict(),
+                'by_role': {role: result.as_dict() for role, result in results.items()},
+            }
+
+    def load(self, host, port, runs, method, clients, duration):
+        """Every role's clients at the same time. Returns {role: LoadResult}."""
+        async def run_all():
+            results = await asyncio.gather(*(
+                bench.run_load(host, port, [path], headers, clients=clients, duration=duration,
+                               method=method, body=body)
+                for path, headers, body in runs.values()
+            ))
+            return dict(zip(runs, results))
+        return asyncio.run(run_all())
+
+    def compare(self, baseline, report, tolerance):
+        regressions = []
+        if baseline.get('params') != report['params'] or baseline.get('dataset') != report['dataset']:
+            self.stderr.write('Warning: the baseline was run with different parameters or data')
+
+        for key, current in report['routes'].items():
+            before = baseline.get('routes', {}).get(key)
+            if before is None:
+                continue
+            now, then = current['all'], before['all']
+            # Ignore differences under a couple of milliseconds, that is noise
+            if now['p95_ms'] > then['p95_ms'] * (1 + tolerance) and now['p95_ms'] - then['p95_ms'] > 2:
+                regressions.append({'route': key, 'metric': 'p95_ms', 'baseline': then['p95_ms'], 'now': now['p95_ms']})
+            if (now['queries_per_request'] or 0) > (then['queries_per_request'] or 0) + 0.5:
+                regressions.append({
+                    'route': key, 'metric': 'queries_per_request',
+                    'baseline': then['queries_per_request'], 'now': now['queries_per_request'],
+                })
+            if now['errors'] and not then['errors']:
+                regressions.append({'route': key, 'metric': 'errors', 'baseline': 0, 'now': now['errors']})
+        return regressions
+
+    def dataset(self):
+        return {
+            'projects': Project.objects.count(),
+            'trades': Trade.objects.count(),
+            'users': User.objects.count(),
+            'issues': Issue.objects.count(),
+            'comments': Comment.objects.count(),
+            'history': IssueHistory.objects.count(),
+            'attachments': Attachment.objects.count(),
+        }
+
+    def uncovered(self):
+        names = {route[0] for route in ROUTES + WRITE_ROUTES} | set(SKIPPED)
+        url_names = {key for key in get_resolver().reverse_dict if isinstance(key, str)}
+        # The router's format-suffix and admin routes aren't ours to benchmark
+        return sorted(name for name in url_names - names if not name.startswith(('admin', 'auth_', 'app_list')))
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,151 @@
+"""
+EXPLAIN the queries behind each endpoint and report sequential scans.
+
+Each query is the one the view builds: its get_queryset(), filters,
+ordering and pagination applied to a request from a user with the role the
+endpoint is checked for (the first such user in the database).
+
+Run it against a seeded database:
+
+    python manage.py check_query_plans
+    python manage.py check_query_plans --verbose   # print every plan
+
+On PostgreSQL sequential scans are switched off for the check, so a
+``Seq Scan`` in the plan means no index can serve the query at all (rather
+than the planner preferring a scan because the table is small).
+"""
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from core.models import CustomUser, Issue, Project, Trade
+from core.pagination import KeysetPagination
+from core.views import CommentViewSet, IssueViewSet, issue_comments_queryset, project_issues_queryset
+
+SQLITE_FULL_SCAN = re.compile(r'\bSCAN (\w+)$')
+POSTGRES_SEQ_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+def api_request(user, params=None):
+    """A GET with ``params`` made by ``user``, as the views receive it."""
+    request = Request(RequestFactory().get('/', params or {}))
+    request.user = user
+    return request
+
+
+def list_page(viewset, request):
+    """
+    The query for one page of ``viewset``'s list: its get_queryset() through
+    its filter backends, then sliced the way its paginator would.
+    """
+    view = viewset(request=request, args=(), kwargs={}, format_kwarg=None, action='list')
+    queryset = view.filter_queryset(view.get_queryset())
+    if KeysetPagination.is_requested(request):
+        return KeysetPagination().page_queryset(queryset, request, view)
+    return queryset[:view.paginator.get_page_size(request)]
+
+
+def nested_page(queryset, request, ordering):
+    """The query behind a nested function view, a page of it in cursor mode."""
+    if KeysetPagination.is_requested(request):
+        return KeysetPagination(ordering=ordering).page_queryset(queryset, request)
+    return queryset
+
+
+def endpoint_queries(stdout=None):
+    """
+    (endpoint, query) pairs, each built by the view that serves the
+    endpoint for a user with the role it is about. Endpoints for roles
+    nobody has are left out.
+    """
+    project = Project.objects.order_by('id').first()
+    trade = Trade.objects.order_by('id').first()
+    issue = Issue.objects.order_by('id').first()
+    if not (project and trade and issue):
+        raise CommandError('The database is empty, seed it before checking query plans.')
+
+    users = {}
+    for user in CustomUser.objects.order_by('id'):
+        users.setdefault(user.role, user)
+    manager = users.get('PROJECT MANAGER') or users.get('ADMIN')
+
+    cases = [
+        ('GET /api/issues/?trade=&status=&priority=', manager,
+         lambda request: list_page(IssueViewSet, request), {'trade': trade.id, 'status': 'OPEN', 'priority': 'HIGH'}),
+        ('GET /api/issues/?status= (site officer)', users.get('SITE OFFICER'),
+         lambda request: list_page(IssueViewSet, request), {'status': 'OPEN'}),
+        ('GET /api/issues/ (sub-contractor)', users.get('SUB CONTRACTOR'),
+         lambda request: list_page(IssueViewSet, request), {}),
+        ('GET /api/issues/?pagination=cursor (safety officer)', users.get('SAFETY OFFICER'),
+         lambda request: list_page(IssueViewSet, request), {'pagination': 'cursor'}),
+        ('GET /api/issues/?ordering=priority', manager,
+         lambda request: list_page(IssueViewSet, request), {'ordering': 'priority'}),
+        ('GET /api/issues/?ordering=due_date', manager,
+         lambda request: list_page(IssueViewSet, request), {'ordering': 'due_date'}),
+        ('GET /api/issues/?ordering=-created_at', manager,
+         lambda request: list_page(IssueViewSet, request), {'ordering': '-created_at'}),
+        ('GET /api/projects/<id>/issues/?pagination=cursor', manager,
+         lambda request: nested_page(project_issues_queryset(request, project.id), request, ['-created_at']),
+         {'pagination': 'cursor'}),
+        ('GET /api/issues/<id>/comments/', manager,
+         lambda request: nested_page(issue_comments_queryset(request, issue), request, ['-timestamp']), {}),
+        ('GET /api/comments/?date=week', manager,
+         lambda request: list_page(CommentViewSet, request), {'date': 'week'}),
+        ('GET /api/comments/?pagination=cursor', manager,
+         lambda request: list_page(CommentViewSet, request), {'pagination': 'cursor'}),
+    ]
+
+    queries = []
+    for name, user, build, params in cases:
+        if user is None:
+            if stdout is not None:
+                stdout.write(f'skipped   {name}  (no user with that role)')
+            continue
+        queries.append((name, build(api_request(user, params))))
+    return queries
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the queries behind each endpoint and report sequential scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose', action='store_true', help='Print every query plan')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'postgresql':
+            pattern = POSTGRES_SEQ_SCAN
+        elif connection.vendor == 'sqlite':
+            pattern = SQLITE_FULL_SCAN
+        else:
+            raise CommandError(f'Query plan checks are not supported on {connection.vendor}')
+
+        offenders = []
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+
+            for name, queryset in endpoint_queries(self.stdout):
+                plan = queryset.explain()
+                scanned = sorted({
+                    match.group(1)
+                    for line in plan.splitlines()
+                    for match in [pattern.search(line.strip())]
+                    if match
+                })
+
+                if scanned:
+                    offenders.append(name)
+                    self.stdout.write(self.style.ERROR(f'SEQ SCAN  {name}  ({", ".join(scanned)})'))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'ok        {name}'))
+                if options['verbose'] or scanned:
+                    self.stdout.write(f'          {queryset.query}')
+                    for line in plan.splitlines():
+                        self.stdout.write(f'          {line}')
+
+        if offenders:
+            raise CommandError(f'{len(offenders)} endpoint(s) fall back to sequential scans')
@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import uploads
+from core.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Remove chunked uploads that were never finished, and their partial files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24,
+                            help='Remove uploads with no chunk received for this many hours (default 24)')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        stale = UploadSession.objects.filter(attachment__isnull=True, updated_at__lt=cutoff)
+
+        removed = 0
+        for session in stale.iterator():
+            uploads.discard(session)
+            removed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} unfinished upload(s)'))
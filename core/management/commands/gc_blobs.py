@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core import blobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete attachment blobs (and their thumbnails and previews) that no attachment refers to '
+        'and nothing has used for BLOB_GC_GRACE_SECONDS. Run it daily.'
+    )
+
+    def handle(self, *args, **options):
+        deleted = blobs.sweep()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} unreferenced blob(s)'))
@@ -0,0 +1,82 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core import importer
+from core.models import Project
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Import issues from a CSV file. Columns: project (id), trade (name), issue_title, '
+        'detailed_description, priority, status, due_date (YYYY-MM-DD), assigned_to (email). '
+        'Rows that fail are written to --errors with the reason.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file to import, - for stdin')
+        parser.add_argument('--project', type=int, help='Project id for rows without a project column')
+        parser.add_argument('--map', action='append', default=[], metavar='HEADER=FIELD',
+                            help='Read FIELD from the column HEADER (repeatable)')
+        parser.add_argument('--errors', help='Write the rows that failed here (CSV)')
+        parser.add_argument('--user', help='Email of the user to record as the creator in the issue history')
+        parser.add_argument('--atomic', action='store_true', help='Import nothing if any row is invalid')
+        parser.add_argument('--allow-past-due', action='store_true', help='Accept due dates in the past')
+        parser.add_argument('--batch-size', type=int, default=importer.BATCH_SIZE,
+                            help=f'Rows validated and loaded at a time (default {importer.BATCH_SIZE})')
+
+    def handle(self, *args, **options):
+        mapping = {}
+        for item in options['map']:
+            header, _, field = item.partition('=')
+            if field not in importer.FIELDS:
+                raise CommandError(f'--map {item}: field must be one of {", ".join(importer.FIELDS)}')
+            mapping[header] = field
+
+        default_project = None
+        if options['project'] is not None:
+            default_project = Project.objects.filter(id=options['project']).first()
+            if default_project is None:
+                raise CommandError(f'No project {options["project"]}')
+
+        actor = None
+        if options['user']:
+            actor = User.objects.filter(email=options['user']).first()
+            if actor is None:
+                raise CommandError(f'No user "{options["user"]}"')
+
+        def progress(result):
+            self.stderr.write(f'  {result.total} rows read, {result.errors} rejected')
+
+        import_job = importer.IssueImporter(
+            default_project=default_project, mapping=mapping, actor=actor,
+            allow_past_due=options['allow_past_due'], atomic=options['atomic'],
+            batch_size=options['batch_size'], progress=progress,
+        )
+
+        source = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8-sig', newline='')
+        error_file = open(options['errors'], 'w', newline='') if options['errors'] else None
+        try:
+            result = import_job.run(source, error_file)
+        except importer.ImportFileError as e:
+            raise CommandError(str(e))
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if error_file is not None:
+                error_file.close()
+
+        rate = result.total / result.duration if result.duration else 0
+        message = (
+            f'Imported {result.imported} of {result.total} rows into {len(result.project_ids)} project(s) '
+            f'in {result.duration:.1f}s ({rate:.0f} rows/s), {result.errors} rejected'
+        )
+        if result.rolled_back:
+            self.stdout.write(self.style.ERROR(f'Nothing imported (--atomic): {result.errors} invalid row(s)'))
+        elif result.errors:
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import Change
+
+
+class Command(BaseCommand):
+    help = (
+        'Remove sync feed entries older than SYNC_RETENTION_DAYS. Clients that have not '
+        'synced since then get "reset" from /api/sync/ and download everything again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per DELETE (default 5000)')
+
+    def handle(self, *args, **options):
+        # Tokens are accepted for SYNC_RETENTION_DAYS, keeping less would let them skip changes
+        cutoff = timezone.now() - timedelta(days=settings.SYNC_RETENTION_DAYS)
+        removed = 0
+        while True:
+            # Entries are appended in id order, so the oldest are the lowest ids
+            ids = list(
+                Change.objects.filter(changed_at__lt=cutoff).order_by('id').values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            removed += Change.objects.filter(id__in=ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} change(s) from before {cutoff:%Y-%m-%d %H:%M}'))
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import IssueHistory
+
+
+def month_start(months_ago):
+    now = timezone.localtime()
+    year, month = divmod(now.year * 12 + now.month - 1 - months_ago, 12)
+    return datetime(year, month + 1, 1, tzinfo=now.tzinfo)
+
+
+class Command(BaseCommand):
+    help = (
+        'Remove issue history older than the retention period, whole months at a time. '
+        'Deletes in batches so the table stays writable while it runs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=24,
+                            help='Keep this many months before the current one (default 24)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per DELETE (default 5000)')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be removed')
+
+    def handle(self, *args, **options):
+        if options['months'] < 1:
+            raise CommandError('--months must be at least 1')
+
+        cutoff = month_start(options['months'])
+        expired = IssueHistory.objects.filter(timestamp__lt=cutoff)
+
+        if options['dry_run']:
+            self.stdout.write(f'{expired.count()} history row(s) from before {cutoff:%Y-%m} would be removed')
+            return
+
+        removed = 0
+        while True:
+            # The timestamp index finds the oldest rows, the primary key deletes them
+            ids = list(expired.order_by('timestamp').values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            removed += IssueHistory.objects.filter(id__in=ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} history row(s) from before {cutoff:%Y-%m}'))
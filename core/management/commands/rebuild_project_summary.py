@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core import summary
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-project issue summary tables from the issues'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_ids', nargs='*', type=int,
+                            help='Only rebuild these projects (default: all)')
+
+    def handle(self, *args, **options):
+        project_ids = options['project_ids'] or None
+        summary.rebuild(project_ids)
+
+        which = 'all projects' if project_ids is None else f'{len(project_ids)} project(s)'
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the issue summary for {which}'))
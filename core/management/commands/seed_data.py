@@ -0,0 +1,224 @@
+import random
+from datetime import date, timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core import audit, response_cache, summary, sync
+from core.models import Attachment, Comment, Issue, IssueHistory, Project, Trade, TRADE_CHOICES
+
+User = get_user_model()
+
+SEED_PREFIX = 'seed_'
+PROJECT_PREFIX = 'Seed project'
+SEED_PASSWORD = 'seedpass123'
+
+# Roles that see every project don't need assignments
+FULL_ACCESS_ROLES = ('ADMIN', 'PROJECT MANAGER')
+
+PRIORITY_WEIGHTS = {'LOW': 40, 'MEDIUM': 35, 'HIGH': 18, 'CRITICAL': 7}
+STATUS_WEIGHTS = {'OPEN': 35, 'IN_PROGRESS': 25, 'RESOLVED': 25, 'CLOSED': 15}
+
+PROBLEMS = [
+    'Cracked', 'Leaking', 'Missing', 'Loose', 'Misaligned', 'Damaged', 'Exposed', 'Blocked', 'Uneven', 'Unsecured',
+]
+ELEMENTS = [
+    'pipe joint', 'cable tray', 'handrail', 'window frame', 'slab edge', 'duct', 'socket outlet', 'door closer',
+    'fire stopping', 'scaffold tie', 'ceiling tile', 'drain cover', 'rebar cover', 'stair nosing', 'vent grille',
+]
+PLACES = ['level 1', 'level 2', 'level 3', 'basement', 'roof', 'stairwell A', 'stairwell B', 'plant room', 'lobby']
+REMARKS = [
+    'Checked on site, needs follow-up.', 'Photos attached.', 'Contractor notified.', 'Materials on order.',
+    'Fixed, please inspect.', 'Still not resolved after the last visit.', 'Safety barrier installed meanwhile.',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a realistic dataset for load testing: projects, every trade, users in every role '
+        'with project assignments, and issues with comments, history and attachments. '
+        'The same --seed always produces the same data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, default=2000, help='Projects to create (default 2000)')
+        parser.add_argument('--users-per-role', type=int, default=50, help='Users per role (default 50)')
+        parser.add_argument('--projects-per-user', type=int, default=25,
+                            help='Projects each site officer, subcontractor and safety officer is assigned to (default 25)')
+        parser.add_argument('--issues-per-project', type=int, default=100, help='Issues per project (default 100)')
+        parser.add_argument('--comments-per-issue', type=float, default=2, help='Average comments per issue (default 2)')
+        parser.add_argument('--history-per-issue', type=float, default=1,
+                            help='Average history entries per issue (default 1)')
+        parser.add_argument('--attachments-per-issue', type=float, default=0.25,
+                            help='Average attachments per issue (default 0.25)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default 42)')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per INSERT (default 2000)')
+        parser.add_argument('--flush', action='store_true', help='Remove previously seeded data first')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+
+        if options['flush']:
+            self.flush()
+        elif User.objects.filter(username__startswith=SEED_PREFIX).exists():
+            raise CommandError('Seeded data already exists, run with --flush to replace it')
+
+        trades = self.create_trades()
+        users = self.create_users(options['users_per_role'])
+        projects = self.create_projects(options['projects'], trades)
+        self.assign_users(users, projects, options['projects_per_user'])
+
+        totals = {'issues': 0, 'comments': 0, 'history': 0, 'attachments': 0}
+        people = [user for role_users in users.values() for user in role_users]
+        # A few projects at a time so memory stays flat however big the dataset
+        for start in range(0, len(projects), 50):
+            chunk = projects[start:start + 50]
+            counts = self.create_issues(chunk, trades, users, people, options)
+            for key, value in counts.items():
+                totals[key] += value
+            self.stdout.write(f'  projects {start + len(chunk)}/{len(projects)}, issues {totals["issues"]}')
+
+        # bulk_create skips the signals that keep these up to date
+        summary.rebuild([project.id for project in projects])
+        response_cache.bump('project', 'trade', 'issue')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(projects)} projects, {len(trades)} trades, {len(people)} users, '
+            f'{totals["issues"]} issues, {totals["comments"]} comments, {totals["history"]} history entries, '
+            f'{totals["attachments"]} attachments (password for every user: {SEED_PASSWORD})'
+        ))
+
+    def flush(self):
+        with transaction.atomic():
+            project_ids = list(Project.objects.filter(project_name__startswith=PROJECT_PREFIX).values_list('id', flat=True))
+            with audit.batch():
+                Project.objects.filter(id__in=project_ids).delete()
+            # History outlives deletes, the seeded projects' has to go explicitly
+            IssueHistory.objects.filter(project_id__in=project_ids).delete()
+            User.objects.filter(username__startswith=SEED_PREFIX).delete()
+        summary.rebuild(project_ids)
+        response_cache.bump('project', 'trade', 'issue')
+
+    def create_trades(self):
+        return [Trade.objects.get_or_create(name=name)[0] for name, label in TRADE_CHOICES]
+
+    def create_users(self, per_role):
+        # Hash once, every seeded user gets the same password
+        password = make_password(SEED_PASSWORD)
+        specialties = [name for name, label in User.TRADE_SPECIALTY]
+        new_users = []
+        for role, label in User.ROLE_CHOICES:
+            slug = role.lower().replace(' ', '_')
+            for n in range(per_role):
+                new_users.append(User(
+                    username=f'{SEED_PREFIX}{slug}_{n}',
+                    email=f'{SEED_PREFIX}{slug}_{n}@siteflow.test',
+                    password=password,
+                    role=role,
+                    specialty=specialties[n % len(specialties)] if role == 'SUB CONTRACTOR' else None,
+                ))
+        User.objects.bulk_create(new_users, batch_size=self.batch_size)
+
+        users = {}
+        for user in User.objects.filter(username__startswith=SEED_PREFIX).order_by('id'):
+            users.setdefault(user.role, []).append(user)
+        return users
+
+    def create_projects(self, count, trades):
+        start = date.today() - timedelta(days=365)
+        Project.objects.bulk_create([
+            Project(
+                project_name=f'{PROJECT_PREFIX} {n:05d}',
+                description=f'Generated project {n} for load testing',
+                start_date=start + timedelta(days=n % 180),
+                end_date=start + timedelta(days=540 + n % 365),
+            )
+            for n in range(count)
+        ], batch_size=self.batch_size)
+        projects = list(Project.objects.filter(project_name__startswith=PROJECT_PREFIX).order_by('id'))
+
+        Through = Project.trades.through
+        Through.objects.bulk_create([
+            Through(project_id=project.id, trade_id=trade.id)
+            for project in projects
+            for trade in self.rng.sample(trades, self.rng.randint(3, len(trades)))
+        ], batch_size=self.batch_size)
+        return projects
+
+    def assign_users(self, users, projects, per_user):
+        Through = Project.assigned_users.through
+        rows = []
+        for role, role_users in users.items():
+            for user in role_users:
+                if role in FULL_ACCESS_ROLES:
+                    # Managers still belong to a few teams (notifications go to the team)
+                    assigned = self.rng.sample(projects, min(5, len(projects)))
+                else:
+                    assigned = self.rng.sample(projects, min(per_user, len(projects)))
+                rows += [Through(project_id=project.id, customuser_id=user.id) for project in assigned]
+        Through.objects.bulk_create(rows, batch_size=self.batch_size)
+
+    def amount(self, average):
+        """A count averaging ``average`` per item, e.g. 0.25 -> 1 in 4 items get one."""
+        whole = int(average)
+        return whole + (1 if self.rng.random() < average - whole else 0)
+
+    def pick(self, weights):
+        return self.rng.choices(list(weights), weights=list(weights.values()))[0]
+
+    def create_issues(self, projects, trades, users, people, options):
+        today = date.today()
+        workers = users.get('SUB CONTRACTOR', []) + users.get('SITE OFFICER', [])
+        issues = []
+        for project in projects:
+            for n in range(options['issues_per_project']):
+                problem = f'{self.rng.choice(PROBLEMS)} {self.rng.choice(ELEMENTS)}'
+                issues.append(Issue(
+                    project=project,
+                    trade=self.rng.choice(trades),
+                    issue_title=f'{problem} on {self.rng.choice(PLACES)}'[:100],
+                    detailed_description=f'{problem} found during inspection. {self.rng.choice(REMARKS)}',
+                    priority=self.pick(PRIORITY_WEIGHTS),
+                    status=self.pick(STATUS_WEIGHTS),
+                    due_date=today + timedelta(days=self.rng.randint(-30, 90)),
+                    assigned_to=self.rng.choice(workers) if workers and self.rng.random() < 0.7 else None,
+                ))
+
+        with transaction.atomic():
+            issues = Issue.objects.bulk_create(issues, batch_size=self.batch_size)
+
+            comments, history, attachments = [], [], []
+            for issue in issues:
+                for n in range(self.amount(options['comments_per_issue'])):
+                    comments.append(Comment(issue=issue, user=self.rng.choice(people), content=self.rng.choice(REMARKS)))
+                for n in range(self.amount(options['history_per_issue'])):
+                    history.append(IssueHistory(
+                        issue=issue, project_id=issue.project_id, user=self.rng.choice(people), action='status_changed',
+                        old_value='OPEN', new_value=issue.status,
+                    ))
+                for n in range(self.amount(options['attachments_per_issue'])):
+                    # Rows only, no files are written
+                    attachments.append(Attachment(
+                        issue=issue, user=self.rng.choice(people), file=f'attachments/seed/{issue.id}_{n}.jpg',
+                        file_name=f'{issue.id}_{n}.jpg', content_type='image/jpeg',
+                    ))
+
+            Comment.objects.bulk_create(comments, batch_size=self.batch_size)
+            IssueHistory.objects.bulk_create(history, batch_size=self.batch_size)
+            Attachment.objects.bulk_create(attachments, batch_size=self.batch_size)
+            # So the sync feed has something to page through
+            sync.record_many('issue', [(issue.id, *sync.issue_scope(issue)) for issue in issues])
+            sync.record_many('comment', [(comment.id, *sync.issue_scope(comment.issue)) for comment in comments])
+            sync.record_many('attachment', [
+                (attachment.id, *sync.issue_scope(attachment.issue)) for attachment in attachments
+            ])
+
+        return {
+            'issues': len(issues),
+            'comments': len(comments),
+            'history': len(history),
+            'attachments': len(attachments),
+        }
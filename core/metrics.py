@@ -0,0 +1,255 @@
+"""
+Per-request performance metrics.
+
+MetricsMiddleware measures every request: SQL queries and time spent in
+the database (through a connection execute wrapper), time spent in
+serializers (see TimedSerializerMixin in core.serializers) and total time.
+Each request is labelled with its route name from core/urls.py. The numbers
+are reported three ways:
+
+- a ``Server-Timing`` header, which browser dev tools show per request
+- a structured log line on the ``core.metrics.requests`` logger
+- Prometheus histograms, served by the ``metrics`` view
+
+Queries slower than SLOW_QUERY_MS are logged on ``core.metrics.slow_queries``
+with the route that ran them.
+
+The histograms live in the process. With several gunicorn workers each
+scrape sees the worker that answered it, which is enough to compare
+routes against each other.
+"""
+import logging
+import re
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+request_logger = logging.getLogger('core.metrics.requests')
+slow_query_logger = logging.getLogger('core.metrics.slow_queries')
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+@dataclass
+class RequestStats:
+    request: object
+    queries: int = 0
+    db_time: float = 0.0
+    serializer_time: float = 0.0
+    serializer_depth: int = 0
+
+    @property
+    def route(self):
+        # Resolved lazily, the URL isn't matched yet when the request starts
+        return route_name(self.request)
+
+
+_current_stats = ContextVar('request_stats', default=None)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self, label_names):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, series in sorted(self.series.items()):
+            base = ','.join(f'{name}="{escape(value)}"' for name, value in zip(label_names, labels))
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{base},le="{bound:g}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{base}}} {series[-2]:.6f}')
+            lines.append(f'{self.name}_count{{{base}}} {series[-1]}')
+        return lines
+
+
+class Registry:
+    label_names = ('route', 'method')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.duration = Histogram('siteflow_request_duration_seconds', 'Total time per request', SECONDS_BUCKETS)
+        self.db_time = Histogram('siteflow_request_db_seconds', 'Time spent in SQL per request', SECONDS_BUCKETS)
+        self.serializer_time = Histogram(
+            'siteflow_request_serializer_seconds', 'Time spent in serializers per request', SECONDS_BUCKETS
+        )
+        self.queries = Histogram('siteflow_request_queries', 'SQL queries per request', QUERY_BUCKETS)
+        self.slow_queries = {}  # route -> count
+
+    def record(self, method, stats, total):
+        labels = (stats.route, method)
+        with self.lock:
+            self.duration.observe(labels, total)
+            self.db_time.observe(labels, stats.db_time)
+            self.serializer_time.observe(labels, stats.serializer_time)
+            self.queries.observe(labels, stats.queries)
+
+    def slow_query(self, route):
+        with self.lock:
+            self.slow_queries[route] = self.slow_queries.get(route, 0) + 1
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for histogram in (self.duration, self.db_time, self.serializer_time, self.queries):
+                lines += histogram.render(self.label_names)
+            lines += [
+                '# HELP siteflow_slow_queries_total Queries slower than SLOW_QUERY_MS',
+                '# TYPE siteflow_slow_queries_total counter',
+            ]
+            for route, count in sorted(self.slow_queries.items()):
+                lines.append(f'siteflow_slow_queries_total{{route="{escape(route)}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self.lock:
+            self.clear()
+
+
+registry = Registry()
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+@contextmanager
+def serializer_timer():
+    """Time a serializer call. Nested calls (fields, list items) count once."""
+    stats = _current_stats.get()
+    if stats is None:
+        yield
+        return
+    stats.serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_depth -= 1
+        if stats.serializer_depth == 0:
+            stats.serializer_time += time.perf_counter() - started
+
+
+def query_timer(execute, sql, params, many, context):
+    """Connection execute wrapper counting queries and DB time for the current request."""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+            if elapsed * 1000 >= settings.SLOW_QUERY_MS:
+                route = stats.route
+                registry.slow_query(route)
+                slow_query_logger.warning(
+                    'slow query route=%s duration_ms=%.1f sql=%s',
+                    route, elapsed * 1000, compact_sql(sql),
+                    extra={'route': route, 'duration_ms': round(elapsed * 1000, 1)},
+                )
+
+
+def compact_sql(sql, limit=2000):
+    sql = re.sub(r'\s+', ' ', str(sql)).strip()
+    return sql if len(sql) <= limit else sql[:limit] + '...'
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.route or 'unmatched'
+
+
+class MetricsMiddleware:
+    """See the module docstring. Sync and async capable."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token, started = self.start(request)
+        try:
+            with self.count_queries():
+                response = self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        return self.finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats, token, started = self.start(request)
+        try:
+            with self.count_queries():
+                response = await self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        return self.finish(request, response, stats, started)
+
+    def start(self, request):
+        stats = RequestStats(request)
+        return stats, _current_stats.set(stats), time.perf_counter()
+
+    @contextmanager
+    def count_queries(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_timer))
+            yield
+
+    def finish(self, request, response, stats, started):
+        total = time.perf_counter() - started
+
+        # Headers only: streaming responses are passed through untouched
+        response['Server-Timing'] = ', '.join([
+            f'db;desc="{stats.queries} queries";dur={stats.db_time * 1000:.1f}',
+            f'serializer;dur={stats.serializer_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+        registry.record(request.method, stats, total)
+        request_logger.info(
+            'route=%s method=%s status=%s queries=%d db_ms=%.1f serializer_ms=%.1f total_ms=%.1f',
+            stats.route, request.method, response.status_code, stats.queries,
+            stats.db_time * 1000, stats.serializer_time * 1000, total * 1000,
+            extra={
+                'route': stats.route,
+                'method': request.method,
+                'status': response.status_code,
+                'queries': stats.queries,
+                'db_ms': round(stats.db_time * 1000, 1),
+                'serializer_ms': round(stats.serializer_time * 1000, 1),
+                'total_ms': round(total * 1000, 1),
+            },
+        )
+        return response
@@ -0,0 +1,136 @@
+"""
+Project middleware.
+"""
+import gzip
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_current_request = ContextVar('current_request', default=None)
+
+
+class CurrentRequestMiddleware:
+    """
+    Remembers the request being handled so code that runs outside the view
+    (signal handlers) can tell who made a change. DRF copies the user it
+    authenticated onto the underlying HttpRequest, so by the time a view
+    saves anything ``request.user`` is the API user.
+
+    Works both ways round so the async views under ASGI don't get switched
+    to a thread just to pass through here.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _current_request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _current_request.reset(token)
+
+    async def __acall__(self, request):
+        token = _current_request.set(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            _current_request.reset(token)
+
+
+def get_current_user():
+    """The authenticated user of the current request, or None."""
+    request = _current_request.get()
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return None
+    return user
+
+
+# Compressing has to cost less time than sending the bytes it saves
+BROTLI_QUALITY = 4
+GZIP_LEVEL = 6
+COMPRESSIBLE_TYPES = ('application/json', 'application/msgpack', 'text/')
+
+
+def accepted_encodings(header):
+    """Content codings an ``Accept-Encoding`` header allows (``q=0`` refuses one)."""
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        quality = params.strip().lower()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding.strip():
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class CompressionMiddleware:
+    """
+    Brotli (when installed) or gzip for responses of COMPRESS_MIN_BYTES and
+    more, which is what list pages with long issue descriptions are; small
+    responses aren't worth it. Streaming responses (exports, downloads,
+    events) pass through untouched.
+
+    The API authenticates with a header, not a cookie, so compressing it
+    doesn't give away secrets the way BREACH needs.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        if (response.streaming or response.status_code != 200 or response.has_header('Content-Encoding')
+                or not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES)
+                or len(response.content) < settings.COMPRESS_MIN_BYTES):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and 'br' in accepted:
+            encoding, content = 'br', brotli.compress(response.content, quality=BROTLI_QUALITY)
+        elif 'gzip' in accepted:
+            encoding, content = 'gzip', gzip.compress(response.content, compresslevel=GZIP_LEVEL, mtime=0)
+        else:
+            return response
+        if len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        response['Content-Encoding'] = encoding
+        # The bytes differ from the uncompressed ones, so the ETag becomes weak (as GZipMiddleware does)
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_alter_trade_name'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attachment',
+            index=models.Index(fields=['uploaded_at', 'id'], name='attachment_uploaded_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['timestamp', 'id'], name='comment_timestamp_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['issue', 'timestamp', 'id'], name='comment_issue_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issue',
+            index=models.Index(fields=['created_at', 'id'], name='issue_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issue',
+            index=models.Index(fields=['project', 'created_at', 'id'], name='issue_project_created_idx'),
+        ),
+    ]
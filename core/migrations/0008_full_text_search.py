@@ -0,0 +1,27 @@
+from django.db import migrations
+
+from core.search import drop_search_index, install_search_index
+
+
+def install(apps, schema_editor):
+    install_search_index(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+    """
+    Full-text search index for issues and comments: a tsvector column with a
+    GIN index on PostgreSQL, an FTS5 table on SQLite. Both are kept up to date
+    by database triggers, see core/search.py.
+    """
+
+    dependencies = [
+        ('core', '0007_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
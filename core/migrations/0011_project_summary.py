@@ -0,0 +1,68 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:02
+
+import django.db.models.deletion
+from django.conf import settings
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_summary(apps, schema_editor):
+    Issue = apps.get_model('core', 'Issue')
+    ProjectIssueStat = apps.get_model('core', 'ProjectIssueStat')
+    ProjectOpenIssueStat = apps.get_model('core', 'ProjectOpenIssueStat')
+
+    rows = Issue.objects.values('project_id', 'status', 'priority', 'trade_id').annotate(total=Count('id')).order_by()
+    ProjectIssueStat.objects.bulk_create([
+        ProjectIssueStat(issue_count=row.pop('total'), **row) for row in rows
+    ], batch_size=1000)
+
+    open_rows = Counter()
+    fields = ('project_id', 'trade_id', 'priority', 'assigned_to_id', 'due_date')
+    for row in Issue.objects.values(*fields, 'status').annotate(total=Count('id')).order_by():
+        if (row['status'] or '').upper() in ('OPEN', 'IN_PROGRESS'):
+            open_rows[tuple(row[field] for field in fields)] += row['total']
+    ProjectOpenIssueStat.objects.bulk_create([
+        ProjectOpenIssueStat(issue_count=total, **dict(zip(fields, key))) for key, total in open_rows.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_upload_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectIssueStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(max_length=50)),
+                ('priority', models.CharField(max_length=100)),
+                ('issue_count', models.IntegerField(default=0)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='issue_stats', to='core.project')),
+                ('trade', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.trade')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('project', 'status', 'priority', 'trade'), name='unique_project_issue_stat')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProjectOpenIssueStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority', models.CharField(max_length=100)),
+                ('due_date', models.DateField()),
+                ('issue_count', models.IntegerField(default=0)),
+                ('assigned_to', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='open_issue_stats', to='core.project')),
+                ('trade', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.trade')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('assigned_to__isnull', False)), fields=('project', 'trade', 'priority', 'assigned_to', 'due_date'), name='unique_project_open_stat'), models.UniqueConstraint(condition=models.Q(('assigned_to__isnull', True)), fields=('project', 'trade', 'priority', 'due_date'), name='unique_project_open_stat_unassigned')],
+            },
+        ),
+        migrations.RunPython(fill_summary, migrations.RunPython.noop),
+    ]
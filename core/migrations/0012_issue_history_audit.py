@@ -0,0 +1,62 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_project(apps, schema_editor):
+    Issue = apps.get_model('core', 'Issue')
+    IssueHistory = apps.get_model('core', 'IssueHistory')
+    IssueHistory.objects.update(
+        project_id=Subquery(Issue.objects.filter(pk=OuterRef('issue_id')).values('project_id')[:1])
+    )
+
+
+def add_timestamp_index(apps, schema_editor):
+    # Rows arrive in time order and are removed by month, which is what a
+    # BRIN index is for: a few pages however big the table gets
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS history_timestamp_brin ON core_issuehistory USING brin ("timestamp")'
+        )
+    else:
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS history_timestamp_idx ON core_issuehistory ("timestamp")'
+        )
+
+
+def drop_timestamp_index(apps, schema_editor):
+    for name in ('history_timestamp_brin', 'history_timestamp_idx'):
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_project_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='issuehistory',
+            name='project',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='issue_history', to='core.project'),
+        ),
+        migrations.AlterField(
+            model_name='issuehistory',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='issuehistory',
+            index=models.Index(fields=['issue', 'timestamp', 'id'], name='history_issue_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issuehistory',
+            index=models.Index(fields=['project', 'timestamp', 'id'], name='history_project_timestamp_idx'),
+        ),
+        migrations.RunPython(fill_project, migrations.RunPython.noop),
+        migrations.RunPython(add_timestamp_index, drop_timestamp_index),
+    ]
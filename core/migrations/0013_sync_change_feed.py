@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_issue_history_audit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('project', 'project'), ('issue', 'issue'), ('comment', 'comment'), ('attachment', 'attachment')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('project_id', models.BigIntegerField(blank=True, null=True)),
+                ('user_id', models.BigIntegerField(blank=True, null=True)),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['project_id', 'id'], name='change_project_seq_idx'), models.Index(condition=models.Q(('user_id__isnull', False)), fields=['user_id', 'id'], name='change_user_seq_idx')],
+            },
+        ),
+    ]
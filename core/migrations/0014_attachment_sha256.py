@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_sync_change_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='sha256',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:54
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_attachment_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='content_type',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='file_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='file_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='attachment',
+            name='file',
+            field=core.storage.BlobField(storage=core.storage.BlobStorage(), upload_to='attachments/'),
+        ),
+        migrations.AddIndex(
+            model_name='attachment',
+            index=models.Index(fields=['file'], name='attachment_file_idx'),
+        ),
+    ]
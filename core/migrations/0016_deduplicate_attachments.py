@@ -0,0 +1,47 @@
+import mimetypes
+import os
+
+from django.core.files import File
+from django.db import migrations
+
+from core.storage import BlobStorage, digest_of
+
+
+def deduplicate(apps, schema_editor):
+    """
+    Move every attachment file into the blob store (core.storage) and delete
+    the original; copies of the same content end up as one blob. Files that
+    are missing keep their name. Safe to run again after an interruption,
+    rows already moved are skipped.
+    """
+    Attachment = apps.get_model('core', 'Attachment')
+    store = BlobStorage()
+    names = Attachment.objects.exclude(file='').values_list('file', flat=True).distinct().order_by()
+    for name in list(names):
+        if digest_of(name):
+            continue
+        rows = Attachment.objects.filter(file=name)
+        file_name = os.path.basename(name)
+        if not store.exists(name):
+            rows.update(file_name=file_name)
+            continue
+        with store.open(name, 'rb') as original:
+            blob = store.save(name, File(original))
+        rows.update(
+            file=blob, file_name=file_name, file_size=store.size(blob),
+            content_type=mimetypes.guess_type(file_name)[0] or 'application/octet-stream', sha256=digest_of(blob),
+        )
+        store.delete(name)
+
+
+class Migration(migrations.Migration):
+    # Files can't be rolled back, so each row is committed as soon as its file has moved
+    atomic = False
+
+    dependencies = [
+        ('core', '0015_content_addressed_attachments'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_deduplicate_attachments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='change',
+            name='priority',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='change',
+            name='trade_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_change_issue_scope'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='issuehistory',
+            name='issue',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='history', to='core.issue'),
+        ),
+        migrations.AlterField(
+            model_name='issuehistory',
+            name='project',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='issue_history', to='core.project'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:48
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def uppercase_open(apps, schema_editor):
+    """Issues saved with the old lowercase default 'open' become 'OPEN', their summary rows too."""
+    Issue = apps.get_model('core', 'Issue')
+    ProjectIssueStat = apps.get_model('core', 'ProjectIssueStat')
+    Change = apps.get_model('core', 'Change')
+
+    issues = Issue.objects.filter(status='open')
+    # So sync clients fetch the new status
+    Change.objects.bulk_create([
+        Change(kind='issue', object_id=object_id, project_id=project_id, trade_id=trade_id, priority=priority)
+        for object_id, project_id, trade_id, priority in issues.values_list('id', 'project_id', 'trade_id', 'priority')
+    ], batch_size=1000)
+    issues.update(status='OPEN')
+
+    for stat in ProjectIssueStat.objects.filter(status='open'):
+        merged = ProjectIssueStat.objects.filter(
+            project_id=stat.project_id, status='OPEN', priority=stat.priority, trade_id=stat.trade_id
+        ).update(issue_count=F('issue_count') + stat.issue_count)
+        if merged:
+            stat.delete()
+        else:
+            stat.status = 'OPEN'
+            stat.save(update_fields=['status'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_keep_history_of_deleted_issues'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='issue',
+            name='status',
+            field=models.CharField(choices=[('OPEN', 'Open'), ('IN_PROGRESS', 'In Progress'), ('RESOLVED', 'Resolved'), ('CLOSED', 'Closed')], default='OPEN', max_length=50),
+        ),
+        migrations.RunPython(uppercase_open, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,13 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.db.models import Q
+
+from .storage import BlobField, BlobStorage
 class CustomUser(AbstractUser):
     ROLE_CHOICES =[
         ('ADMIN', 'admin'),
@@ -79,34 +83,224 @@ class Issue(models.Model):
     priority = models.CharField(max_length=100, choices=PRIORITY_STATUS)
     assigned_to = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
     due_date = models.DateField()
-    status = models.CharField(max_length= 50, choices = STATUS_CHOICES, default = 'open')
+    status = models.CharField(max_length= 50, choices = STATUS_CHOICES, default = 'OPEN')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Fields whose previous value signal handlers need to see on save
+    TRACKED_FIELDS = ('status', 'priority', 'trade_id', 'assigned_to_id', 'due_date', 'project_id')
+    
+    class Meta:
+        indexes = [
+            # keyset pagination: (created_at, id) globally and per project
+            models.Index(fields=['created_at', 'id'], name='issue_created_id_idx'),
+            models.Index(fields=['project', 'created_at', 'id'], name='issue_project_created_idx'),
+            # IssueFilter: ?trade= / ?status= / ?priority=, alone or scoped to projects
+            models.Index(fields=['trade', 'status', 'priority'], name='issue_trade_status_idx'),
+            models.Index(fields=['project', 'status', 'priority'], name='issue_project_status_idx'),
+            # IssueViewSet.ordering_fields
+            models.Index(fields=['priority', 'id'], name='issue_priority_id_idx'),
+            models.Index(fields=['due_date', 'id'], name='issue_due_date_id_idx'),
+            # open issues only: what is due / overdue per project
+            models.Index(
+                fields=['project', 'due_date'],
+                name='issue_open_due_idx',
+                condition=Q(status__in=['OPEN', 'IN_PROGRESS']),
+            ),
+            # safety officers only ever see HIGH / CRITICAL issues
+            models.Index(
+                fields=['project', 'created_at', 'id'],
+                name='issue_safety_created_idx',
+                condition=Q(priority__in=['HIGH', 'CRITICAL']),
+            ),
+        ]
+    
     def __str__(self):
         return self.issue_title
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.snapshot()
+        return instance
+    
+    def snapshot(self):
+        """Remember the current values of TRACKED_FIELDS (called on load and after save)"""
+        self._loaded_values = {
+            field: getattr(self, field)
+            for field in self.TRACKED_FIELDS
+            if field in self.__dict__
+        }
+    
+    def previous_value(self, field):
+        """Value of ``field`` when the issue was loaded / last saved, None for new issues"""
+        return getattr(self, '_loaded_values', {}).get(field)
+    
 class IssueHistory(models.Model):
-    issue = models.ForeignKey(Issue, on_delete=models.CASCADE, related_name='history')
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    """
+    One change to an issue, written by core.audit. Append-only: rows outlive
+    the user who made the change, and the issue and project too (deleting an
+    issue adds a ``deleted`` row), and are only removed by prune_issue_history.
+    """
+    # No constraints, so deletes leave the rows alone. null=True only makes
+    # joins to them outer joins, for rows whose issue is gone
+    issue = models.ForeignKey(
+        Issue, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='history'
+    )
+    # The issue's project when the change was made, so a project's history is one index read
+    project = models.ForeignKey(
+        Project, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='issue_history'
+    )
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
     action = models.CharField(max_length=100)
     old_value = models.TextField(blank=True, null=True)
     new_value = models.TextField(blank=True, null=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            # keyset pagination of /issues/<id>/history/ and /projects/<id>/history/
+            models.Index(fields=['issue', 'timestamp', 'id'], name='history_issue_timestamp_idx'),
+            models.Index(fields=['project', 'timestamp', 'id'], name='history_project_timestamp_idx'),
+        ]
+    
     def __str__(self):
-        return f"{self.issue.issue_title} - {self.action}"
+        return f"Issue {self.issue_id} - {self.action}"
+class Change(models.Model):
+    """
+    One entry of the sync change feed (core.sync): "this object changed or
+    went away". ``id`` is the change sequence clients sync from. Ids are
+    plain integers so entries outlive the rows they describe (tombstones).
+    Membership changes carry the user who was added or removed. Changes to
+    issues, comments and attachments carry the issue's trade and priority,
+    so a user is only sent tombstones for what they could see.
+    """
+    KIND_CHOICES = [
+        ('project', 'project'),
+        ('issue', 'issue'),
+        ('comment', 'comment'),
+        ('attachment', 'attachment'),
+    ]
+    
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    # The project the object belongs (or belonged) to, what the feed is scoped by
+    project_id = models.BigIntegerField(null=True, blank=True)
+    user_id = models.BigIntegerField(null=True, blank=True)
+    # The issue's trade and priority (before the change, for an issue that
+    # left someone's view), what sub-contractors and safety officers are scoped by
+    trade_id = models.BigIntegerField(null=True, blank=True)
+    priority = models.CharField(max_length=100, blank=True, default='')
+    changed_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            # /api/sync/ for a user: their projects' changes after a sequence number
+            models.Index(fields=['project_id', 'id'], name='change_project_seq_idx'),
+            models.Index(
+                fields=['user_id', 'id'],
+                name='change_user_seq_idx',
+                condition=Q(user_id__isnull=False),
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.id}: {self.kind} {self.object_id}"
+
 class Comment(models.Model):
     issue = models.ForeignKey(Issue, on_delete=models.CASCADE)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='comments')
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp', 'id'], name='comment_timestamp_id_idx'),
+            models.Index(fields=['issue', 'timestamp', 'id'], name='comment_issue_timestamp_idx'),
+        ]
 
 class Attachment(models.Model):
     issue = models.ForeignKey(Issue, on_delete=models.CASCADE)  
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='attachments')
-    file = models.FileField(upload_to='attachments/')
+    # Stored once per distinct content, see core/storage.py
+    file = BlobField(upload_to='attachments/', storage=BlobStorage())
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # Filled in by BlobField as the file is saved (it needs them after ``file``)
+    file_name = models.CharField(max_length=255, blank=True, default='')
+    file_size = models.BigIntegerField(default=0)
+    content_type = models.CharField(max_length=100, blank=True, default='')
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['uploaded_at', 'id'], name='attachment_uploaded_id_idx'),
+            # References to a blob, counted by core.blobs
+            models.Index(fields=['file'], name='attachment_file_idx'),
+        ]
+class ProjectIssueStat(models.Model):
+    """
+    Number of issues in a project for each status x priority x trade.
+    Derived data, kept up to date by core.summary on every Issue save/delete.
+    """
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='issue_stats')
+    status = models.CharField(max_length=50)
+    priority = models.CharField(max_length=100)
+    trade = models.ForeignKey(Trade, on_delete=models.CASCADE)
+    issue_count = models.IntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['project', 'status', 'priority', 'trade'], name='unique_project_issue_stat'),
+        ]
+
+class ProjectOpenIssueStat(models.Model):
+    """
+    Number of open issues in a project per trade, priority, assignee and due
+    date, so overdue counts and per-assignee workload never touch Issue.
+    Derived data, kept up to date by core.summary.
+    """
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='open_issue_stats')
+    trade = models.ForeignKey(Trade, on_delete=models.CASCADE)
+    priority = models.CharField(max_length=100)
+    assigned_to = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+    due_date = models.DateField()
+    issue_count = models.IntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            # NULLs are never equal in a unique index, so unassigned rows need their own
+            models.UniqueConstraint(
+                fields=['project', 'trade', 'priority', 'assigned_to', 'due_date'],
+                condition=Q(assigned_to__isnull=False),
+                name='unique_project_open_stat',
+            ),
+            models.UniqueConstraint(
+                fields=['project', 'trade', 'priority', 'due_date'],
+                condition=Q(assigned_to__isnull=True),
+                name='unique_project_open_stat_unassigned',
+            ),
+        ]
+
+class UploadSession(models.Model):
+    """
+    A chunked attachment upload in progress. Chunks are appended to a
+    partial file on disk and ``offset`` records how many bytes have been
+    received, so an interrupted upload resumes from there instead of from
+    byte zero. The Attachment is created when the last chunk arrives.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    issue = models.ForeignKey(Issue, on_delete=models.CASCADE, related_name='upload_sessions')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    file_name = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    attachment = models.OneToOneField(Attachment, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.file_name} ({self.offset}/{self.total_size})"
+
 class Notification(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notifications')
     title = models.CharField(max_length=200)
@@ -115,6 +309,17 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'is_read', 'created_at'], name='notification_user_read_idx'),
+            # unread notifications only: the badge count and inbox
+            models.Index(
+                fields=['user', 'created_at'],
+                name='notification_unread_idx',
+                condition=Q(is_read=False),
+            ),
+        ]
+    
     def __str__(self):
         return f"{self.user.email} - {self.title}"
     
\ No newline at end of file
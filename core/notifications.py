@@ -0,0 +1,161 @@
+"""
+Notification fan-out.
+
+Issue events (created, status changed, assigned, commented) are queued once
+the request's transaction commits and written by a background thread, so
+request latency does not depend on the size of the project team.
+
+The worker waits NOTIFICATION_COALESCE_SECONDS before writing an issue's
+events, and every event on that issue in the meantime becomes part of the
+same notification. Recipients are the project's assigned users who can see
+the issue under the same role rules as IssueViewSet (see core.visibility),
+minus whoever made the change. Everything for a batch is written with one
+bulk insert.
+
+When the process exits (a worker restart or a deploy) the thread is
+stopped and whatever is still queued is written straight away, from an
+atexit handler and gunicorn's worker_exit hook (gunicorn.conf.py).
+
+With NOTIFICATION_ASYNC off no thread is started and events wait until
+``dispatcher.flush()`` is called (used by the tests).
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import Issue, Notification, Project
+from .visibility import Visibility
+
+logger = logging.getLogger(__name__)
+
+EVENT_TITLES = {
+    'created': 'New issue',
+    'status_changed': 'Issue status changed',
+    'assigned': 'Issue reassigned',
+    'commented': 'New comment',
+}
+
+BATCH_SIZE = 500
+
+
+class NotificationDispatcher:
+    def __init__(self):
+        self._pending = {}  # issue id -> {'since': monotonic time, 'events': [(event, message, actor id)]}
+        self._lock = threading.Lock()
+        self._worker = None
+        self._stop = threading.Event()
+        self._exit_registered = False
+
+    def enqueue(self, issue_id, event, message, actor_id=None):
+        with self._lock:
+            entry = self._pending.setdefault(issue_id, {'since': time.monotonic(), 'events': []})
+            entry['events'].append((event, message, actor_id))
+        if settings.NOTIFICATION_ASYNC:
+            self._start_worker()
+
+    def flush(self, older_than=0):
+        """Write the notifications for issues queued at least ``older_than`` seconds ago."""
+        cutoff = time.monotonic() - older_than
+        with self._lock:
+            ready = {
+                issue_id: entry['events']
+                for issue_id, entry in self._pending.items()
+                if entry['since'] <= cutoff
+            }
+            for issue_id in ready:
+                del self._pending[issue_id]
+        if not ready:
+            return 0
+        return write_notifications(ready)
+
+    def shutdown(self, timeout=10):
+        """Stop the worker and write everything still queued. Returns how many notifications were written."""
+        with self._lock:
+            worker, stop = self._worker, self._stop
+        stop.set()
+        if worker is not None and worker is not threading.current_thread():
+            # Let a batch it is writing finish
+            worker.join(timeout)
+        try:
+            return self.flush()
+        except Exception:
+            logger.exception('Could not write the queued notifications at shutdown')
+            return 0
+
+    def _start_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._stop = threading.Event()
+                self._worker = threading.Thread(
+                    target=self._run, args=(self._stop,), name='notification-fanout', daemon=True
+                )
+                self._worker.start()
+                if not self._exit_registered:
+                    # Daemon threads are killed at exit, so drain the queue first
+                    atexit.register(self.shutdown)
+                    self._exit_registered = True
+
+    def _run(self, stop):
+        window = settings.NOTIFICATION_COALESCE_SECONDS
+        while not stop.wait(max(window / 2, 0.1)):
+            try:
+                self.flush(older_than=window)
+            except Exception:
+                logger.exception('Notification fan-out failed')
+            finally:
+                close_old_connections()
+
+
+dispatcher = NotificationDispatcher()
+
+
+def notify(issue, event, message, actor=None):
+    """Queue a notification about ``issue`` once the current transaction commits."""
+    actor_id = actor.pk if actor is not None else None
+    issue_id = issue.pk
+    transaction.on_commit(lambda: dispatcher.enqueue(issue_id, event, message, actor_id))
+
+
+def write_notifications(events_by_issue):
+    """Fan ``{issue id: [(event, message, actor id)]}`` out to the project teams."""
+    issues = Issue.objects.in_bulk(list(events_by_issue))
+
+    members = {}  # project id -> [(user id, role, specialty)]
+    memberships = Project.assigned_users.through.objects.filter(
+        project_id__in={issue.project_id for issue in issues.values()},
+        customuser__is_active=True,
+    ).values_list('project_id', 'customuser_id', 'customuser__role', 'customuser__specialty')
+    for project_id, user_id, role, specialty in memberships:
+        members.setdefault(project_id, []).append((user_id, role, specialty))
+
+    notifications = []
+    for issue_id, events in events_by_issue.items():
+        issue = issues.get(issue_id)
+        if issue is None:
+            continue  # deleted since
+
+        for user_id, role, specialty in members.get(issue.project_id, []):
+            scope = Visibility(role=role, specialty=specialty, assigned_project_ids=frozenset([issue.project_id]))
+            if not scope.can_see_issue(issue):
+                continue
+            # Nobody needs telling about their own changes
+            theirs = [(event, message) for event, message, actor_id in events if actor_id != user_id]
+            if theirs:
+                notifications.append(build_notification(user_id, issue, theirs))
+
+    Notification.objects.bulk_create(notifications, batch_size=BATCH_SIZE)
+    return len(notifications)
+
+
+def build_notification(user_id, issue, events):
+    if len(events) == 1:
+        event, message = events[0]
+        title = EVENT_TITLES.get(event, 'Issue updated')
+    else:
+        title = f'{len(events)} updates on "{issue.issue_title}"'
+        message = '\n'.join(message for event, message in events)
+    return Notification(user_id=user_id, issue=issue, title=title[:200], message=message)
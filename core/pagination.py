@@ -0,0 +1,281 @@
+"""
+Keyset (cursor) pagination.
+
+Page number pagination runs a COUNT(*) and an OFFSET scan on every page, so
+deep pages get slower as the tables grow. Keyset pagination instead remembers
+the ordering values of the last row it returned and asks for the rows after
+it, which the composite indexes on (created_at, id) / (timestamp, id) answer
+directly no matter how deep the client is.
+
+It is opt-in: send ``?pagination=cursor`` for the first page and follow the
+``next`` / ``previous`` links from there.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.paginator import InvalidPage, Paginator
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    page_size = api_settings.PAGE_SIZE or 20
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering=('-created_at',)):
+        self.default_ordering = tuple(ordering)
+
+    @classmethod
+    def is_requested(cls, request):
+        """True when the client asked for cursor mode or is following a cursor link."""
+        params = request.query_params
+        return cls.cursor_query_param in params or params.get(cls.mode_query_param) == 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        return self.page_rows(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() for the async views."""
+        queryset = self.page_queryset(queryset, request, view)
+        return self.page_rows([row async for row in queryset])
+
+    def page_queryset(self, queryset, request, view=None):
+        """The (unevaluated) query for one page plus one row to see if there is more."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.keys = self.get_keys(queryset, request, view)
+
+        cursor = self.decode_cursor(request)
+        self.reverse = cursor['r'] if cursor else False
+        self.position = cursor['v'] if cursor else None
+
+        order_by = [
+            f"{'-' if desc != self.reverse else ''}{name}" for name, desc in self.keys
+        ]
+        queryset = queryset.order_by(*order_by)
+        if self.position is not None:
+            queryset = queryset.filter(self.after(self.position, self.reverse))
+        return queryset[:self.page_size + 1]
+
+    def page_rows(self, rows):
+        reverse, position = self.reverse, self.position
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        if reverse:
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.first_row = rows[0] if rows else None
+        self.last_row = rows[-1] if rows else None
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_keys(self, queryset, request, view):
+        """
+        Work out the (column, descending) pairs to page on. Uses the same
+        ordering OrderingFilter applied (so ``?ordering=priority`` keeps
+        working) and always ends with ``id`` so every position is unique.
+        """
+        ordering = None
+        if view is not None:
+            for backend in getattr(view, 'filter_backends', []):
+                if issubclass(backend, OrderingFilter):
+                    ordering = backend().get_ordering(request, queryset, view)
+                    break
+            if not ordering:
+                ordering = getattr(view, 'cursor_ordering', None)
+        ordering = ordering or self.default_ordering
+
+        opts = queryset.model._meta
+        keys = []
+        for term in ordering:
+            desc = term.startswith('-')
+            name = term.lstrip('-')
+            if name == 'pk':
+                name = opts.pk.name
+            # Page on the raw column for foreign keys (user -> user_id)
+            name = opts.get_field(name).attname
+            keys.append((name, desc))
+
+        if opts.pk.attname not in [name for name, desc in keys]:
+            keys.append((opts.pk.attname, keys[-1][1] if keys else False))
+        return keys
+
+    def after(self, position, reverse):
+        """
+        Q matching the rows that come after ``position`` in the current
+        ordering: (a > x) OR (a = x AND b > y) OR ...
+        """
+        condition = Q()
+        for index, (name, desc) in enumerate(self.keys):
+            lookup = 'lt' if desc != reverse else 'gt'
+            step = Q(**{f'{name}__{lookup}': position[index]})
+            for prev_index in range(index):
+                step &= Q(**{self.keys[prev_index][0]: position[prev_index]})
+            condition |= step
+        return condition
+
+    def get_next_link(self):
+        if not self.has_next or self.last_row is None:
+            return None
+        return self.encode_link(self.last_row, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_row is None:
+            return None
+        return self.encode_link(self.first_row, reverse=True)
+
+    def encode_link(self, row, reverse):
+        values = []
+        for name, desc in self.keys:
+            value = getattr(row, name)
+            # Keep full microsecond precision, DjangoJSONEncoder would
+            # truncate datetimes to milliseconds and skip rows.
+            if isinstance(value, (datetime.date, datetime.datetime)):
+                value = value.isoformat()
+            values.append(value)
+
+        payload = {'o': self.signature(), 'v': values, 'r': reverse}
+        encoded = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+        url = remove_query_param(self.base_url, self.mode_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            valid = (
+                cursor['o'] == self.signature()
+                and len(cursor['v']) == len(self.keys)
+                and isinstance(cursor['r'], bool)
+            )
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            valid = False
+        if not valid:
+            # Also catches cursors issued for a different ?ordering=
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def signature(self):
+        return [f"{'-' if desc else ''}{name}" for name, desc in self.keys]
+
+
+class PageOrCursorPagination(PageNumberPagination):
+    """
+    The usual page number pagination, switching to keyset pagination when
+    the client asks for it. The keyset ordering comes from the view's
+    ``cursor_ordering``.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if KeysetPagination.is_requested(request):
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+def paginate_nested(request, queryset, serializer_class, ordering):
+    """
+    Keyset-paginated response for the nested function views
+    (``project_issues``, ``issue_comments``). Returns None when the client
+    did not ask for cursor mode so those views keep returning full lists.
+    """
+    if not KeysetPagination.is_requested(request):
+        return None
+    paginator = KeysetPagination(ordering=ordering)
+    page = paginator.paginate_queryset(queryset, request)
+    return paginator.get_paginated_response(serializer_class(page, many=True, context={'request': request}).data)
+
+
+async def apaginate_nested(request, queryset, serializer_class, ordering):
+    """paginate_nested() for the async views. Returns the response data or None."""
+    if not KeysetPagination.is_requested(request):
+        return None
+    paginator = KeysetPagination(ordering=ordering)
+    page = await paginator.apaginate_queryset(queryset, request)
+    return paginator.get_paginated_data(serializer_class(page, many=True, context={'request': request}).data)
+
+
+async def apaginate(request, queryset, serializer_class, view=None):
+    """
+    PageOrCursorPagination for the async views, returning the same response
+    data. Page number mode counts with acount() and works out the page from
+    the count alone, so nothing but the page itself is loaded.
+    """
+    if KeysetPagination.is_requested(request):
+        paginator = KeysetPagination()
+        page = await paginator.apaginate_queryset(queryset, request, view)
+        return paginator.get_paginated_data(serializer_class(page, many=True, context={'request': request}).data)
+
+    page_size = api_settings.PAGE_SIZE
+    count = await queryset.acount()
+    pages = Paginator(range(count), page_size)
+    page_number = request.query_params.get(PageNumberPagination.page_query_param, 1)
+    if page_number in PageNumberPagination.last_page_strings:
+        page_number = pages.num_pages
+    try:
+        page = pages.page(page_number)
+    except InvalidPage:
+        raise NotFound(PageNumberPagination.invalid_page_message)
+
+    offset = (page.number - 1) * page_size
+    rows = [row async for row in queryset[offset:offset + page_size]]
+
+    url = request.build_absolute_uri()
+    next_link = previous_link = None
+    if page.has_next():
+        next_link = replace_query_param(url, PageNumberPagination.page_query_param, page.number + 1)
+    if page.has_previous():
+        if page.number - 1 == 1:
+            previous_link = remove_query_param(url, PageNumberPagination.page_query_param)
+        else:
+            previous_link = replace_query_param(url, PageNumberPagination.page_query_param, page.number - 1)
+
+    return {
+        'count': count,
+        'next': next_link,
+        'previous': previous_link,
+        'results': serializer_class(rows, many=True, context={'request': request}).data,
+    }
@@ -0,0 +1,79 @@
+"""
+Renderers and parsers for the API.
+
+- ORJSONRenderer / ORJSONParser: JSON through orjson, several times faster
+  than the stdlib encoder DRF uses, byte-for-byte the same output for what
+  our serializers produce (compact, UTF-8, dates formatted by DRF, U+2028
+  and U+2029 escaped as DRF does so the output is also valid JavaScript).
+- MessagePackRenderer / MessagePackParser: ``Accept: application/msgpack``
+  (or ``?format=msgpack``). The same data as the JSON, smaller and cheaper
+  to decode on the phones and tablets used on site. Only offered when
+  msgpack is installed (it is in requirements.txt).
+
+The renderer is picked by content negotiation on ``Accept``, JSON when the
+client doesn't say. ``python manage.py benchmark_renderers`` compares them
+on issue pages. Large responses are also compressed, see
+core.middleware.CompressionMiddleware.
+"""
+import orjson
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Whatever orjson / msgpack can't encode themselves goes through DRF's encoder
+# (lazy strings, Decimals, querysets, ...); dates too, so they come out in
+# DRF's format rather than orjson's
+_encoder = JSONEncoder()
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+LINE_SEPARATOR = '\u2028'.encode()
+PARAGRAPH_SEPARATOR = '\u2029'.encode()
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            # orjson only indents by 2, leave pretty printing to the stdlib
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = orjson.dumps(data, default=_encoder.default, option=ORJSON_OPTIONS)
+        # orjson leaves the line and paragraph separators raw, DRF escapes them
+        return ret.replace(LINE_SEPARATOR, b'\\u2028').replace(PARAGRAPH_SEPARATOR, b'\\u2029')
+
+
+class ORJSONParser(JSONParser):
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_encoder.default, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
@@ -0,0 +1,150 @@
+"""
+Response cache and conditional GETs for the read-mostly endpoints
+(projects, trades, issue detail).
+
+Each cached view names the models its output depends on. Every model has a
+version counter in the cache that is bumped after any write to it commits
+(see core.signals, and core.bulk for the paths that skip signals). A
+response is stored under the request path, the user's visibility scope and
+the current versions, and its ETag is derived from that same key.
+
+So a client sending ``If-None-Match`` with the ETag it already has gets a
+304 before the database is touched at all, and a changed model or scope
+simply produces a new key.
+
+The version counters have to be seen by every process, so all of this is
+off (settings.RESPONSE_CACHE) unless the cache is shared between them.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+from .visibility import get_visibility
+
+
+def _version_key(name):
+    return f'response:version:{name}'
+
+
+def versions(names):
+    """Current version of each model name, starting any that are missing."""
+    keys = [_version_key(name) for name in names]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # A timestamp, so an evicted counter can't come back at an old value
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def bump(*names):
+    for name in names:
+        try:
+            cache.incr(_version_key(name))
+        except ValueError:
+            cache.set(_version_key(name), time.time_ns(), None)
+
+
+def changed(*names):
+    """Bump these models' versions once the current transaction commits."""
+    transaction.on_commit(lambda: bump(*names))
+
+
+def scope_key(user):
+    """Users who see exactly the same rows share cache entries."""
+    scope = get_visibility(user)
+    if scope.see_all:
+        return 'all'
+    project_ids = ','.join(str(project_id) for project_id in sorted(scope.assigned_project_ids))
+    return f'{scope.role}:{scope.specialty}:{project_ids}'
+
+
+class CachedResponseMixin:
+    """
+    Cache ``list`` / ``retrieve`` of a viewset and answer conditional GETs.
+
+    - cache_models: model names whose versions the output depends on
+    - cache_actions: which of 'list' and 'retrieve' to cache
+    - cache_scoped: False when every user sees the same data
+    """
+    cache_models = ()
+    cache_actions = ('list', 'retrieve')
+    cache_scoped = True
+
+    def list(self, request, *args, **kwargs):
+        if 'list' not in self.cache_actions or not settings.RESPONSE_CACHE:
+            return super().list(request, *args, **kwargs)
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        if 'retrieve' not in self.cache_actions or not settings.RESPONSE_CACHE:
+            return super().retrieve(request, *args, **kwargs)
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+    def response_cache_key(self, request):
+        parts = [
+            request.get_full_path(),
+            request.accepted_renderer.format,
+            scope_key(request.user) if self.cache_scoped else '*',
+            *(str(version) for version in versions(self.cache_models)),
+        ]
+        return 'response:' + hashlib.md5('|'.join(parts).encode(), usedforsecurity=False).hexdigest()
+
+    def last_modified(self, data):
+        """Timestamp for the Last-Modified header, from the ``updated_at`` of a single object."""
+        if isinstance(data, dict) and data.get('updated_at'):
+            modified = parse_datetime(str(data['updated_at']))
+            if modified is not None:
+                return int(modified.timestamp())
+        return None
+
+    def cached_response(self, request, view, *args, **kwargs):
+        key = self.response_cache_key(request)
+        etag = f'"{key.rsplit(":", 1)[1]}"'
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        # Weak comparison: CompressionMiddleware hands out compressed responses with W/ ETags
+        if if_none_match and (if_none_match.strip() == '*' or etag in {
+            tag.removeprefix('W/') for tag in parse_etags(if_none_match)
+        }):
+            return self.not_modified(etag, None)
+
+        entry = cache.get(key)
+        if entry is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            entry = {'data': response.data, 'last_modified': self.last_modified(response.data)}
+            cache.set(key, entry, settings.RESPONSE_CACHE_TIMEOUT)
+        else:
+            if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+            if (not if_none_match and entry['last_modified'] is not None
+                    and if_modified_since is not None and entry['last_modified'] <= if_modified_since):
+                return self.not_modified(etag, entry['last_modified'])
+            response = Response(entry['data'])
+
+        self.add_validators(response, etag, entry['last_modified'])
+        return response
+
+    def not_modified(self, etag, last_modified):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        self.add_validators(response, etag, last_modified)
+        return response
+
+    def add_validators(self, response, etag, last_modified):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        # Clients may keep the response but must check it is still current,
+        # and it must never be shared between users
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Authorization'])
@@ -0,0 +1,248 @@
+"""
+Full-text search for issues and comments.
+
+``icontains`` compiles to ``ILIKE '%term%'`` which has to read every row.
+Instead each searchable table gets an index maintained by the database
+itself (triggers), so inserts from bulk paths are covered too:
+
+- PostgreSQL: a ``search_vector`` tsvector column with a GIN index
+- SQLite: an FTS5 table ``<table>_fts`` (tests and local development)
+
+Query syntax (same on both backends):
+
+- ``leak pipe``      both words, in any order
+- ``"burst pipe"``   the exact phrase
+- ``elec*``          prefix match
+
+Results are ranked by relevance and carry a highlighted snippet as the
+``search_rank`` / ``search_snippet`` annotations.
+"""
+import logging
+import re
+
+from django.db import connections
+from django.db.models import FloatField, Q, TextField
+from django.db.models.expressions import RawSQL
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CONFIG = 'english'
+
+# table -> (indexed columns, column used for the snippet)
+SEARCH_TABLES = {
+    'core_issue': (('issue_title', 'detailed_description'), 'detailed_description'),
+    'core_comment': (('content',), 'content'),
+}
+
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_STOP = '</mark>'
+
+_TOKEN_RE = re.compile(r'"([^"]*)"?|(\S+)')
+_WORD_RE = re.compile(r'\w+')
+
+# db alias -> whether the SQLite FTS5 tables exist
+_sqlite_ready = {}
+
+
+def parse_query(text):
+    """
+    Split a search string into terms. Each term is ``(words, prefix)``:
+    a phrase when it has several words, a prefix match when ``prefix`` is set.
+    Anything that is not a word character is dropped, so the result is safe
+    to hand to either backend's query syntax.
+    """
+    terms = []
+    for phrase, token in _TOKEN_RE.findall(text or ''):
+        if phrase:
+            words = _WORD_RE.findall(phrase)
+            prefix = False
+        else:
+            words = _WORD_RE.findall(token)
+            prefix = token.endswith('*')
+        if words:
+            terms.append((tuple(words), prefix))
+    return terms
+
+
+def search(queryset, text):
+    """Filter ``queryset`` to rows matching ``text``, best matches first."""
+    table = queryset.model._meta.db_table
+    if table not in SEARCH_TABLES:
+        raise ValueError(f'{queryset.model.__name__} is not searchable')
+
+    terms = parse_query(text)
+    if not terms:
+        return queryset.none()
+
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        return _search_postgres(queryset, table, terms)
+    if connection.vendor == 'sqlite' and _sqlite_search_ready(connection):
+        return _search_sqlite(queryset, table, terms)
+    return _search_fallback(queryset, table, terms)
+
+
+def _search_postgres(queryset, table, terms):
+    from django.contrib.postgres.search import (
+        SearchHeadline, SearchQuery, SearchRank, SearchVectorField,
+    )
+
+    tsquery = ' & '.join(
+        ' <-> '.join(words) + (':*' if prefix else '')
+        for words, prefix in terms
+    )
+    query = SearchQuery(tsquery, search_type='raw', config=SEARCH_CONFIG)
+    vector = RawSQL(f'{_quote(table)}.search_vector', [], output_field=SearchVectorField())
+    columns, snippet_column = SEARCH_TABLES[table]
+
+    return queryset.alias(search_vector=vector).filter(search_vector=query).annotate(
+        search_rank=SearchRank(vector, query),
+        search_snippet=SearchHeadline(
+            snippet_column, query, config=SEARCH_CONFIG,
+            start_sel=HIGHLIGHT_START, stop_sel=HIGHLIGHT_STOP, max_words=30, min_words=10,
+        ),
+    ).order_by('-search_rank', '-pk')
+
+
+def _search_sqlite(queryset, table, terms):
+    fts = f'{table}_fts'
+    columns, snippet_column = SEARCH_TABLES[table]
+    match = ' AND '.join(
+        '"' + ' '.join(words) + '"' + ('*' if prefix else '')
+        for words, prefix in terms
+    )
+    # bm25() and snippet() only work inside a full-text query, so both are
+    # correlated subqueries against the FTS table for the current row.
+    where = f'{_quote(fts)} MATCH %s AND rowid = {_quote(table)}.id'
+    rank = RawSQL(f'SELECT -bm25({_quote(fts)}) FROM {_quote(fts)} WHERE {where}', [match],
+                  output_field=FloatField())
+    snippet = RawSQL(
+        f"SELECT snippet({_quote(fts)}, {columns.index(snippet_column)}, "
+        f"'{HIGHLIGHT_START}', '{HIGHLIGHT_STOP}', '...', 16) FROM {_quote(fts)} WHERE {where}",
+        [match], output_field=TextField(),
+    )
+    matching = RawSQL(f'SELECT rowid FROM {_quote(fts)} WHERE {_quote(fts)} MATCH %s', [match])
+
+    return queryset.filter(pk__in=matching).annotate(
+        search_rank=rank,
+        search_snippet=snippet,
+    ).order_by('-search_rank', '-pk')
+
+
+def _search_fallback(queryset, table, terms):
+    """No full-text index on this database: plain icontains, unranked."""
+    columns, snippet_column = SEARCH_TABLES[table]
+    for words, prefix in terms:
+        phrase = ' '.join(words)
+        condition = Q()
+        for column in columns:
+            condition |= Q(**{f'{column}__icontains': phrase})
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+def _quote(name):
+    return f'"{name}"'
+
+
+# Index maintenance -----------------------------------------------------
+
+def install_search_index(connection):
+    """Create the search index, its triggers and backfill it. Safe to re-run."""
+    if connection.vendor == 'postgresql':
+        _install_postgres(connection)
+    elif connection.vendor == 'sqlite':
+        _install_sqlite(connection)
+
+
+def drop_search_index(connection):
+    with connection.cursor() as cursor:
+        for table in SEARCH_TABLES:
+            if connection.vendor == 'postgresql':
+                cursor.execute(f'DROP TRIGGER IF EXISTS {table}_search_update ON {table}')
+                cursor.execute(f'DROP INDEX IF EXISTS {table}_search_idx')
+                cursor.execute(f'ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector')
+            elif connection.vendor == 'sqlite':
+                for suffix in ('insert', 'delete', 'update'):
+                    cursor.execute(f'DROP TRIGGER IF EXISTS {table}_fts_{suffix}')
+                cursor.execute(f'DROP TABLE IF EXISTS {table}_fts')
+    _sqlite_ready.pop(connection.alias, None)
+
+
+def _install_postgres(connection):
+    config = f'pg_catalog.{SEARCH_CONFIG}'
+    with connection.cursor() as cursor:
+        for table, (columns, snippet_column) in SEARCH_TABLES.items():
+            column_list = ', '.join(columns)
+            document = " || ' ' || ".join(f"coalesce({column}, '')" for column in columns)
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector')
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {table}_search_idx ON {table} USING gin(search_vector)'
+            )
+            cursor.execute(f'DROP TRIGGER IF EXISTS {table}_search_update ON {table}')
+            cursor.execute(
+                f'CREATE TRIGGER {table}_search_update '
+                f'BEFORE INSERT OR UPDATE OF {column_list} ON {table} FOR EACH ROW '
+                f"EXECUTE FUNCTION tsvector_update_trigger(search_vector, '{config}', {column_list})"
+            )
+            cursor.execute(
+                f"UPDATE {table} SET search_vector = to_tsvector('{config}', {document}) "
+                f'WHERE search_vector IS NULL'
+            )
+
+
+def _install_sqlite(connection):
+    with connection.cursor() as cursor:
+        for table, (columns, snippet_column) in SEARCH_TABLES.items():
+            fts = f'{table}_fts'
+            column_list = ', '.join(columns)
+            new_values = ', '.join(f'new.{column}' for column in columns)
+            old_values = ', '.join(f'old.{column}' for column in columns)
+
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+                [f'{fts}_%'],
+            )
+            if cursor.fetchone()[0] == 3:
+                continue
+
+            try:
+                cursor.execute(
+                    f'CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5('
+                    f"{column_list}, content='{table}', content_rowid='id', "
+                    f"tokenize='porter unicode61')"
+                )
+            except Exception:
+                logger.warning('SQLite was built without FTS5, search falls back to icontains')
+                return
+
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN '
+                f'INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values}); END'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); END"
+            )
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column_list} ON {table} BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); "
+                f'INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values}); END'
+            )
+            # Triggers were missing (new index, or a migration rebuilt the
+            # table and dropped them), so the index may be stale
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    _sqlite_ready.pop(connection.alias, None)
+
+
+def _sqlite_search_ready(connection):
+    if connection.alias not in _sqlite_ready:
+        with connection.cursor() as cursor:
+            names = [f'{table}_fts' for table in SEARCH_TABLES]
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name IN (%s)"
+                % ', '.join(['%s'] * len(names)),
+                names,
+            )
+            _sqlite_ready[connection.alias] = cursor.fetchone()[0] == len(SEARCH_TABLES)
+    return _sqlite_ready[connection.alias]
@@ -1,27 +1,210 @@
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from django.urls import reverse
 from rest_framework import serializers
+from rest_framework.fields import empty
+from . import derivatives, downloads, metrics, trades
 from .models import Project, Trade, Issue, Comment, Attachment, CustomUser, Notification, IssueHistory
 
-class UserSerializer(serializers.ModelSerializer):
+# Each serializer that reads through a relation has a setup_eager_loading()
+# that adds the matching select_related / prefetch_related, so a list costs
+# the same number of queries whatever the page size. Views must pass their
+# querysets through it.
+
+class TimedSerializerMixin:
+    """Count the time spent validating and rendering towards the request's metrics (core.metrics)."""
+    
+    def run_validation(self, data=empty):
+        with metrics.serializer_timer():
+            return super().run_validation(data)
+    
+    def to_representation(self, instance):
+        with metrics.serializer_timer():
+            return super().to_representation(instance)
+
+class SearchResultMixin:
+    """Add the relevance rank and highlighted snippet to full-text search results."""
+    
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if hasattr(instance, 'search_rank'):
+            data['search_rank'] = instance.search_rank
+            data['search_snippet'] = instance.search_snippet
+        return data
+
+def requested_fields(request):
+    """
+    ``(fields, expand)`` asked for with ``?fields=a,b`` / ``?expand=c,d``:
+    a set of field names or None for all of them, and a list of expansions.
+    Only GETs render sparse, a write always returns the whole object.
+    """
+    if request is None or request.method not in ('GET', 'HEAD'):
+        return None, []
+    params = request.query_params
+    fields = params.get('fields')
+    fields = {name.strip() for name in fields.split(',') if name.strip()} | {'id'} if fields else None
+    expand = [name.strip() for name in params.get('expand', '').split(',') if name.strip()]
+    return fields, expand
+
+class Expansion:
+    """
+    Related data a serializer adds with ``?expand=<name>``: the field that
+    renders it, and how to load it without a query per row.
+    """
+    
+    def __init__(self, field, select_related=(), columns=(), annotate=None):
+        self.field = field  # makes the serializer field
+        self.select_related = select_related
+        self.columns = columns  # for .only(), when ?fields= is given too
+        self.annotate = annotate or {}
+
+class SparseFieldsMixin:
+    """
+    ``?fields=id,issue_title,status`` renders only those fields and
+    ``?expand=project,comments_count`` adds the related data listed in
+    ``expandable`` (an expanded relation replaces its id). Unknown names are
+    ignored. Needs the request in the serializer context.
+    
+    setup_sparse_loading() is setup_eager_loading() for a request: it loads
+    just the columns (``.only()``) and relations the response will use.
+    ``sparse_columns`` names the columns a field reads when it isn't the
+    field's own source, ``always_loaded`` the ones a view needs whatever is
+    rendered (the orderings pagination reads back).
+    """
+    expandable = {}
+    sparse_columns = {}
+    always_loaded = ()
+    
+    def get_fields(self):
+        fields = super().get_fields()
+        only, expand = requested_fields(self.context.get('request'))
+        expand = [name for name in expand if name in self.expandable]
+        for name in expand:
+            fields[name] = self.expandable[name].field()
+        if only is not None:
+            fields = {name: field for name, field in fields.items() if name in only or name in expand}
+        return fields
+    
+    @classmethod
+    def setup_sparse_loading(cls, queryset, request):
+        only, expand = requested_fields(request)
+        expansions = [cls.expandable[name] for name in expand if name in cls.expandable]
+        
+        if only is None:
+            queryset = cls.setup_eager_loading(queryset)
+        else:
+            declared = cls().fields
+            columns = {'id', *cls.always_loaded}
+            for name in only:
+                if name in cls.sparse_columns:
+                    columns.update(cls.sparse_columns[name])
+                elif name in declared and declared[name].source != '*':
+                    columns.add(declared[name].source.replace('.', '__'))
+            for expansion in expansions:
+                columns.update(expansion.columns)
+            # A column across a relation (project__project_name) joins it in
+            relations = {column.rsplit('__', 1)[0] for column in columns if '__' in column}
+            if relations:
+                queryset = queryset.select_related(*sorted(relations))
+            queryset = queryset.only(*sorted(columns))
+        
+        for expansion in expansions:
+            if expansion.select_related:
+                queryset = queryset.select_related(*expansion.select_related)
+            if expansion.annotate:
+                queryset = queryset.annotate(**expansion.annotate)
+        return queryset
+
+class ProjectRefSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Project
+        fields = ['id', 'project_name']
+
+class TradeRefSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Trade
+        fields = ['id', 'name']
+
+class UserRefSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomUser
+        fields = ['id', 'username', 'email']
+
+class IssueRefSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Issue
+        fields = ['id', 'issue_title']
+
+def comments_count():
+    comments = Comment.objects.filter(issue=OuterRef('pk')).order_by().values('issue').annotate(total=Count('id'))
+    return Coalesce(Subquery(comments.values('total'), output_field=IntegerField()), 0)
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = CustomUser
         fields = ['id', 'email', 'username', 'role', 'specialty', 'is_active']
         read_only_fields = ['id', 'is_active']
 
-class TradeSerializer(serializers.ModelSerializer):
+class TradeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Trade
         fields = '__all__'
 
-class ProjectSerializer(serializers.ModelSerializer):
-    trades = serializers.PrimaryKeyRelatedField(many=True, queryset=Trade.objects.all())
+class TradeField(serializers.PrimaryKeyRelatedField):
+    """Trade by primary key, checked against core.trades rather than with a query per value."""
+    
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            trade = trades.by_id(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if trade is None:
+            self.fail('does_not_exist', pk_value=data)
+        return trade
+
+class ProjectSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    trades = TradeField(many=True, queryset=Trade.objects.all())
     assigned_users = serializers.PrimaryKeyRelatedField(many=True, queryset=CustomUser.objects.all(), required=False)
     
     class Meta:
         model = Project
         fields = ['id', 'project_name', 'description', 'start_date', 'end_date', 'trades', 'assigned_users']
+    
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # Only the ids are rendered, don't load whole user rows
+        return queryset.prefetch_related(
+            Prefetch('trades', queryset=Trade.objects.only('id')),
+            Prefetch('assigned_users', queryset=CustomUser.objects.only('id')),
+        )
 
-class IssueSerializer(serializers.ModelSerializer):
+class IssueSerializer(TimedSerializerMixin, SearchResultMixin, SparseFieldsMixin, serializers.ModelSerializer):
     project_name = serializers.CharField(source='project.project_name', read_only=True)
+    trade = TradeField(queryset=Trade.objects.all())
+    
+    expandable = {
+        'project': Expansion(
+            lambda: ProjectRefSerializer(read_only=True),
+            select_related=('project',), columns=('project__id', 'project__project_name'),
+        ),
+        'trade': Expansion(
+            lambda: TradeRefSerializer(read_only=True),
+            select_related=('trade',), columns=('trade__id', 'trade__name'),
+        ),
+        'assigned_to': Expansion(
+            lambda: UserRefSerializer(read_only=True),
+            select_related=('assigned_to',),
+            columns=('assigned_to__id', 'assigned_to__username', 'assigned_to__email'),
+        ),
+        'comments_count': Expansion(
+            lambda: serializers.IntegerField(read_only=True),
+            annotate={'comments_count': comments_count()},
+        ),
+    }
+    # IssueViewSet.ordering_fields, for the cursor links
+    always_loaded = ('created_at', 'priority', 'due_date')
     
     class Meta:
         model = Issue
@@ -32,32 +215,94 @@ class IssueSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
     
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('project')
+    
     def validate_due_date(self, value):
         from django.utils import timezone
         if value < timezone.now().date():
             raise serializers.ValidationError("Due date cannot be in the past")
         return value
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(TimedSerializerMixin, SearchResultMixin, SparseFieldsMixin, serializers.ModelSerializer):
     # Show user email instead of just ID
     user_email = serializers.CharField(source='user.email', read_only=True)
     
+    expandable = {
+        'user': Expansion(
+            lambda: UserRefSerializer(read_only=True),
+            select_related=('user',), columns=('user__id', 'user__username', 'user__email'),
+        ),
+        'issue': Expansion(
+            lambda: IssueRefSerializer(read_only=True),
+            select_related=('issue',), columns=('issue__id', 'issue__issue_title'),
+        ),
+    }
+    # CommentViewSet.ordering_fields
+    always_loaded = ('timestamp', 'user')
+    
     class Meta:
         model = Comment
         fields = ['id', 'issue', 'user', 'user_email', 'content', 'timestamp']
         read_only_fields = ['id', 'user', 'timestamp']
+    
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('user')
 
-class AttachmentSerializer(serializers.ModelSerializer):
+class AttachmentSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     # Show user email and file info
     user_email = serializers.CharField(source='user.email', read_only=True)
-    file_name = serializers.CharField(source='file.name', read_only=True)
+    # Thumbnail and preview URLs for images, see core/derivatives.py
+    derivatives = serializers.SerializerMethodField()
+    # Signed, expiring link that downloads without auth, see core/downloads.py
+    download_url = serializers.SerializerMethodField()
+    
+    expandable = {
+        'user': Expansion(
+            lambda: UserRefSerializer(read_only=True),
+            select_related=('user',), columns=('user__id', 'user__username', 'user__email'),
+        ),
+        'issue': Expansion(
+            lambda: IssueRefSerializer(read_only=True),
+            select_related=('issue',), columns=('issue__id', 'issue__issue_title'),
+        ),
+    }
+    sparse_columns = {
+        'download_url': ('file', 'file_name', 'content_type', 'sha256'),
+        'derivatives': ('file', 'file_name'),
+    }
+    always_loaded = ('uploaded_at',)
     
     class Meta:
         model = Attachment
-        fields = ['id', 'issue', 'user', 'user_email', 'file', 'file_name', 'uploaded_at']
-        read_only_fields = ['id', 'user', 'uploaded_at']
+        fields = [
+            'id', 'issue', 'user', 'user_email', 'file', 'file_name', 'file_size', 'content_type', 'sha256',
+            'download_url', 'derivatives', 'uploaded_at'
+        ]
+        # Recorded from the file as it is stored (core.storage)
+        read_only_fields = ['id', 'user', 'file_name', 'file_size', 'content_type', 'sha256', 'uploaded_at']
+    
+    def get_download_url(self, attachment):
+        if not attachment.file:
+            return None
+        return downloads.signed_url(attachment, self.context.get('request'))
+    
+    def get_derivatives(self, attachment):
+        if not derivatives.has_derivatives(attachment):
+            return {}
+        request = self.context.get('request')
+        urls = {name: reverse('attachment-derivative', args=[attachment.id, name]) for name in derivatives.SIZES}
+        if request is not None:
+            urls = {name: request.build_absolute_uri(url) for name, url in urls.items()}
+        return urls
+    
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('user')
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     # Show issue title instead of just ID
     issue_title = serializers.CharField(source='issue.issue_title', read_only=True)
     
@@ -65,13 +310,22 @@ class NotificationSerializer(serializers.ModelSerializer):
         model = Notification
         fields = ['id', 'user', 'title', 'message', 'issue', 'issue_title', 'is_read', 'created_at']
         read_only_fields = ['id', 'created_at']
+    
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('issue')
 
-class IssueHistorySerializer(serializers.ModelSerializer):
+class IssueHistorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     # Show user email and issue title
     user_email = serializers.CharField(source='user.email', read_only=True)
-    issue_title = serializers.CharField(source='issue.issue_title', read_only=True)
+    # None once the issue is deleted
+    issue_title = serializers.CharField(source='issue.issue_title', read_only=True, allow_null=True)
     
     class Meta:
         model = IssueHistory
-        fields = ['id', 'issue', 'issue_title', 'user', 'user_email', 'action', 'old_value', 'new_value', 'timestamp']
-        read_only_fields = ['id', 'timestamp']
\ No newline at end of file
+        fields = ['id', 'issue', 'issue_title', 'project', 'user', 'user_email', 'action', 'old_value', 'new_value', 'timestamp']
+        read_only_fields = ['id', 'timestamp']
+    
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('user', 'issue')
@@ -0,0 +1,182 @@
+"""
+Signal handlers that keep the cached indexes (visibility, summary, response
+cache) in sync with the database.
+"""
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from . import audit, authentication, blobs, derivatives, events, notifications, response_cache, summary, sync, trades, visibility
+from .middleware import get_current_user
+from .models import Attachment, Comment, Issue, Project, Trade
+from .search import install_search_index
+
+
+@receiver(m2m_changed, sender=Project.assigned_users.through)
+def assigned_users_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidate the visibility index of every user whose assignments moved,
+    and make them refresh tokens that list their old projects.
+    """
+    if reverse:
+        # user.assigned_projects.add(...) - only that user is affected
+        user_ids = {instance.pk}
+    elif action == 'pre_clear':
+        # The ids are gone by post_clear, so remember them now
+        instance._cleared_user_ids = set(instance.assigned_users.values_list('id', flat=True))
+        return
+    elif action == 'post_clear':
+        user_ids = getattr(instance, '_cleared_user_ids', set())
+    else:
+        user_ids = pk_set or set()
+
+    if action in ('post_add', 'post_remove', 'post_clear') and user_ids:
+        transaction.on_commit(lambda: scope_changed(*user_ids))
+
+
+@receiver(m2m_changed, sender=Project.assigned_users.through)
+def membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """A sync feed entry for each (project, user) pair added or removed."""
+    if action == 'pre_clear':
+        related = instance.assigned_projects if reverse else instance.assigned_users
+        instance._cleared_membership_ids = set(related.values_list('id', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_cleared_membership_ids', set())
+    elif action not in ('post_add', 'post_remove'):
+        return
+
+    pairs = [(project_id, instance.pk) for project_id in pk_set] if reverse else \
+        [(instance.pk, user_id) for user_id in pk_set]
+    for project_id, user_id in pairs:
+        sync.record('project', project_id, project_id, user_id=user_id)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(sender, instance, created, **kwargs):
+    """Email, username, role, specialty or password may have changed, rebuild the index on next use."""
+    if not created:
+        transaction.on_commit(lambda: scope_changed(instance.pk))
+
+
+def scope_changed(*user_ids):
+    visibility.invalidate(*user_ids)
+    authentication.forget(*user_ids)
+
+
+@receiver([post_save, post_delete], sender=Project)
+def project_changed(sender, instance, **kwargs):
+    sync.record('project', instance.pk, instance.pk)
+    # Issue detail shows the project name
+    response_cache.changed('project', 'issue')
+
+
+@receiver([post_save, post_delete], sender=Trade)
+def trade_changed(sender, **kwargs):
+    # Deleting a trade also drops it from projects without an m2m signal
+    response_cache.changed('trade', 'project')
+    trades.changed()
+
+
+@receiver(m2m_changed, sender=Project.trades.through)
+@receiver(m2m_changed, sender=Project.assigned_users.through)
+def project_members_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        response_cache.changed('project')
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_deleted(sender, instance, **kwargs):
+    # Removes the user from assigned_users without an m2m signal
+    response_cache.changed('project')
+    user_id = instance.pk  # cleared once the delete is done
+    transaction.on_commit(lambda: authentication.forget(user_id))
+
+
+@receiver(post_migrate)
+def restore_sqlite_search_index(sender, using, **kwargs):
+    """
+    SQLite rebuilds a table to alter it, which drops the FTS triggers on it.
+    Put them back (and reindex) after every migrate. Postgres alters tables
+    in place so its triggers survive.
+    """
+    if sender.name == 'core' and connections[using].vendor == 'sqlite':
+        install_search_index(connections[using])
+
+
+@receiver(post_save, sender=Issue)
+def issue_saved(sender, instance, created, **kwargs):
+    """Everything that reacts to an issue changing, then remember its new values."""
+    actor = get_current_user()
+
+    summary.issue_saved(instance, created)
+    audit.record(instance, created)
+    # Moved to another project, trade or priority: also a tombstone for
+    # whoever could only see it where it was
+    sync.record_many('issue', sync.issue_changes(instance))
+    events.publish(events.issue_event(instance, 'created' if created else 'updated'))
+    response_cache.changed('issue')
+
+    if created:
+        notifications.notify(instance, 'created', f'"{instance.issue_title}" was reported', actor=actor)
+    elif instance.previous_value('status') not in (None, instance.status):
+        notifications.notify(
+            instance, 'status_changed',
+            f'"{instance.issue_title}" moved from {instance.previous_value("status")} to {instance.status}',
+            actor=actor
+        )
+
+    instance.snapshot()
+
+
+@receiver(post_delete, sender=Issue)
+def issue_deleted(sender, instance, **kwargs):
+    summary.issue_deleted(instance)
+    audit.record(instance, deleted=True)
+    sync.record('issue', instance.pk, instance.project_id, trade_id=instance.trade_id, priority=instance.priority)
+    events.publish(events.issue_event(instance, 'deleted'))
+    response_cache.changed('issue')
+
+
+@receiver([post_save, post_delete], sender=Comment)
+@receiver([post_save, post_delete], sender=Attachment)
+def issue_content_changed(sender, instance, signal, **kwargs):
+    kind = 'comment' if sender is Comment else 'attachment'
+    project_id, trade_id, priority = sync.content_scope(instance)
+    sync.record(kind, instance.pk, project_id, trade_id=trade_id, priority=priority)
+    if sender is Comment:
+        # Issue detail can show comments_count (?expand=)
+        response_cache.changed('comment')
+
+    if signal is post_delete:
+        action = 'deleted'
+    else:
+        action = 'created' if kwargs['created'] else 'updated'
+    event = events.issue_content_event(kind, instance, action)
+    if event is not None:
+        events.publish(event)
+
+
+@receiver(post_save, sender=Attachment)
+def attachment_saved(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'file' not in update_fields:
+        return
+    transaction.on_commit(lambda: derivatives.schedule(instance))
+
+
+@receiver(post_delete, sender=Attachment)
+def attachment_deleted(sender, instance, **kwargs):
+    # Its blob may have no references left
+    name = instance.file.name
+    transaction.on_commit(lambda: blobs.release(name))
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        notifications.notify(
+            instance.issue, 'commented',
+            f'{instance.user.email} commented: {instance.content[:200]}',
+            actor=instance.user
+        )
@@ -0,0 +1,122 @@
+"""
+Content-addressed storage for attachment files.
+
+BlobStorage stores a file under the sha256 of its content, hashed while it
+is streamed to disk: ``attachments/ab/ab12...`` (the directory is the one
+``upload_to`` asked for). The same content is stored once however many
+times it is uploaded, so disk and backups grow with unique content, not
+with the number of uploads.
+
+BlobField is the FileField that uses it. When a file is saved it also
+records on the row what the blob name no longer says: the uploaded file's
+name, its size, its MIME type and its sha256 (the model needs ``file_name``,
+``file_size``, ``content_type`` and ``sha256`` fields, declared after the
+file field). Listings read those and never touch the filesystem.
+
+Blobs are never deleted when a row goes away, another row may share them;
+core.blobs collects the ones nothing refers to.
+"""
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import tempfile
+import time
+
+from django.core.files.storage import FileSystemStorage
+from django.db.models.fields.files import FieldFile, FileField
+from django.utils.deconstruct import deconstructible
+
+DIGEST = re.compile(r'[0-9a-f]{64}')
+
+
+def blob_name(directory, digest):
+    return posixpath.join(directory, digest[:2], digest)
+
+
+def digest_of(name):
+    """The sha256 a blob is stored under, '' for a name that isn't a blob's."""
+    directory, digest = posixpath.split(name or '')
+    if DIGEST.fullmatch(digest) and posixpath.basename(directory) == digest[:2]:
+        return digest
+    return ''
+
+
+@deconstructible
+class BlobStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # _save names the file after its content, nothing to make unique
+        return name
+
+    def _save(self, name, content):
+        directory = posixpath.dirname(name)
+        os.makedirs(self.path(directory), exist_ok=True)
+        fd, partial = tempfile.mkstemp(dir=self.path(directory), suffix='.part')
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    out.write(chunk)
+            name = blob_name(directory, digest.hexdigest())
+            path = self.path(name)
+            if not self.touch(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(partial, self.file_permissions_mode)
+                os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        return name
+
+    def touch(self, path):
+        """
+        Mark an existing blob as just used, so the collector leaves it alone
+        until the row referring to it has committed. False if there is none.
+        """
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def discard(self, name, older_than):
+        """
+        Delete blob ``name`` unless it was stored or reused in the last
+        ``older_than`` seconds. True if it was deleted.
+        """
+        path = self.path(name)
+        held = f'{path}.{os.getpid()}.gc'
+        try:
+            # Out of the way first: an upload of the same content from now on
+            # writes the blob again instead of reusing this one
+            os.rename(path, held)
+        except FileNotFoundError:
+            return False
+        if os.stat(held).st_mtime > time.time() - older_than:
+            os.replace(held, path)
+            return False
+        os.remove(held)
+        return True
+
+
+class BlobFieldFile(FieldFile):
+    def save(self, name, content, save=True):
+        instance = self.instance
+        instance.file_name = os.path.basename(name)[:255]
+        instance.file_size = content.size
+        instance.content_type = (
+            mimetypes.guess_type(name)[0] or getattr(content, 'content_type', None) or 'application/octet-stream'
+        )[:100]
+        super().save(name, content, save=False)
+        instance.sha256 = digest_of(self.name)
+        if save:
+            instance.save()
+
+    save.alters_data = True
+
+
+class BlobField(FileField):
+    attr_class = BlobFieldFile
@@ -0,0 +1,219 @@
+"""
+Per-project issue summary.
+
+Instead of aggregating over every issue each time the dashboard loads, two
+small tables hold the counts and are adjusted by +1 / -1 whenever an issue
+is saved or deleted:
+
+- ProjectIssueStat: issues per status x priority x trade
+- ProjectOpenIssueStat: open issues per trade, priority, assignee and due
+  date (for overdue counts and per-assignee workload)
+
+Both carry project, trade and priority, so the role scoping from
+core.visibility applies to them unchanged. ``rebuild()`` recomputes them
+from scratch (see the rebuild_project_summary command).
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from .models import Issue, ProjectIssueStat, ProjectOpenIssueStat
+
+OPEN_STATUSES = ('OPEN', 'IN_PROGRESS')
+
+STAT_FIELDS = ('project_id', 'status', 'priority', 'trade_id')
+OPEN_STAT_FIELDS = ('project_id', 'trade_id', 'priority', 'assigned_to_id', 'due_date')
+
+# Above this many rows to adjust the rows are read and written in batches
+# instead of one UPDATE each (the bulk paths always batch)
+BUMP_ONE_BY_ONE = 10
+
+
+def is_open(status):
+    return status in OPEN_STATUSES
+
+
+def keys_for(values):
+    """The stat rows one issue counts towards, from a dict of its field values."""
+    keys = [(ProjectIssueStat, tuple(values[field] for field in STAT_FIELDS))]
+    if is_open(values['status']):
+        keys.append((ProjectOpenIssueStat, tuple(values[field] for field in OPEN_STAT_FIELDS)))
+    return keys
+
+
+def current_values(issue):
+    return {field: getattr(issue, field) for field in Issue.TRACKED_FIELDS}
+
+
+def previous_values(issue):
+    return {field: issue.previous_value(field) for field in Issue.TRACKED_FIELDS}
+
+
+def issue_saved(issue, created):
+    deltas = Counter()
+    if not created:
+        for key in keys_for(previous_values(issue)):
+            deltas[key] -= 1
+    for key in keys_for(current_values(issue)):
+        deltas[key] += 1
+    apply(deltas)
+
+
+def issue_deleted(issue):
+    apply(Counter({key: -1 for key in keys_for(current_values(issue))}))
+
+
+def issues_created(issues):
+    """bulk_create path: no signals are sent."""
+    deltas = Counter()
+    for issue in issues:
+        for key in keys_for(current_values(issue)):
+            deltas[key] += 1
+    apply(deltas, batched=True)
+
+
+def issues_updated(issues):
+    """bulk_update path: call before the issues are snapshot()ed again."""
+    deltas = Counter()
+    for issue in issues:
+        for key in keys_for(previous_values(issue)):
+            deltas[key] -= 1
+        for key in keys_for(current_values(issue)):
+            deltas[key] += 1
+    apply(deltas, batched=True)
+
+
+def apply(deltas, batched=False):
+    by_model = {}
+    for (model, key), delta in deltas.items():
+        if delta:
+            by_model.setdefault(model, {})[key] = delta
+
+    for model, model_deltas in by_model.items():
+        if not batched and len(model_deltas) <= BUMP_ONE_BY_ONE:
+            for key, delta in model_deltas.items():
+                bump(model, key, delta)
+        else:
+            bump_many(model, model_deltas)
+
+
+def bump(model, key, delta):
+    fields = STAT_FIELDS if model is ProjectIssueStat else OPEN_STAT_FIELDS
+    lookup = dict(zip(fields, key))
+    if lookup.get('assigned_to_id', 0) is None:
+        lookup = {k: v for k, v in lookup.items() if k != 'assigned_to_id'}
+        lookup['assigned_to__isnull'] = True
+
+    if model.objects.filter(**lookup).update(issue_count=F('issue_count') + delta):
+        return
+    if delta < 0:
+        # Nothing to take away from, e.g. the project itself is being deleted
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(issue_count=delta, **dict(zip(fields, key)))
+    except IntegrityError:
+        # Someone else created the row in the meantime
+        model.objects.filter(**lookup).update(issue_count=F('issue_count') + delta)
+
+
+def bump_many(model, deltas):
+    """bump() for ``{key: delta}``, with a fixed number of queries."""
+    fields = STAT_FIELDS if model is ProjectIssueStat else OPEN_STAT_FIELDS
+    existing = {
+        tuple(getattr(row, field) for field in fields): row
+        for row in model.objects.filter(project_id__in={key[0] for key in deltas})
+    }
+
+    to_update, to_create = [], []
+    for key, delta in deltas.items():
+        row = existing.get(key)
+        if row is not None:
+            row.issue_count = F('issue_count') + delta
+            to_update.append(row)
+        elif delta > 0:
+            to_create.append(model(issue_count=delta, **dict(zip(fields, key))))
+
+    if to_update:
+        model.objects.bulk_update(to_update, ['issue_count'], batch_size=1000)
+    if not to_create:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(to_create, batch_size=1000)
+    except IntegrityError:
+        # Someone else created some of the rows in the meantime
+        for row in to_create:
+            bump(model, tuple(getattr(row, field) for field in fields), row.issue_count)
+
+
+def rebuild(project_ids=None):
+    """Recompute the summary tables from Issue (all projects, or just these)."""
+    issues = Issue.objects.all()
+    stats = ProjectIssueStat.objects.all()
+    open_stats = ProjectOpenIssueStat.objects.all()
+    if project_ids is not None:
+        issues = issues.filter(project_id__in=project_ids)
+        stats = stats.filter(project_id__in=project_ids)
+        open_stats = open_stats.filter(project_id__in=project_ids)
+
+    with transaction.atomic():
+        stats.delete()
+        open_stats.delete()
+
+        ProjectIssueStat.objects.bulk_create([
+            ProjectIssueStat(issue_count=row.pop('total'), **row)
+            for row in issues.values(*STAT_FIELDS).annotate(total=Count('id')).order_by()
+        ], batch_size=1000)
+
+        open_rows = Counter()
+        for row in issues.values(*OPEN_STAT_FIELDS, 'status').annotate(total=Count('id')).order_by():
+            if is_open(row['status']):
+                open_rows[tuple(row[field] for field in OPEN_STAT_FIELDS)] += row['total']
+        ProjectOpenIssueStat.objects.bulk_create([
+            ProjectOpenIssueStat(issue_count=total, **dict(zip(OPEN_STAT_FIELDS, key)))
+            for key, total in open_rows.items()
+        ], batch_size=1000)
+
+
+def build_summary(visibility, project_id=None):
+    """The summary as the given user is allowed to see it."""
+    stats = ProjectIssueStat.objects.filter(visibility.issue_filter(), issue_count__gt=0)
+    open_stats = ProjectOpenIssueStat.objects.filter(visibility.issue_filter(), issue_count__gt=0)
+    if project_id is not None:
+        stats = stats.filter(project_id=project_id)
+        open_stats = open_stats.filter(project_id=project_id)
+
+    by_status, by_priority, by_trade = Counter(), Counter(), Counter()
+    breakdown = []
+    for row in stats.values('status', 'priority', 'trade__name').annotate(total=Sum('issue_count')).order_by():
+        by_status[row['status']] += row['total']
+        by_priority[row['priority']] += row['total']
+        by_trade[row['trade__name']] += row['total']
+        breakdown.append({
+            'status': row['status'],
+            'priority': row['priority'],
+            'trade': row['trade__name'],
+            'count': row['total'],
+        })
+
+    today = timezone.localdate()
+    overdue = open_stats.filter(due_date__lt=today).aggregate(total=Sum('issue_count'))['total'] or 0
+    by_assignee = [
+        {'assigned_to': row['assigned_to'], 'email': row['assigned_to__email'], 'open': row['total']}
+        for row in open_stats.values('assigned_to', 'assigned_to__email')
+        .annotate(total=Sum('issue_count')).order_by('-total')
+    ]
+
+    return {
+        'total': sum(by_status.values()),
+        'open': sum(row['open'] for row in by_assignee),
+        'overdue': overdue,
+        'by_status': dict(by_status),
+        'by_priority': dict(by_priority),
+        'by_trade': dict(by_trade),
+        'breakdown': breakdown,
+        'open_by_assignee': by_assignee,
+    }
@@ -0,0 +1,222 @@
+"""
+Delta sync change feed for offline clients.
+
+Every save or delete of a project, issue, comment or attachment, and every
+change to a project's members, appends a Change row in the same transaction.
+Its id is a monotonic change sequence: a client remembers the token from
+its last sync and ``GET /api/sync/?since=<token>`` returns what changed
+after it, so reconnecting transfers only that instead of whole lists.
+
+The feed carries the current state of each changed object, not the change
+itself, and only what the user can see right now (the same rules as
+IssueViewSet.get_queryset through core.visibility). An object the user
+could see that was deleted or left their view (an issue moved to another
+project, trade or priority) comes back as a tombstone: each change records
+the issue's project, trade and priority, and an issue's update also
+records the values it had before. Changes to what the user never could
+see are left out. An object changed several times since the token comes
+back once.
+
+Sequence numbers are handed out when a row is inserted but become visible
+when its transaction commits, so a slow transaction can commit a number
+lower than one already synced. The token therefore stops short of changes
+younger than SYNC_SETTLE_SECONDS; they are still returned, and sent again
+on the next sync (applying a change twice is harmless).
+
+Changes older than SYNC_RETENTION_DAYS are removed by prune_changes; a
+client whose token is older than that gets ``reset`` and downloads again.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import trades
+from .models import Attachment, Change, Comment, Issue
+from .serializers import AttachmentSerializer, CommentSerializer, IssueSerializer, ProjectSerializer
+
+PAGE_SIZE = 500
+
+
+def record(kind, object_id, project_id, user_id=None, trade_id=None, priority=''):
+    Change.objects.create(
+        kind=kind, object_id=object_id, project_id=project_id, user_id=user_id, trade_id=trade_id, priority=priority
+    )
+
+
+def record_many(kind, objects):
+    """
+    One Change per ``(object_id, project_id, trade_id, priority)``, for the
+    bulk paths that send no signals.
+    """
+    Change.objects.bulk_create(
+        [
+            Change(kind=kind, object_id=object_id, project_id=project_id, trade_id=trade_id, priority=priority)
+            for object_id, project_id, trade_id, priority in objects
+        ],
+        batch_size=1000,
+    )
+
+
+def issue_scope(issue):
+    """``(project_id, trade_id, priority)``: what decides who can see an issue."""
+    return issue.project_id, issue.trade_id, issue.priority
+
+
+def issue_changes(issue):
+    """
+    record_many() entries for a saved issue: its values, and the ones it had
+    before if they differ, so whoever could only see those gets a tombstone.
+    """
+    now = issue_scope(issue)
+    before = (issue.previous_value('project_id'), issue.previous_value('trade_id'), issue.previous_value('priority'))
+    if None in before or before == now:
+        return [(issue.pk, *now)]
+    return [(issue.pk, *now), (issue.pk, *before)]
+
+
+def content_scope(instance):
+    """issue_scope() of a comment's or attachment's issue, without a query of its own."""
+    if type(instance).issue.is_cached(instance):
+        return issue_scope(instance.issue)
+    issue = Issue.objects.filter(pk=instance.issue_id)
+    return (
+        Subquery(issue.values('project_id')[:1]),
+        Subquery(issue.values('trade_id')[:1]),
+        Coalesce(Subquery(issue.values('priority')[:1]), Value('')),
+    )
+
+
+# Tokens
+
+def make_token(sequence):
+    return f'{sequence}.{int(time.time())}'
+
+
+def read_token(token):
+    """The sequence number in ``token``, or None if it is malformed or too old to sync from."""
+    try:
+        sequence, issued = (int(part) for part in token.split('.'))
+    except (AttributeError, ValueError):
+        return None
+    if sequence < 0 or issued < time.time() - settings.SYNC_RETENTION_DAYS * 86400:
+        return None
+    return sequence
+
+
+def settled(sequence=None):
+    """Highest sequence number (up to ``sequence``) older than SYNC_SETTLE_SECONDS."""
+    settled_at = timezone.now() - timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+    changes = Change.objects.filter(changed_at__lte=settled_at)
+    if sequence is not None:
+        changes = changes.filter(id__lte=sequence)
+    latest = changes.order_by('-id').values_list('id', flat=True).first()
+    return latest or 0
+
+
+# Feed
+
+def scoped_changes(user, scope):
+    """The Change rows that may concern ``user``."""
+    if scope.see_all:
+        return Change.objects.all()
+    return Change.objects.filter(
+        Q(project_id__in=sorted(scope.assigned_project_ids)) | Q(user_id=user.pk)
+    )
+
+
+def could_see(scope, kind, project_id, trade_id, priority):
+    """Whether the user could see the object as it was when a change was recorded."""
+    if kind == 'project' or not priority:
+        # Projects are scoped by the feed's query already. No priority: a
+        # change recorded before issues' scope was kept
+        return True
+    trade = trades.by_id(trade_id)
+    return scope.can_see(project_id, trade.name if trade is not None else None, priority)
+
+
+def visible(kind, ids, scope, request):
+    """``{id: (project_id, rendered object)}`` for the objects of ``kind`` the user can see."""
+    if kind == 'project':
+        objects = ProjectSerializer.setup_eager_loading(scope.project_queryset())
+        serializer, project_of = ProjectSerializer, lambda project: project.id
+    elif kind == 'issue':
+        objects = IssueSerializer.setup_eager_loading(scope.issue_queryset())
+        serializer, project_of = IssueSerializer, lambda issue: issue.project_id
+    else:
+        model, serializer = (Comment, CommentSerializer) if kind == 'comment' else (Attachment, AttachmentSerializer)
+        objects = serializer.setup_eager_loading(model.objects.filter(scope.issue_filter('issue__')))
+        objects = objects.select_related('issue')
+        project_of = lambda instance: instance.issue.project_id
+
+    found = list(objects.filter(id__in=ids))
+    data = serializer(found, many=True, context={'request': request}).data
+    return {instance.id: (project_of(instance), rendered) for instance, rendered in zip(found, data)}
+
+
+def feed(request, user, scope, since):
+    """The /api/sync/ response body for changes after sequence number ``since``."""
+    entries = list(
+        scoped_changes(user, scope).filter(id__gt=since)
+        .order_by('id')
+        .values_list('id', 'kind', 'object_id', 'project_id', 'user_id', 'trade_id', 'priority')[:PAGE_SIZE + 1]
+    )
+    has_more = len(entries) > PAGE_SIZE
+    entries = entries[:PAGE_SIZE]
+
+    # The last entry for each object decides where it goes in the feed; a
+    # tombstone is only for what the user could see at one of them
+    latest, seen = {}, set()
+    for sequence, kind, object_id, project_id, user_id, trade_id, priority in entries:
+        latest.pop((kind, object_id), None)
+        latest[(kind, object_id)] = project_id
+        if could_see(scope, kind, project_id, trade_id, priority):
+            seen.add((kind, object_id))
+
+    by_kind = {}
+    for kind, object_id in latest:
+        by_kind.setdefault(kind, []).append(object_id)
+    found = {kind: visible(kind, ids, scope, request) for kind, ids in by_kind.items()}
+
+    changes = []
+    for (kind, object_id), project_id in latest.items():
+        if object_id in found[kind]:
+            project_id, data = found[kind][object_id]
+            changes.append({'type': kind, 'id': object_id, 'project': project_id, 'deleted': False, 'data': data})
+        elif (kind, object_id) in seen:
+            changes.append({'type': kind, 'id': object_id, 'project': project_id, 'deleted': True})
+
+    # Projects this user was added to: the client has none of their issues yet
+    resync = sorted({
+        object_id for sequence, kind, object_id, project_id, user_id, trade_id, priority in entries
+        if kind == 'project' and user_id == user.pk and object_id in found['project']
+    }) if not scope.see_all else []
+
+    if has_more:
+        token = entries[-1][0]
+    elif entries:
+        token = max(settled(entries[-1][0]), since)
+    else:
+        token = since
+
+    return {
+        'token': make_token(token),
+        'reset': False,
+        'has_more': has_more,
+        'changes': changes,
+        'resync_projects': resync,
+    }
+
+
+def reset():
+    """Response for a first sync or an unusable token: download everything, then sync from ``token``."""
+    return {
+        'token': make_token(settled()),
+        'reset': True,
+        'has_more': False,
+        'changes': [],
+        'resync_projects': [],
+    }
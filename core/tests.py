@@ -1,11 +1,37 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
 from datetime import date, timedelta
+from django.apps import apps
+from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from io import BytesIO, StringIO
+import gzip
+import importlib
+import json
+import os
+import runpy
+import shutil
+import tempfile
+import time
 
-from .models import Project, Trade, Issue, Comment, Attachment
+from types import SimpleNamespace
+from unittest import skipUnless
+from unittest.mock import patch
+
+from asgiref.sync import sync_to_async
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+
+from .models import Project, Trade, Issue, Comment, Attachment, IssueHistory, Notification, ProjectIssueStat, ProjectOpenIssueStat, UploadSession
+from . import blobs, derivatives, events, importer, metrics, notifications, renderers, summary, trades, uploads
 
 User = get_user_model()
 
@@ -197,4 +223,2017 @@ class AttachmentTests(APITestCase):
         # Handle pagination
         results = response.data.get('results', response.data)
         attachment_count = Attachment.objects.count()
-        self.assertEqual(len(results), attachment_count)
\ No newline at end of file
+        self.assertEqual(len(results), attachment_count)
+
+
+class VisibilityTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.electrical = Trade.objects.create(name='ELECTRICAL')
+        self.plumbing = Trade.objects.create(name='PLUMBING')
+        self.project = Project.objects.create(
+            project_name='Assigned Project',
+            description='Test Description',
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=365)
+        )
+        self.other_project = Project.objects.create(
+            project_name='Other Project',
+            description='Test Description',
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=365)
+        )
+        for project in (self.project, self.other_project):
+            for trade, priority in ((self.electrical, 'HIGH'), (self.plumbing, 'LOW')):
+                Issue.objects.create(
+                    project=project,
+                    trade=trade,
+                    issue_title=f'{trade.name} issue',
+                    detailed_description='Test Description',
+                    priority=priority,
+                    due_date=date.today() + timedelta(days=7),
+                    status='OPEN'
+                )
+
+    def make_user(self, role, specialty=None):
+        user = User.objects.create_user(
+            username=role.lower().replace(' ', ''),
+            email=f"{role.lower().replace(' ', '')}@site.com",
+            password='testpass123',
+            role=role,
+            specialty=specialty
+        )
+        self.project.assigned_users.add(user)
+        self.client.force_authenticate(user=user)
+        return user
+
+    def issue_ids(self):
+        response = self.client.get('/api/issues/')
+        self.assertEqual(response.status_code, 200)
+        return {issue['id'] for issue in response.data.get('results', response.data)}
+
+    def test_site_officer_sees_assigned_projects_only(self):
+        self.make_user('SITE OFFICER')
+        expected = set(Issue.objects.filter(project=self.project).values_list('id', flat=True))
+        self.assertEqual(self.issue_ids(), expected)
+
+    def test_subcontractor_and_safety_officer_filters(self):
+        self.make_user('SUB CONTRACTOR', specialty='PLUMBING')
+        expected = set(Issue.objects.filter(project=self.project, trade=self.plumbing).values_list('id', flat=True))
+        self.assertEqual(self.issue_ids(), expected)
+
+        self.make_user('SAFETY OFFICER')
+        expected = set(Issue.objects.filter(project=self.project, priority='HIGH').values_list('id', flat=True))
+        self.assertEqual(self.issue_ids(), expected)
+
+    def test_index_is_invalidated_when_assignments_change(self):
+        user = self.make_user('SITE OFFICER')
+        response = self.client.get('/api/projects/')
+        self.assertEqual(len(response.data['results']), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other_project.assigned_users.add(user)
+
+        response = self.client.get('/api/projects/')
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='cursoruser',
+            email='cursor@site.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.trade = Trade.objects.create(name='GENERAL')
+        self.project = Project.objects.create(
+            project_name='Test Project',
+            description='Test Description',
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=365)
+        )
+        for i in range(45):
+            Issue.objects.create(
+                project=self.project,
+                trade=self.trade,
+                issue_title=f'Issue {i}',
+                detailed_description='Test Description',
+                priority=['LOW', 'MEDIUM', 'HIGH'][i % 3],
+                due_date=date.today() + timedelta(days=i % 5),
+                status='OPEN'
+            )
+
+    def walk(self, url):
+        ids = []
+        pages = 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids.extend(issue['id'] for issue in response.data['results'])
+            url = response.data['next']
+            pages += 1
+        return ids, pages
+
+    def test_cursor_walk_returns_every_issue_once(self):
+        ids, pages = self.walk('/api/issues/?pagination=cursor')
+        self.assertEqual(pages, 3)
+        expected = list(Issue.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_cursor_is_stable_with_ordering_fields(self):
+        ids, _ = self.walk('/api/issues/?pagination=cursor&ordering=priority')
+        expected = list(Issue.objects.order_by('priority', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_previous_link_and_nested_view(self):
+        first = self.client.get(f'/api/projects/{self.project.id}/issues/?pagination=cursor')
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(
+            [issue['id'] for issue in back.data['results']],
+            [issue['id'] for issue in first.data['results']]
+        )
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/issues/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='searchuser',
+            email='search@site.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        trade = Trade.objects.create(name='PLUMBING')
+        project = Project.objects.create(
+            project_name='Test Project',
+            description='Test Description',
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=365)
+        )
+        descriptions = [
+            ('Burst pipe', 'Burst pipe flooding the basement near the pump room'),
+            ('Leaking joint', 'Pipe joint leaking slowly, pipe needs resealing'),
+            ('Electrical panel', 'Exposed wiring in the electrical panel'),
+        ]
+        self.issues = {}
+        for title, description in descriptions:
+            self.issues[title] = Issue.objects.create(
+                project=project,
+                trade=trade,
+                issue_title=title,
+                detailed_description=description,
+                priority='HIGH',
+                due_date=date.today() + timedelta(days=7),
+                status='OPEN'
+            )
+        Comment.objects.create(issue=self.issues['Burst pipe'], user=self.user, content='Safety rail missing on stairs')
+
+    def titles(self, query):
+        response = self.client.get('/api/issues/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [issue['issue_title'] for issue in response.data['results']]
+
+    def test_words_phrase_and_prefix(self):
+        self.assertEqual(set(self.titles('pipe')), {'Burst pipe', 'Leaking joint'})
+        self.assertEqual(self.titles('"burst pipe"'), ['Burst pipe'])
+        self.assertEqual(self.titles('electr*'), ['Electrical panel'])
+        self.assertEqual(self.titles('pipe wiring'), [])
+
+    def test_results_are_ranked_with_snippet(self):
+        response = self.client.get('/api/issues/', {'search': 'leaking'})
+        result = response.data['results'][0]
+        self.assertEqual(result['issue_title'], 'Leaking joint')
+        self.assertIn('<mark>', result['search_snippet'])
+
+    def test_index_follows_updates_and_comment_search(self):
+        issue = self.issues['Electrical panel']
+        issue.detailed_description = 'Scaffolding collapsed'
+        issue.save()
+        self.assertEqual(self.titles('scaffold*'), ['Electrical panel'])
+        self.assertEqual(self.titles('wiring'), [])
+
+        response = self.client.get('/api/comments/', {'search': '"safety rail"'})
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_comment_results_are_ranked_not_dated(self):
+        issue = self.issues['Burst pipe']
+        best = Comment.objects.create(issue=issue, user=self.user, content='Valve leak, valve replaced')
+        Comment.objects.create(
+            issue=issue, user=self.user,
+            content='Checked the whole floor today, walls, ceilings, doors, windows and the valve cupboard'
+        )
+        response = self.client.get('/api/comments/', {'search': 'valve'})
+        self.assertEqual([comment['id'] for comment in response.data['results']][0], best.id)
+        # Without a search they are newest first
+        response = self.client.get('/api/comments/')
+        self.assertNotEqual(response.data['results'][0]['id'], best.id)
+
+
+
+class QueryPlanTests(TestCase):
+    def test_endpoint_queries_use_indexes(self):
+        project = Project.objects.create(
+            project_name='Test Project',
+            description='Test Description',
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=365)
+        )
+        issue = Issue.objects.create(
+            project=project,
+            trade=Trade.objects.create(name='GENERAL'),
+            issue_title='Test Issue',
+            detailed_description='Test Description',
+            priority='HIGH',
+            due_date=date.today() + timedelta(days=7),
+            status='OPEN'
+        )
+        users = [
+            User.objects.create_user(
+                username=f'plan{index}', email=f'plan{index}@site.com', password='testpass123',
+                role=role, specialty='GENERAL' if role == 'SUB CONTRACTOR' else None,
+            )
+            for index, role in enumerate(['PROJECT MANAGER', 'SITE OFFICER', 'SUB CONTRACTOR', 'SAFETY OFFICER'])
+        ]
+        project.assigned_users.set(users[1:])
+        Comment.objects.create(issue=issue, user=users[0], content='Test comment')
+
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertNotIn('SEQ SCAN', out.getvalue())
+        self.assertNotIn('skipped', out.getvalue())
+        self.assertIn('(safety officer)', out.getvalue())
+
+
+
+class QueryBudgetMixin:
+    """
+    Fails a test when an endpoint runs more SQL than it is allowed to, or
+    when its query count grows with the number of rows it returns (N+1).
+    """
+
+    def assertQueryBudget(self, url, budget):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{url} ran {len(queries)} queries, budget is {budget}:\n'
+            + '\n'.join(query['sql'] for query in queries.captured_queries)
+        )
+        return len(queries)
+
+    def assertConstantQueries(self, budgets, add_rows):
+        """
+        Check every ``{url: budget}``, call ``add_rows()`` to grow the data,
+        then check that each url still runs exactly as many queries as before.
+        """
+        cache.clear()
+        before = {url: self.assertQueryBudget(url, budget) for url, budget in budgets.items()}
+        add_rows()
+        cache.clear()
+        for url, budget in budgets.items():
+            after = self.assertQueryBudget(url, budget)
+            self.assertEqual(before[url], after, f'{url} query count grew from {before[url]} to {after} with more rows')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ListQueryBudgetTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='budgetuser',
+            email='budget@site.com',
+            password='testpass123',
+            role='SITE OFFICER'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.trade = Trade.objects.create(name='GENERAL')
+        self.project = self.add_project()
+        self.issue = self.add_issue()
+
+    def add_project(self):
+        project = Project.objects.create(
+            project_name='Test Project',
+            description='Test Description',
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=365)
+        )
+        project.trades.add(self.trade)
+        project.assigned_users.add(self.user)
+        return project
+
+    def add_issue(self):
+        return Issue.objects.create(
+            project=self.project,
+            trade=self.trade,
+            issue_title='Test Issue',
+            detailed_description='Test Description',
+            priority='HIGH',
+            due_date=date.today() + timedelta(days=7),
+            status='OPEN'
+        )
+
+    def add_rows(self):
+        for i in range(10):
+            other = User.objects.create_user(username=f'user{i}', email=f'user{i}@site.com', password='testpass123')
+            self.add_project()
+            issue = self.add_issue()
+            Comment.objects.create(issue=self.issue, user=other, content='Another comment')
+            Attachment.objects.create(issue=issue, user=other, file=SimpleUploadedFile('a.txt', b'a'))
+
+    def test_list_endpoints_run_constant_queries(self):
+        Comment.objects.create(issue=self.issue, user=self.user, content='First comment')
+        Attachment.objects.create(issue=self.issue, user=self.user, file=SimpleUploadedFile('a.txt', b'a'))
+        self.assertConstantQueries({
+            '/api/projects/': 5,
+            '/api/trades/': 2,
+            '/api/issues/': 3,
+            '/api/comments/': 2,
+            '/api/attachments/': 2,
+            f'/api/projects/{self.project.id}/issues/': 2,
+            f'/api/issues/{self.issue.id}/comments/': 2,
+            '/api/test-assigned-projects/': 5,
+        }, self.add_rows)
+
+
+class BulkIssueTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='bulkuser',
+            email='bulk@site.com',
+            password='testpass123',
+            role='SITE OFFICER'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.trade = Trade.objects.create(name='STRUCTURAL')
+        self.project = Project.objects.create(
+            project_name='Test Project',
+            description='Test Description',
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=365)
+        )
+        self.url = f'/api/projects/{self.project.id}/issues/'
+
+    def item(self, i, due_in=7):
+        return {
+            'trade': self.trade.id,
+            'issue_title': f'Punch item {i}',
+            'detailed_description': 'Found on walkthrough',
+            'priority': 'MEDIUM',
+            'due_date': str(date.today() + timedelta(days=due_in)),
+        }
+
+    def test_bulk_create_in_constant_queries(self):
+        items = [self.item(i) for i in range(120)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, items, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['created']), 120)
+        self.assertEqual(Issue.objects.filter(project=self.project).count(), 120)
+        # Includes the project summary rows (see core/summary.py) and the sync feed entries
+        self.assertLess(len(queries), 17)
+
+    def test_invalid_items_are_reported_by_index(self):
+        items = [self.item(0), self.item(1, due_in=-1), {'issue_title': 'No trade'}]
+        response = self.client.post(self.url, items, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(len(response.data['created']), 1)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertIn('due_date', response.data['errors'][0]['errors'])
+
+        response = self.client.post(f'{self.url}?atomic=true', items, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Issue.objects.filter(project=self.project).count(), 1)
+
+    def test_bulk_update(self):
+        self.client.post(self.url, [self.item(i) for i in range(3)], format='json')
+        ids = list(Issue.objects.order_by('id').values_list('id', flat=True))
+        response = self.client.patch(self.url, [
+            {'id': ids[0], 'status': 'RESOLVED'},
+            {'id': ids[1], 'priority': 'CRITICAL'},
+            {'id': ids[2], 'issue_title': 'Renamed'},
+        ], format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(Issue.objects.get(id=ids[0]).status, 'RESOLVED')
+        self.assertEqual(Issue.objects.get(id=ids[1]).priority, 'CRITICAL')
+        self.assertEqual(response.data['errors'][0]['index'], 2)
+
+    def test_bulk_update_rejects_ids_that_are_not_integers(self):
+        self.client.post(self.url, [self.item(0)], format='json')
+        issue_id = Issue.objects.get().id
+        response = self.client.patch(self.url, [
+            {'id': [issue_id], 'status': 'RESOLVED'},
+            {'id': True, 'status': 'RESOLVED'},
+            {'id': str(issue_id), 'status': 'RESOLVED'},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.data['errors']], [0, 1, 2])
+        self.assertEqual(Issue.objects.get().status, 'OPEN')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), CHUNKED_UPLOAD_DIR=tempfile.mkdtemp())
+class ChunkedUploadTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='uploaduser',
+            email='upload@site.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+        project = Project.objects.create(
+            project_name='Test Project',
+            description='Test Description',
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=365)
+        )
+        self.issue = Issue.objects.create(
+            project=project,
+            trade=Trade.objects.create(name='GENERAL'),
+            issue_title='Test Issue',
+            detailed_description='Test Description',
+            priority='MEDIUM',
+            due_date=date.today() + timedelta(days=7),
+            status='OPEN'
+        )
+        self.content = bytes(range(256)) * 40
+
+    def start(self, total_size):
+        return self.client.post(f'/api/issues/{self.issue.id}/uploads/', {
+            'file_name': 'drawing.pdf',
+            'total_size': total_size
+        }, format='json')
+
+    def put_chunk(self, upload_id, offset, chunk, checksum=None):
+        import hashlib
+        return self.client.put(
+            f'/api/uploads/{upload_id}/', chunk,
+            content_type='application/octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset),
+            HTTP_UPLOAD_CHECKSUM=f'sha256 {checksum or hashlib.sha256(chunk).hexdigest()}'
+        )
+
+    def test_resumable_upload(self):
+        upload_id = self.start(len(self.content)).data['upload_id']
+
+        response = self.put_chunk(upload_id, 0, self.content[:4000])
+        self.assertEqual(response.data['offset'], 4000)
+
+        # A corrupted chunk is rejected and the offset stays put
+        response = self.put_chunk(upload_id, 4000, self.content[4000:8000], checksum='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        # Resuming from the wrong place is refused with the server's offset
+        response = self.put_chunk(upload_id, 0, self.content[:4000])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.get(f'/api/uploads/{upload_id}/').data['offset'], 4000)
+
+        response = self.put_chunk(upload_id, 4000, self.content[4000:])
+        self.assertEqual(response.status_code, 201)
+        attachment = Attachment.objects.get(id=response.data['attachment_id'])
+        with attachment.file.open('rb') as stored:
+            self.assertEqual(stored.read(), self.content)
+
+    def test_size_limit_enforced_before_upload(self):
+        self.assertEqual(self.start(11 * 1024 * 1024).status_code, 413)
+        upload_id = self.start(100).data['upload_id']
+        self.assertEqual(self.put_chunk(upload_id, 0, b'x' * 101).status_code, 413)
+
+    def test_chunk_is_read_before_the_session_is_locked(self):
+        upload_id = self.start(len(self.content)).data['upload_id']
+        spool_chunk = uploads.spool_chunk
+
+        def slow_client(*args):
+            spooled = spool_chunk(*args)
+            # The same chunk arrived through another request meanwhile
+            UploadSession.objects.filter(id=upload_id).update(offset=4000)
+            return spooled
+
+        with patch.object(uploads, 'spool_chunk', side_effect=slow_client):
+            response = self.put_chunk(upload_id, 0, self.content[:4000])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], 4000)
+        self.assertEqual(os.listdir(settings.CHUNKED_UPLOAD_DIR), [])
+
+
+@override_settings(NOTIFICATION_ASYNC=False)
+class NotificationFanOutTests(APITestCase):
+    def setUp(self):
+        notifications.dispatcher.flush()
+        self.manager = User.objects.create_user(
+            username='manager', email='manager@site.com', password='testpass123', role='PROJECT MANAGER'
+        )
+        self.project = Project.objects.create(
+            project_name='Test Project',
+            description='Test Description',
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=365)
+        )
+        self.team = {}
+        for role, specialty in (('SITE OFFICER', None), ('SUB CONTRACTOR', 'PLUMBING'), ('SAFETY OFFICER', None)):
+            user = User.objects.create_user(
+                username=role.replace(' ', ''), email=f"{role.replace(' ', '')}@site.com",
+                password='testpass123', role=role, specialty=specialty
+            )
+            self.team[role] = user
+        self.project.assigned_users.add(self.manager, *self.team.values())
+        self.trade = Trade.objects.create(name='ELECTRICAL')
+        self.client.force_authenticate(user=self.manager)
+
+    def recipients(self):
+        return set(Notification.objects.values_list('user__role', flat=True))
+
+    def test_new_issue_notifies_the_team_members_who_can_see_it(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/projects/{self.project.id}/issues/', {
+                'trade': self.trade.id,
+                'issue_title': 'Exposed cable',
+                'detailed_description': 'Live cable exposed in stairwell',
+                'priority': 'HIGH',
+                'due_date': str(date.today() + timedelta(days=3)),
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Notification.objects.count(), 0)  # written by the fan-out, not the request
+
+        notifications.dispatcher.flush()
+        # Not the plumbing subcontractor, and not the manager who reported it
+        self.assertEqual(self.recipients(), {'SITE OFFICER', 'SAFETY OFFICER'})
+
+    def test_changes_on_one_issue_are_coalesced(self):
+        issue = Issue.objects.create(
+            project=self.project, trade=self.trade, issue_title='Loose panel',
+            detailed_description='Test Description', priority='LOW',
+            due_date=date.today() + timedelta(days=7), status='OPEN'
+        )
+        notifications.dispatcher.flush()
+        Notification.objects.all().delete()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/issues/{issue.id}/', {'status': 'IN_PROGRESS'}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/issues/{issue.id}/', {'status': 'RESOLVED'}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(issue=issue, user=self.team['SAFETY OFFICER'], content='Checked it')
+
+        notifications.dispatcher.flush()
+        site_officer = Notification.objects.get(user=self.team['SITE OFFICER'])
+        self.assertEqual(site_officer.title, '3 updates on "Loose panel"')
+        # LOW priority: not visible to the safety officer, who also wrote the comment
+        self.assertFalse(Notification.objects.filter(user=self.team['SAFETY OFFICER']).exists())
+        self.assertEqual(Notification.objects.filter(user=self.manager).count(), 1)
+
+    def test_shutdown_writes_what_is_still_queued(self):
+        issue = Issue.objects.create(
+            project=self.project, trade=self.trade, issue_title='Loose panel',
+            detailed_description='Test Description', priority='HIGH',
+            due_date=date.today() + timedelta(days=7), status='OPEN'
+        )
+        with override_settings(NOTIFICATION_ASYNC=True, NOTIFICATION_COALESCE_SECONDS=60):
+            with self.captureOnCommitCallbacks(execute=True):
+                notifications.notify(issue, 'created', 'Loose panel was reported')
+            worker = notifications.dispatcher._worker
+            self.assertTrue(worker.is_alive())
+            self.assertEqual(Notification.objects.count(), 0)
+
+            # A worker restart: the coalescing window isn't up yet
+            notifications.dispatcher.shutdown()
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(self.recipients(), {'PROJECT MANAGER', 'SITE OFFICER', 'SAFETY OFFICER'})
+
+
+class ProjectSummaryTests(APITestCase):
+    def setUp(self):
+        self.manager = User.objects.create_user(
+            username='manager', email='manager@site.com', password='testpass123', role='PROJECT MANAGER'
+        )
+        self.project = Project.objects.create(
+            project_name='Test Project',
+            description='Test Description',
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=365)
+        )
+        self.electrical = Trade.objects.create(name='ELECTRICAL')
+        self.plumbing = Trade.objects.create(name='PLUMBING')
+        self.client.force_authenticate(user=self.manager)
+
+    def create_issue(self, **fields):
+        values = {
+            'project': self.project, 'trade': self.electrical, 'issue_title': 'Test Issue',
+            'detailed_description': 'Test Description', 'priority': 'LOW',
+            'due_date': date.today() + timedelta(days=7), 'status': 'OPEN',
+        }
+        values.update(fields)
+        return Issue.objects.create(**values)
+
+    def stat_rows(self):
+        return (
+            sorted(ProjectIssueStat.objects.filter(issue_count__gt=0)
+                   .values_list('project_id', 'status', 'priority', 'trade_id', 'issue_count')),
+            sorted(ProjectOpenIssueStat.objects.filter(issue_count__gt=0)
+                   .values_list('project_id', 'trade_id', 'priority', 'assigned_to_id', 'due_date', 'issue_count'),
+                   key=str),
+        )
+
+    def assertMatchesRebuild(self):
+        incremental = self.stat_rows()
+        summary.rebuild()
+        self.assertEqual(incremental, self.stat_rows())
+
+    def test_saves_and_deletes_keep_the_summary_in_step(self):
+        first = self.create_issue(priority='HIGH', due_date=date.today() - timedelta(days=1))
+        second = self.create_issue(trade=self.plumbing)
+        self.create_issue(status='RESOLVED')
+
+        second.status = 'IN_PROGRESS'
+        second.assigned_to = self.manager
+        second.save()
+        first.status = 'RESOLVED'
+        first.save()
+        second.delete()
+        self.assertMatchesRebuild()
+
+    def test_bulk_paths_keep_the_summary_in_step(self):
+        url = f'/api/projects/{self.project.id}/issues/'
+        items = [{
+            'trade': self.plumbing.id, 'issue_title': f'Leak {n}', 'detailed_description': 'Test Description',
+            'priority': 'MEDIUM', 'due_date': str(date.today() + timedelta(days=n)), 'status': 'OPEN',
+        } for n in range(3)]
+        response = self.client.post(url, items, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        ids = Issue.objects.values_list('id', flat=True)
+        response = self.client.patch(url, [{'id': ids[0], 'status': 'CLOSED'}], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertMatchesRebuild()
+
+    def test_summary_endpoint(self):
+        self.create_issue(priority='HIGH', due_date=date.today() - timedelta(days=1))
+        self.create_issue(priority='CRITICAL', trade=self.plumbing)
+        self.create_issue(status='CLOSED')
+
+        response = self.client.get(f'/api/projects/{self.project.id}/summary/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total'], 3)
+        self.assertEqual(response.data['open'], 2)
+        self.assertEqual(response.data['overdue'], 1)
+        self.assertEqual(response.data['by_priority'], {'HIGH': 1, 'CRITICAL': 1, 'LOW': 1})
+        self.assertEqual(response.data['by_trade'], {'ELECTRICAL': 2, 'PLUMBING': 1})
+
+    def test_lowercase_open_statuses_are_migrated(self):
+        issue = self.create_issue()
+        self.create_issue()
+        # As the old lowercase default left them
+        Issue.objects.filter(id=issue.id).update(status='open')
+        ProjectIssueStat.objects.filter(status='OPEN').update(issue_count=1)
+        ProjectIssueStat.objects.create(
+            project=self.project, status='open', priority='LOW', trade=self.electrical, issue_count=1
+        )
+
+        migration = importlib.import_module('core.migrations.0019_uppercase_open_status')
+        migration.uppercase_open(apps, None)
+        self.assertEqual(Issue.objects.get(id=issue.id).status, 'OPEN')
+        self.assertMatchesRebuild()
+        self.assertEqual(self.client.get('/api/summary/').data['by_status'], {'OPEN': 2})
+
+    def test_summary_is_scoped_like_the_issue_list(self):
+        self.create_issue(priority='HIGH')
+        self.create_issue(priority='LOW')
+        other = Project.objects.create(
+            project_name='Other Project', description='Test Description',
+            start_date=date.today(), end_date=date.today() + timedelta(days=365)
+        )
+        self.create_issue(project=other, priority='CRITICAL')
+
+        safety = User.objects.create_user(
+            username='safety', email='safety@site.com', password='testpass123', role='SAFETY OFFICER'
+        )
+        self.project.assigned_users.add(safety)
+        self.client.force_authenticate(user=safety)
+
+        response = self.client.get('/api/summary/')
+        self.assertEqual(response.data['total'], 1)
+        self.assertEqual(response.data['by_priority'], {'HIGH': 1})
+
+        response = self.client.get(f'/api/projects/{other.id}/summary/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(RESPONSE_CACHE=True)
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user(
+            username='manager', email='manager@site.com', password='testpass123', role='PROJECT MANAGER'
+        )
+        self.project = Project.objects.create(
+            project_name='Test Project',
+            description='Test Description',
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=365)
+        )
+        self.trade = Trade.objects.create(name='ELECTRICAL')
+        self.issue = Issue.objects.create(
+            project=self.project, trade=self.trade, issue_title='Test Issue',
+            detailed_description='Test Description', priority='LOW',
+            due_date=date.today() + timedelta(days=7), status='OPEN'
+        )
+        self.client.force_authenticate(user=self.manager)
+
+    def test_if_none_match_returns_304_without_queries(self):
+        response = self.client.get('/api/projects/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/projects/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    @override_settings(RESPONSE_CACHE=False)
+    def test_off_without_a_shared_cache(self):
+        response = self.client.get('/api/projects/')
+        self.assertNotIn('ETag', response)
+        # A write another process made, without bumping this one's versions
+        with patch('core.response_cache.bump'), self.captureOnCommitCallbacks(execute=True):
+            self.project.trades.add(self.trade)
+        response = self.client.get('/api/projects/')
+        self.assertEqual(response.data['results'][0]['trades'], [self.trade.id])
+
+    def test_writes_change_the_etag(self):
+        etag = self.client.get('/api/projects/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project.trades.add(self.trade)
+
+        response = self.client.get('/api/projects/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['results'][0]['trades'], [self.trade.id])
+
+    def test_issue_detail_last_modified(self):
+        url = f'/api/issues/{self.issue.id}/'
+        response = self.client.get(url)
+        last_modified = response['Last-Modified']
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {'status': 'IN_PROGRESS'}, format='json')
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'IN_PROGRESS')
+
+    def test_entries_are_not_shared_across_scopes(self):
+        manager_etag = self.client.get('/api/projects/')['ETag']
+
+        officer = User.objects.create_user(
+            username='officer', email='officer@site.com', password='testpass123', role='SITE OFFICER'
+        )
+        self.client.force_authenticate(user=officer)
+        response = self.client.get('/api/projects/', HTTP_IF_NONE_MATCH=manager_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 0)
+
+
+class AsyncViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user(
+            username='manager', email='manager@site.com', password='testpass123', role='PROJECT MANAGER'
+        )
+        self.project = Project.objects.create(
+            project_name='Test Project',
+            description='Test Description',
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=365)
+        )
+        self.trade = Trade.objects.create(name='ELECTRICAL')
+        self.issues = [
+            Issue.objects.create(
+                project=self.project, trade=self.trade, issue_title=f'Test Issue {n}',
+                detailed_description='Test Description', priority=priority,
+                due_date=date.today() + timedelta(days=7), status='OPEN'
+            )
+            for n, priority in enumerate(['LOW', 'HIGH', 'CRITICAL'])
+        ]
+        Comment.objects.create(issue=self.issues[0], user=self.manager, content='Checked it')
+        self.auth = f'Bearer {AccessToken.for_user(self.manager)}'
+        self.client.credentials(HTTP_AUTHORIZATION=self.auth)
+
+    def assertSameAsSync(self, path):
+        sync = self.client.get(f'/api{path}')
+        async_ = self.client.get(f'/api/async{path}')
+        self.assertEqual(async_.status_code, sync.status_code)
+        self.assertEqual(async_.content, sync.content)
+
+    def test_async_views_match_the_sync_ones(self):
+        issue = self.issues[0]
+        for path in [
+            '/auth/profile/',
+            '/issues/',
+            '/issues/?priority=HIGH&ordering=-created_at',
+            '/issues/?pagination=cursor',
+            f'/issues/{issue.id}/',
+            f'/projects/{self.project.id}/issues/?pagination=cursor',
+            f'/issues/{issue.id}/comments/',
+            '/issues/99999/',
+            f'/issues/?trade={self.trade.id + 100}',
+        ]:
+            with self.subTest(path=path):
+                self.assertSameAsSync(path)
+
+    def test_async_views_are_scoped_and_authenticated(self):
+        officer = User.objects.create_user(
+            username='officer', email='officer@site.com', password='testpass123', role='SAFETY OFFICER'
+        )
+        self.project.assigned_users.add(officer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(officer)}')
+        response = self.client.get('/api/async/issues/')
+        self.assertEqual(response.json()['count'], 2)
+
+        self.client.credentials()
+        response = self.client.get('/api/async/issues/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn('WWW-Authenticate', response)
+
+    @skipUnless(renderers.msgpack, 'msgpack is not installed')
+    def test_async_views_negotiate_msgpack(self):
+        sync = self.client.get('/api/issues/', HTTP_ACCEPT='application/msgpack')
+        async_ = self.client.get('/api/async/issues/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(async_['Content-Type'], 'application/msgpack')
+        self.assertEqual(async_.content, sync.content)
+
+    async def test_served_by_the_async_handler(self):
+        response = await self.async_client.get('/api/async/auth/profile/', headers={'Authorization': self.auth})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['email'], 'manager@site.com')
+
+    async def test_sub_contractor_scope_with_a_cold_trade_registry(self):
+        contractor = await User.objects.acreate_user(
+            username='contractor', email='contractor@site.com', password='testpass123',
+            role='SUB CONTRACTOR', specialty='ELECTRICAL'
+        )
+        await self.project.assigned_users.aadd(contractor)
+        headers = {'Authorization': f'Bearer {await sync_to_async(AccessToken.for_user)(contractor)}'}
+
+        trades.invalidate()
+        response = await self.async_client.get('/api/async/issues/', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['count'], 3)
+
+        trades.invalidate()
+        response = await self.async_client.get(f'/api/async/issues/{self.issues[0].id}/', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        self.manager = User.objects.create_user(
+            username='manager', email='manager@site.com', password='testpass123', role='PROJECT MANAGER'
+        )
+        self.client.force_authenticate(user=self.manager)
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/issues/')
+        timing = response['Server-Timing']
+        self.assertIn(f'db;desc="{len(queries)} queries"', timing)
+        self.assertIn('serializer;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+    def test_requests_are_logged_and_exported_per_route(self):
+        with self.assertLogs('core.metrics.requests', 'INFO') as logs:
+            self.client.get('/api/issues/')
+        self.assertIn('route=issue-list method=GET status=200', logs.output[0])
+
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('siteflow_request_duration_seconds_count{route="issue-list",method="GET"} 1', body)
+        self.assertIn('siteflow_request_queries_bucket{route="issue-list",method="GET",le="+Inf"} 1', body)
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_slow_query_log(self):
+        with self.assertLogs('core.metrics.slow_queries', 'WARNING') as logs:
+            self.client.get('/api/issues/')
+        self.assertIn('route=issue-list', logs.output[0])
+        self.assertIn('siteflow_slow_queries_total{route="issue-list"}', self.client.get('/metrics/').content.decode())
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 401)
+        self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+
+
+class SeedDataTests(APITestCase):
+    def seed(self, **options):
+        call_command('seed_data', projects=3, users_per_role=2, projects_per_user=2, issues_per_project=4,
+                     stdout=StringIO(), **options)
+
+    def test_seed_creates_every_role_and_keeps_summary_in_step(self):
+        self.seed()
+        self.assertEqual(Project.objects.count(), 3)
+        self.assertEqual(Issue.objects.count(), 12)
+        for role, label in User.ROLE_CHOICES:
+            self.assertEqual(User.objects.filter(role=role).count(), 2)
+        self.assertEqual(Trade.objects.count(), len(Trade._meta.get_field('name').choices))
+
+        self.assertEqual(sum(ProjectIssueStat.objects.values_list('issue_count', flat=True)), 12)
+
+    def test_seed_is_deterministic(self):
+        self.seed()
+        first = list(Issue.objects.order_by('id').values_list('issue_title', 'priority', 'status'))
+        self.seed(flush=True)
+        self.assertEqual(list(Issue.objects.order_by('id').values_list('issue_title', 'priority', 'status')), first)
+
+
+class ScopedTokenTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.officer = User.objects.create_user(
+            username='officer', email='officer@site.com', password='testpass123', role='SITE OFFICER'
+        )
+        self.project, self.other_project = [
+            Project.objects.create(
+                project_name=name, description='Test Description',
+                start_date=date.today(), end_date=date.today() + timedelta(days=365)
+            )
+            for name in ('Test Project', 'Other Project')
+        ]
+        self.project.assigned_users.add(self.officer)
+
+    def login(self):
+        response = self.client.post('/api/auth/login/', {'email': 'officer@site.com', 'password': 'testpass123'})
+        self.assertEqual(response.status_code, 200)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {response.data["access"]}')
+        return response.data
+
+    def test_authenticated_reads_do_not_load_the_user(self):
+        self.login()
+        self.client.get(f'/api/projects/{self.project.id}/summary/')  # fill the fingerprint cache
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/projects/{self.project.id}/summary/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query['sql'] for query in queries if 'FROM "core_customuser"' in query['sql']])
+
+        profile = self.client.get('/api/auth/profile/').json()
+        self.assertEqual((profile['email'], profile['role']), ('officer@site.com', 'SITE OFFICER'))
+
+    def test_assignment_change_forces_refresh(self):
+        tokens = self.login()
+        self.assertEqual(self.client.get(f'/api/projects/{self.other_project.id}/summary/').status_code, 404)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other_project.assigned_users.add(self.officer)
+        response = self.client.get('/api/projects/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'token_not_valid')
+        self.assertEqual(self.client.get('/api/async/issues/').status_code, 401)
+
+        refreshed = self.client.post('/api/auth/refresh/', {'refresh': tokens['refresh']})
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refreshed.data["access"]}')
+        self.assertEqual(self.client.get(f'/api/projects/{self.other_project.id}/summary/').status_code, 200)
+        self.assertEqual(self.client.get('/api/async/issues/').status_code, 200)
+
+    @override_settings(SCOPED_TOKEN_RECHECK_SECONDS=0)
+    def test_removal_made_by_another_process_forces_refresh(self):
+        tokens = self.login()
+        self.assertEqual(self.client.get(f'/api/projects/{self.project.id}/summary/').status_code, 200)
+
+        # Another worker handles the change: this one's caches never hear of it
+        with patch('core.signals.scope_changed'), self.captureOnCommitCallbacks(execute=True):
+            self.project.assigned_users.remove(self.officer)
+        response = self.client.get('/api/projects/')
+        self.assertEqual(response.status_code, 401)
+
+        refreshed = self.client.post('/api/auth/refresh/', {'refresh': tokens['refresh']})
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refreshed.data["access"]}')
+        self.assertEqual(self.client.get(f'/api/projects/{self.project.id}/summary/').status_code, 404)
+
+    def test_deactivated_user_is_refused(self):
+        self.login()
+        self.assertEqual(self.client.get('/api/projects/').status_code, 200)
+        self.officer.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.officer.save()
+        self.assertEqual(self.client.get('/api/projects/').status_code, 401)
+
+    def test_profile_update_saves_the_real_user(self):
+        self.login()
+        response = self.client.put('/api/auth/profile/', {'username': 'renamed'})
+        self.assertEqual(response.status_code, 200)
+        self.officer.refresh_from_db()
+        self.assertEqual(self.officer.username, 'renamed')
+        self.assertTrue(self.officer.check_password('testpass123'))
+
+    def test_email_change_forces_refresh(self):
+        tokens = self.login()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put('/api/auth/profile/', {'email': 'renamed@site.com'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/auth/profile/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'token_not_valid')
+
+        refreshed = self.client.post('/api/auth/refresh/', {'refresh': tokens['refresh']})
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refreshed.data["access"]}')
+        self.assertEqual(self.client.get('/api/auth/profile/').json()['email'], 'renamed@site.com')
+
+
+class AuditLogTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user(
+            username='manager', email='manager@site.com', password='testpass123', role='PROJECT MANAGER'
+        )
+        self.client.force_authenticate(user=self.manager)
+        self.trade = Trade.objects.create(name='ELECTRICAL')
+        self.project = Project.objects.create(
+            project_name='Test Project',
+            description='Test Description',
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=365)
+        )
+        self.issue = Issue.objects.create(
+            project=self.project, trade=self.trade, issue_title='Test Issue',
+            detailed_description='Test Description', priority='LOW',
+            due_date=date.today() + timedelta(days=7), status='OPEN'
+        )
+
+    def history_inserts(self, queries):
+        return [query for query in queries if query['sql'].startswith('INSERT INTO "core_issuehistory"')]
+
+    def test_field_changes_are_recorded_in_one_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                f'/api/issues/{self.issue.id}/', {'status': 'IN_PROGRESS', 'priority': 'HIGH'}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.history_inserts(queries)), 1)
+
+        changes = {
+            row.action: (row.old_value, row.new_value, row.user_id, row.project_id)
+            for row in self.issue.history.exclude(action='created')
+        }
+        self.assertEqual(changes, {
+            'status_changed': ('OPEN', 'IN_PROGRESS', self.manager.id, self.project.id),
+            'priority_changed': ('LOW', 'HIGH', self.manager.id, self.project.id),
+        })
+
+    def test_assign_and_bulk_update_are_recorded(self):
+        self.client.post(f'/api/issues/{self.issue.id}/assign/', {'assigned_trade': 'PLUMBING'}, format='json')
+        row = self.issue.history.get(action='trade_changed')
+        self.assertEqual(row.old_value, str(self.trade.id))
+
+        others = [
+            Issue.objects.create(
+                project=self.project, trade=self.trade, issue_title=f'Issue {n}',
+                detailed_description='Test Description', priority='LOW',
+                due_date=date.today() + timedelta(days=7), status='OPEN'
+            )
+            for n in range(5)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            self.client.patch(
+                f'/api/projects/{self.project.id}/issues/',
+                [{'id': issue.id, 'status': 'RESOLVED'} for issue in others], format='json'
+            )
+        self.assertEqual(len(self.history_inserts(queries)), 1)
+        self.assertEqual(IssueHistory.objects.filter(action='status_changed', new_value='RESOLVED').count(), 5)
+
+    def test_history_endpoints_page_and_respect_scope(self):
+        for status_value in ('IN_PROGRESS', 'RESOLVED', 'CLOSED'):
+            self.issue.status = status_value
+            self.issue.save()
+
+        response = self.client.get(f'/api/issues/{self.issue.id}/history/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [row['action'] for row in response.data['results']],
+            ['status_changed', 'status_changed', 'status_changed', 'created']
+        )
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(len(self.client.get(f'/api/projects/{self.project.id}/history/').data['results']), 4)
+
+        safety = User.objects.create_user(
+            username='safety', email='safety@site.com', password='testpass123', role='SAFETY OFFICER'
+        )
+        self.project.assigned_users.add(safety)
+        self.client.force_authenticate(user=safety)
+        self.assertEqual(self.client.get(f'/api/issues/{self.issue.id}/history/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/projects/{self.project.id}/history/').data['results'], [])
+
+    def test_deletes_keep_the_history(self):
+        issue_id = self.issue.id
+        self.client.delete(f'/api/issues/{issue_id}/')
+
+        history = self.client.get(f'/api/projects/{self.project.id}/history/').data['results']
+        self.assertEqual([(row['action'], row['issue'], row['issue_title']) for row in history], [
+            ('deleted', issue_id, None), ('created', issue_id, None),
+        ])
+        self.assertEqual(history[0]['user'], self.manager.id)
+
+        other = Issue.objects.create(
+            project=self.project, trade=self.trade, issue_title='Other Issue',
+            detailed_description='Test Description', priority='LOW',
+            due_date=date.today() + timedelta(days=7), status='OPEN'
+        )
+        response = self.client.delete(f'/api/projects/{self.project.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(
+            list(IssueHistory.objects.filter(issue_id=other.id).values_list('action', flat=True)),
+            ['created', 'deleted']
+        )
+        self.assertEqual(IssueHistory.objects.filter(project_id=self.project.id).count(), 4)
+
+    def test_prune_removes_old_months(self):
+        IssueHistory.objects.filter(issue=self.issue).update(timestamp=timezone.now() - timedelta(days=800))
+        self.issue.status = 'RESOLVED'
+        self.issue.save()
+        call_command('prune_issue_history', months=24, stdout=StringIO())
+        self.assertEqual(list(self.issue.history.values_list('action', flat=True)), ['status_changed'])
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.officer = User.objects.create_user(
+            username='officer', email='officer@site.com', password='testpass123', role='SITE OFFICER'
+        )
+        self.trade = Trade.objects.create(name='ELECTRICAL')
+        self.project, self.other_project = [
+            Project.objects.create(
+                project_name=name, description='Test Description',
+                start_date=date.today(), end_date=date.today() + timedelta(days=365)
+            )
+            for name in ('Test Project', 'Other Project')
+        ]
+        self.project.assigned_users.add(self.officer)
+        for project in (self.project, self.other_project):
+            for n, status_value in enumerate(['OPEN', 'RESOLVED', 'OPEN']):
+                issue = Issue.objects.create(
+                    project=project, trade=self.trade, issue_title=f'=Issue {n}',
+                    detailed_description='Test Description', priority='HIGH',
+                    due_date=date.today() + timedelta(days=7), status=status_value
+                )
+                Comment.objects.create(issue=issue, user=self.officer, content=f'Comment on {n}')
+        self.client.force_authenticate(user=self.officer)
+
+    def get_lines(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode().splitlines()
+
+    def test_csv_export_is_scoped(self):
+        lines = self.get_lines('/api/export/issues/')
+        self.assertTrue(lines[0].startswith('id,project_id,project,trade,issue_title'))
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(all(f',{self.project.id},Test Project,' in line for line in lines[1:]))
+        # Not run as a formula by spreadsheets
+        self.assertIn(",'=Issue 0,", lines[1])
+
+    def test_ndjson_export_with_issue_filters(self):
+        rows = [json.loads(line) for line in self.get_lines('/api/export/comments/?output=ndjson&status=OPEN')]
+        self.assertEqual([row['content'] for row in rows], ['Comment on 0', 'Comment on 2'])
+        self.assertEqual({row['project_id'] for row in rows}, {self.project.id})
+
+        rows = [json.loads(line) for line in self.get_lines(f'/api/export/issues/?output=ndjson&project={self.project.id}')]
+        self.assertEqual(len(rows), 3)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get('/api/export/users/').status_code, 404)
+        self.assertEqual(self.client.get('/api/export/issues/?output=xml').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/export/issues/?project={self.other_project.id}').status_code, 404)
+        self.assertEqual(self.client.get('/api/export/issues/?status=NOPE').status_code, 400)
+
+    async def test_streams_asynchronously_under_asgi(self):
+        auth = f'Bearer {await sync_to_async(AccessToken.for_user)(self.officer)}'
+        response = await self.async_client.get('/api/export/issues/?output=ndjson', headers={'Authorization': auth})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(content.decode().splitlines()), 3)
+
+
+class IssueImportTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.officer = User.objects.create_user(
+            username='officer', email='officer@site.com', password='testpass123', role='SITE OFFICER'
+        )
+        self.trade = Trade.objects.create(name='ELECTRICAL')
+        self.project, self.other_project = [
+            Project.objects.create(
+                project_name=name, description='Test Description',
+                start_date=date.today(), end_date=date.today() + timedelta(days=365)
+            )
+            for name in ('Test Project', 'Other Project')
+        ]
+        self.project.assigned_users.add(self.officer)
+        self.client.force_authenticate(user=self.officer)
+        self.due = str(date.today() + timedelta(days=7))
+        # Error files are written to default_storage
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.media = override_settings(MEDIA_ROOT=self.media_root)
+        self.media.enable()
+        self.addCleanup(self.media.disable)
+
+    def csv_file(self, rows):
+        lines = ['project,trade,title,description,priority,status,due_date,assigned_to'] + rows
+        return SimpleUploadedFile('issues.csv', '\n'.join(lines).encode(), content_type='text/csv')
+
+    def test_import_with_rejected_rows(self):
+        rows = [
+            f'{self.project.id},electrical,Loose socket,Level 2,high,,{self.due},officer@site.com',
+            f'{self.project.id},ELECTRICAL,Missing cover,Level 3,LOW,in progress,{self.due},',
+            f'{self.other_project.id},ELECTRICAL,Not my project,Level 1,LOW,,{self.due},',
+            f'{self.project.id},PAINTING,Unknown trade,Level 1,URGENT,,2001-01-01,nobody@site.com',
+        ]
+        response = self.client.post('/api/import/issues/', {'file': self.csv_file(rows)}, format='multipart')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((response.data['total'], response.data['imported'], response.data['errors']), (4, 2, 2))
+
+        issue = Issue.objects.get(issue_title='Loose socket')
+        self.assertEqual((issue.priority, issue.status, issue.assigned_to), ('HIGH', 'OPEN', self.officer))
+        self.assertEqual(Issue.objects.get(issue_title='Missing cover').status, 'IN_PROGRESS')
+        self.assertEqual(IssueHistory.objects.filter(action='created', user=self.officer).count(), 2)
+        self.assertEqual(sum(ProjectIssueStat.objects.values_list('issue_count', flat=True)), 2)
+
+        # Only the importing user can download the rejected rows
+        error_file = response.data['error_file']
+        self.assertIn('/api/import/errors/', error_file)
+        download = self.client.get(error_file)
+        self.assertEqual(download.status_code, 200)
+        self.assertIn(b'Not my project', b''.join(download.streaming_content))
+        self.client.force_authenticate(user=User.objects.create_user(
+            username='other', email='other@site.com', password='testpass123', role='SITE OFFICER'
+        ))
+        self.assertEqual(self.client.get(error_file).status_code, 404)
+
+        # Expired links stop working and their files are deleted by the next import
+        with override_settings(IMPORT_ERROR_FILE_SECONDS=-1):
+            importer.clean_error_files()
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'imports')), [])
+
+    def test_atomic_and_missing_columns(self):
+        rows = [
+            f'{self.project.id},ELECTRICAL,Loose socket,Level 2,HIGH,,{self.due},',
+            f'{self.project.id},ELECTRICAL,Bad date,Level 2,HIGH,,tomorrow,',
+        ]
+        response = self.client.post(
+            '/api/import/issues/', {'file': self.csv_file(rows), 'atomic': 'true'}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.data['rolled_back'])
+        self.assertFalse(Issue.objects.exists())
+
+        upload = SimpleUploadedFile('issues.csv', b'title,description\nA,B\n', content_type='text/csv')
+        response = self.client.post('/api/import/issues/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Missing column(s): project, trade', response.data['error'])
+
+    def test_management_command(self):
+        path = tempfile.mktemp(suffix='.csv')
+        errors_path = tempfile.mktemp(suffix='.csv')
+        with open(path, 'w') as csv_file:
+            csv_file.write('Title,Trade,Description,Priority,Due\n')
+            csv_file.write(f'Cracked slab,ELECTRICAL,Basement,CRITICAL,{self.due}\n')
+            csv_file.write(f'Old item,ELECTRICAL,Basement,CRITICAL,2001-01-01\n')
+        call_command('import_issues', path, project=self.project.id, errors=errors_path, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(list(Issue.objects.values_list('issue_title', flat=True)), ['Cracked slab'])
+        with open(errors_path) as errors_file:
+            self.assertIn('Due date cannot be in the past', errors_file.read())
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class SyncFeedTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.officer = User.objects.create_user(
+            username='officer', email='officer@site.com', password='testpass123', role='SITE OFFICER'
+        )
+        self.electrical = Trade.objects.create(name='ELECTRICAL')
+        self.plumbing = Trade.objects.create(name='PLUMBING')
+        self.project, self.other_project = [
+            Project.objects.create(
+                project_name=name, description='Test Description',
+                start_date=date.today(), end_date=date.today() + timedelta(days=365)
+            )
+            for name in ('Test Project', 'Other Project')
+        ]
+        self.project.assigned_users.add(self.officer)
+        self.client.force_authenticate(user=self.officer)
+
+    def create_issue(self, project, trade=None):
+        return Issue.objects.create(
+            project=project, trade=trade or self.electrical, issue_title='Loose socket',
+            detailed_description='Level 2', priority='LOW', due_date=date.today() + timedelta(days=7)
+        )
+
+    def sync(self, token=None):
+        response = self.client.get('/api/sync/', {'since': token} if token else {})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_only_changes_since_the_token(self):
+        first = self.sync()
+        self.assertTrue(first['reset'])
+
+        issue = self.create_issue(self.project)
+        self.create_issue(self.other_project)
+        comment = Comment.objects.create(issue=issue, user=self.officer, content='On it')
+        issue.status = 'IN_PROGRESS'
+        issue.save()
+
+        data = self.sync(first['token'])
+        self.assertFalse(data['reset'])
+        self.assertEqual(
+            [(change['type'], change['id'], change['deleted']) for change in data['changes']],
+            [('comment', comment.id, False), ('issue', issue.id, False)]
+        )
+        self.assertEqual(data['changes'][1]['data']['status'], 'IN_PROGRESS')
+        self.assertEqual(data['changes'][1]['project'], self.project.id)
+
+        comment_id = comment.id
+        comment.delete()
+        data = self.sync(data['token'])
+        self.assertEqual(data['changes'], [
+            {'type': 'comment', 'id': comment_id, 'project': self.project.id, 'deleted': True}
+        ])
+        self.assertEqual(self.sync(data['token'])['changes'], [])
+
+    def test_issues_out_of_scope_become_tombstones(self):
+        self.officer.role, self.officer.specialty = 'SUB CONTRACTOR', 'ELECTRICAL'
+        self.officer.save()
+        issue = self.create_issue(self.project)
+        token = self.sync()['token']
+
+        issue.trade = self.plumbing
+        issue.save()
+        moved = self.create_issue(self.project)
+        moved.project = self.other_project
+        moved.save()
+
+        data = self.sync(token)
+        self.assertEqual(
+            [(change['id'], change['deleted']) for change in data['changes']],
+            [(issue.id, True), (moved.id, True)]
+        )
+
+    def test_nothing_about_what_the_user_never_could_see(self):
+        self.officer.role, self.officer.specialty = 'SUB CONTRACTOR', 'ELECTRICAL'
+        self.officer.save()
+        token = self.sync()['token']
+
+        leak = self.create_issue(self.project, trade=self.plumbing)
+        Comment.objects.create(issue=leak, user=self.officer, content='Not mine')
+        leak.status = 'IN_PROGRESS'
+        leak.save()
+        gone = self.create_issue(self.project, trade=self.plumbing)
+        gone.delete()
+        self.assertEqual(self.sync(token)['changes'], [])
+
+        # A safety officer doesn't hear about low priority issues either
+        self.officer.role, self.officer.specialty = 'SAFETY OFFICER', None
+        self.officer.save()
+        self.create_issue(self.project)
+        self.assertEqual(self.sync(token)['changes'], [])
+
+    def test_membership_changes(self):
+        token = self.sync()['token']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other_project.assigned_users.add(self.officer)
+        data = self.sync(token)
+        self.assertEqual([(change['type'], change['id'], change['deleted']) for change in data['changes']],
+                         [('project', self.other_project.id, False)])
+        self.assertEqual(data['resync_projects'], [self.other_project.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.officer.assigned_projects.remove(self.other_project)
+        data = self.sync(data['token'])
+        self.assertEqual([(change['id'], change['deleted']) for change in data['changes']],
+                         [(self.other_project.id, True)])
+        self.assertEqual(data['resync_projects'], [])
+
+    def test_unusable_tokens_and_settling(self):
+        self.assertTrue(self.sync('nonsense')['reset'])
+        self.assertTrue(self.sync(f'0.{int(time.time()) - 90 * 86400}')['reset'])
+
+        token = self.sync()['token']
+        issue = self.create_issue(self.project)
+        with override_settings(SYNC_SETTLE_SECONDS=60):
+            data = self.sync(token)
+            # Returned, but the token doesn't move past it yet
+            self.assertEqual([change['id'] for change in data['changes']], [issue.id])
+            self.assertEqual(data['token'].split('.')[0], token.split('.')[0])
+
+
+class EventCollector:
+    """Stands in for a stream's Subscription on the in-process broker."""
+    def __init__(self):
+        self.events = []
+
+    def put(self, event):
+        self.events.append(event)
+
+
+class EventStreamTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.contractor = User.objects.create_user(
+            username='sparky', email='sparky@site.com', password='testpass123',
+            role='SUB CONTRACTOR', specialty='ELECTRICAL'
+        )
+        self.electrical = Trade.objects.create(name='ELECTRICAL')
+        self.plumbing = Trade.objects.create(name='PLUMBING')
+        self.project, self.other_project = [
+            Project.objects.create(
+                project_name=name, description='Test Description',
+                start_date=date.today(), end_date=date.today() + timedelta(days=365)
+            )
+            for name in ('Test Project', 'Other Project')
+        ]
+        self.project.assigned_users.add(self.contractor)
+
+    def test_saves_publish_after_commit(self):
+        collector = EventCollector()
+        broker = events.broker()
+        broker._subscribers.add(collector)
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                issue = Issue.objects.create(
+                    project=self.project, trade=self.electrical, issue_title='Loose socket',
+                    detailed_description='Level 2', priority='LOW', due_date=date.today() + timedelta(days=7)
+                )
+                Comment.objects.create(issue=issue, user=self.contractor, content='On it')
+                self.assertEqual(collector.events, [])
+            with self.captureOnCommitCallbacks(execute=True):
+                issue.trade = self.plumbing
+                issue.save()
+        finally:
+            broker.unsubscribe(collector)
+
+        self.assertEqual([(event['type'], event['action']) for event in collector.events],
+                         [('issue', 'created'), ('comment', 'created'), ('issue', 'updated')])
+        # Scoped by the old trade too, so the electrician hears it went away
+        self.assertEqual(collector.events[2]['scopes'], [
+            (self.project.id, self.plumbing.id, 'LOW'), (self.project.id, self.electrical.id, 'LOW')
+        ])
+
+    async def test_stream_is_scoped_like_the_issue_list(self):
+        auth = f'Bearer {await sync_to_async(AccessToken.for_user)(self.contractor)}'
+        response = await self.async_client.get('/api/async/events/', headers={'Authorization': auth})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertTrue((await anext(chunks)).startswith(b'retry:'))
+
+        def issue(pk, project, trade, priority='LOW'):
+            return Issue(pk=pk, project_id=project.id, trade_id=trade.id, priority=priority)
+
+        broker = events.broker()
+        broker.publish(events.issue_event(issue(1, self.project, self.plumbing), 'created'))
+        broker.publish(events.issue_event(issue(2, self.other_project, self.electrical), 'created'))
+        broker.publish(events.issue_event(issue(3, self.project, self.electrical), 'created'))
+        broker.publish(events.project_event(self.project.id, 'imported'))
+        try:
+            self.assertEqual(
+                await anext(chunks),
+                b'event: issue\ndata: {"type": "issue", "action": "created", "id": 3, "issue": 3, "project": %d}\n\n'
+                % self.project.id
+            )
+            self.assertTrue((await anext(chunks)).startswith(b'event: project\n'))
+        finally:
+            await chunks.aclose()
+
+
+@override_settings(DERIVATIVE_WORKERS=0)
+class AttachmentDerivativeTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = override_settings(MEDIA_ROOT=tempfile.mkdtemp(), DERIVATIVE_DIR=tempfile.mkdtemp())
+        self.media.enable()
+        self.addCleanup(self.media.disable)
+        self.officer = User.objects.create_user(
+            username='officer', email='officer@site.com', password='testpass123', role='SITE OFFICER'
+        )
+        self.project = Project.objects.create(
+            project_name='Test Project', description='Test Description',
+            start_date=date.today(), end_date=date.today() + timedelta(days=365)
+        )
+        self.project.assigned_users.add(self.officer)
+        self.issue = Issue.objects.create(
+            project=self.project, trade=Trade.objects.create(name='ELECTRICAL'), issue_title='Loose socket',
+            detailed_description='Level 2', priority='LOW', due_date=date.today() + timedelta(days=7)
+        )
+        self.client.force_authenticate(user=self.officer)
+
+    def photo(self, name='site.png', size=(2000, 1000)):
+        buffer = BytesIO()
+        Image.new('RGBA', size, (200, 40, 40, 255)).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def test_rendered_after_upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/issues/{self.issue.id}/upload/', {'file': self.photo()}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        attachment = Attachment.objects.get(id=response.data['attachment_id'])
+        self.assertEqual(len(attachment.sha256), 64)
+
+        data = self.client.get(f'/api/attachments/{attachment.id}/').data
+        self.assertEqual(set(data['derivatives']), {'thumb', 'preview'})
+        self.assertTrue(data['derivatives']['thumb'].endswith(f'/api/attachments/{attachment.id}/derivatives/thumb/'))
+
+        response = self.client.get(data['derivatives']['thumb'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        with Image.open(BytesIO(b''.join(response.streaming_content))) as thumb:
+            self.assertEqual(thumb.size, (320, 160))
+
+        response = self.client.get(data['derivatives']['thumb'], HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_missing_sizes_render_on_request(self):
+        # Uploaded without its commit hooks running: nothing rendered yet
+        self.client.post(f'/api/issues/{self.issue.id}/upload/', {'file': self.photo()}, format='multipart')
+        attachment = Attachment.objects.get()
+        preview = derivatives.imaging.derivative_path(settings.DERIVATIVE_DIR, attachment.sha256, 'preview')
+        self.assertFalse(preview.exists())
+
+        response = self.client.get(f'/api/attachments/{attachment.id}/derivatives/preview/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(preview.exists())
+
+        self.assertEqual(self.client.get(f'/api/attachments/{attachment.id}/derivatives/huge/').status_code, 404)
+
+    def test_other_files_and_other_projects(self):
+        self.client.post(
+            f'/api/issues/{self.issue.id}/upload/',
+            {'file': SimpleUploadedFile('notes.txt', b'notes', content_type='text/plain')}, format='multipart'
+        )
+        attachment = Attachment.objects.get()
+        self.assertEqual(self.client.get(f'/api/attachments/{attachment.id}/').data['derivatives'], {})
+        self.assertEqual(self.client.get(f'/api/attachments/{attachment.id}/derivatives/thumb/').status_code, 404)
+
+        self.client.post(f'/api/issues/{self.issue.id}/upload/', {'file': self.photo()}, format='multipart')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project.assigned_users.remove(self.officer)
+        photo = Attachment.objects.exclude(id=attachment.id).get()
+        self.assertEqual(self.client.get(f'/api/attachments/{photo.id}/derivatives/thumb/').status_code, 404)
+
+    @override_settings(DERIVATIVE_WORKERS=1)
+    def test_process_pool(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/issues/{self.issue.id}/upload/', {'file': self.photo('wide.png', (900, 300))}, format='multipart')
+        attachment = Attachment.objects.get()
+        self.addCleanup(derivatives.reset_pool)
+        self.addCleanup(derivatives.pool().shutdown)
+        path = derivatives.get(attachment, 'thumb')
+        with Image.open(path) as thumb:
+            self.assertEqual(thumb.size, (320, 107))
+
+
+class AttachmentDownloadTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+        self.media.enable()
+        self.addCleanup(self.media.disable)
+        self.officer = User.objects.create_user(
+            username='officer', email='officer@site.com', password='testpass123', role='SITE OFFICER'
+        )
+        self.project = Project.objects.create(
+            project_name='Test Project', description='Test Description',
+            start_date=date.today(), end_date=date.today() + timedelta(days=365)
+        )
+        self.project.assigned_users.add(self.officer)
+        self.issue = Issue.objects.create(
+            project=self.project, trade=Trade.objects.create(name='ELECTRICAL'), issue_title='Loose socket',
+            detailed_description='Level 2', priority='LOW', due_date=date.today() + timedelta(days=7)
+        )
+        self.client.force_authenticate(user=self.officer)
+        self.content = bytes(range(256)) * 40
+        self.client.post(
+            f'/api/issues/{self.issue.id}/upload/',
+            {'file': SimpleUploadedFile('drawing.pdf', self.content, content_type='application/pdf')}, format='multipart'
+        )
+        self.attachment = Attachment.objects.get()
+        self.url = f'/api/attachments/{self.attachment.id}/download/'
+
+    def test_download_and_ranges(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('attachment;', response['Content-Disposition'])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_signed_url(self):
+        download_url = self.client.get(f'/api/attachments/{self.attachment.id}/').data['download_url']
+        self.client.force_authenticate(user=None)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(download_url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[:10])
+
+        self.assertEqual(self.client.get(download_url[:-2] + 'xx/').status_code, 403)
+        self.client.force_authenticate(user=self.officer)
+        with override_settings(DOWNLOAD_URL_SECONDS=-120):
+            expired = self.client.get(f'/api/attachments/{self.attachment.id}/').data['download_url']
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get(expired).status_code, 403)
+
+    @override_settings(DOWNLOAD_OFFLOAD='nginx')
+    def test_offloaded_to_nginx(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.attachment.file.name)
+        self.assertEqual(response.content, b'')
+
+    def test_other_projects(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project.assigned_users.remove(self.officer)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+@override_settings(BLOB_GC_ASYNC=False, BLOB_GC_GRACE_SECONDS=0)
+class BlobStorageTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = override_settings(MEDIA_ROOT=tempfile.mkdtemp(), DERIVATIVE_DIR=tempfile.mkdtemp())
+        self.media.enable()
+        self.addCleanup(self.media.disable)
+        self.officer = User.objects.create_user(
+            username='officer', email='officer@site.com', password='testpass123', role='SITE OFFICER'
+        )
+        self.project = Project.objects.create(
+            project_name='Test Project', description='Test Description',
+            start_date=date.today(), end_date=date.today() + timedelta(days=365)
+        )
+        self.project.assigned_users.add(self.officer)
+        self.issue = Issue.objects.create(
+            project=self.project, trade=Trade.objects.create(name='ELECTRICAL'), issue_title='Loose socket',
+            detailed_description='Level 2', priority='LOW', due_date=date.today() + timedelta(days=7)
+        )
+        self.client.force_authenticate(user=self.officer)
+
+    def upload(self, name, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f'/api/issues/{self.issue.id}/upload/',
+                {'file': SimpleUploadedFile(name, content, content_type='application/octet-stream')}, format='multipart'
+            )
+        return Attachment.objects.get(id=response.data['attachment_id'])
+
+    def blob_files(self):
+        return sorted(blobs.stored())
+
+    def test_same_content_stored_once(self):
+        first = self.upload('KAHAWA_SUKARI_PROJECT.pdf', b'%PDF drawing set')
+        second = self.upload('KAHAWA_SUKARI_PROJECT.pdf', b'%PDF drawing set')
+        other = self.upload('notes.txt', b'notes')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(self.blob_files(), sorted({first.file.name, other.file.name}))
+
+        self.assertEqual(first.file_name, 'KAHAWA_SUKARI_PROJECT.pdf')
+        self.assertEqual(first.file_size, 16)
+        self.assertEqual(first.content_type, 'application/pdf')
+        self.assertEqual(first.file.name, f'attachments/{first.sha256[:2]}/{first.sha256}')
+        with first.file.open('rb') as stored:
+            self.assertEqual(stored.read(), b'%PDF drawing set')
+
+        data = self.client.get(f'/api/attachments/{other.id}/').data
+        self.assertEqual((data['file_name'], data['file_size'], data['content_type']), ('notes.txt', 5, 'text/plain'))
+        response = self.client.get(f'/api/attachments/{first.id}/download/')
+        self.assertIn('KAHAWA_SUKARI_PROJECT.pdf', response['Content-Disposition'])
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+    def test_collected_with_last_reference(self):
+        first = self.upload('site.png', b'photo')
+        second = self.upload('site-copy.png', b'photo')
+        derivative = derivatives.imaging.derivative_path(settings.DERIVATIVE_DIR, first.sha256, 'thumb')
+        derivative.parent.mkdir(parents=True, exist_ok=True)
+        derivative.write_bytes(b'thumb')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(self.blob_files(), [second.file.name])
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual(self.blob_files(), [])
+        self.assertFalse(derivative.exists())
+
+    def test_recently_used_blobs_are_kept(self):
+        attachment = self.upload('notes.txt', b'notes')
+        with override_settings(BLOB_GC_GRACE_SECONDS=3600):
+            with self.captureOnCommitCallbacks(execute=True):
+                attachment.delete()
+            self.assertEqual(blobs.sweep(), 0)
+        self.assertEqual(len(self.blob_files()), 1)
+
+        call_command('gc_blobs', stdout=StringIO())
+        self.assertEqual(self.blob_files(), [])
+
+    def test_migration_deduplicates_existing_files(self):
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'attachments'))
+        for name in ('list_test.txt', 'list_test_jJfDJDo.txt'):
+            with open(os.path.join(settings.MEDIA_ROOT, 'attachments', name), 'wb') as old:
+                old.write(b'Content for listing')
+        for name in ('list_test.txt', 'list_test_jJfDJDo.txt', 'missing.txt'):
+            Attachment.objects.bulk_create([Attachment(issue=self.issue, user=self.officer, file=f'attachments/{name}')])
+
+        migration = importlib.import_module('core.migrations.0016_deduplicate_attachments')
+        migration.deduplicate(apps, None)
+
+        rows = {row.file_name: row for row in Attachment.objects.all()}
+        self.assertEqual(rows['list_test.txt'].file.name, rows['list_test_jJfDJDo.txt'].file.name)
+        self.assertEqual(rows['list_test.txt'].file_size, 19)
+        self.assertEqual(rows['missing.txt'].file.name, 'attachments/missing.txt')
+        self.assertEqual(sorted(os.listdir(os.path.join(settings.MEDIA_ROOT, 'attachments'))), [rows['list_test.txt'].sha256[:2]])
+
+
+class GunicornConfigTests(TestCase):
+    def on_starting(self, workers):
+        config = runpy.run_path(os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'))
+        config['on_starting'](SimpleNamespace(cfg=SimpleNamespace(workers=workers)))
+
+    @override_settings(SHARED_CACHE=False)
+    def test_several_workers_need_a_shared_cache(self):
+        with self.assertRaisesMessage(RuntimeError, 'shared cache'):
+            self.on_starting(workers=2)
+        self.on_starting(workers=1)
+
+    @override_settings(SHARED_CACHE=True)
+    def test_several_workers_with_a_shared_cache(self):
+        self.on_starting(workers=2)
+
+
+class RendererTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user(
+            username='manager', email='manager@site.com', password='testpass123', role='PROJECT MANAGER'
+        )
+        self.project = Project.objects.create(
+            project_name='Test Project', description='Test Description',
+            start_date=date.today(), end_date=date.today() + timedelta(days=365)
+        )
+        trade = Trade.objects.create(name='ELECTRICAL')
+        for n in range(20):
+            Issue.objects.create(
+                project=self.project, trade=trade, issue_title=f'Issue {n}',
+                detailed_description='Cracked slab near gridline C4, — see drawing S-201. ' * 10,
+                priority='LOW', due_date=date.today() + timedelta(days=7), status='OPEN'
+            )
+        self.client.force_authenticate(user=self.manager)
+
+    def test_orjson_output_matches_drf(self):
+        data = self.client.get('/api/issues/').data
+        self.assertEqual(renderers.ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+        response = self.client.post('/api/trades/', b'{"name": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_orjson_escapes_line_separators_like_drf(self):
+        data = {'detailed_description': 'Pasted from the spec\u2028line two\u2029next paragraph'}
+        rendered = renderers.ORJSONRenderer().render(data)
+        self.assertEqual(rendered, JSONRenderer().render(data))
+        self.assertIn(b'\\u2028', rendered)
+        self.assertEqual(json.loads(rendered), data)
+
+    @skipUnless(renderers.msgpack, 'msgpack is not installed')
+    def test_msgpack_through_accept(self):
+        response = self.client.get('/api/issues/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(renderers.msgpack.unpackb(response.content), json.loads(self.client.get('/api/issues/').content))
+
+    def test_large_responses_compressed(self):
+        response = self.client.get('/api/issues/', HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))['results']), 20)
+
+        self.assertFalse(self.client.get('/api/issues/', HTTP_ACCEPT_ENCODING='identity').has_header('Content-Encoding'))
+        with override_settings(COMPRESS_MIN_BYTES=10 ** 6):
+            self.assertFalse(self.client.get('/api/issues/', HTTP_ACCEPT_ENCODING='gzip').has_header('Content-Encoding'))
+
+    @override_settings(COMPRESS_MIN_BYTES=1, RESPONSE_CACHE=True)
+    def test_compressed_etag_still_validates(self):
+        response = self.client.get('/api/projects/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        response = self.client.get('/api/projects/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class SparseFieldsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user(
+            username='manager', email='manager@site.com', password='testpass123', role='PROJECT MANAGER'
+        )
+        self.project = Project.objects.create(
+            project_name='Test Project', description='Test Description',
+            start_date=date.today(), end_date=date.today() + timedelta(days=365)
+        )
+        self.trade = Trade.objects.create(name='ELECTRICAL')
+        self.client.force_authenticate(user=self.manager)
+
+    def add_issues(self, count):
+        for n in range(count):
+            issue = Issue.objects.create(
+                project=self.project, trade=self.trade, issue_title=f'Issue {n}', assigned_to=self.manager,
+                detailed_description='Long description ' * 50, priority='LOW',
+                due_date=date.today() + timedelta(days=7), status='OPEN'
+            )
+            Comment.objects.create(issue=issue, user=self.manager, content='Checked')
+
+    def test_fields_load_only_those_columns(self):
+        self.add_issues(2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/issues/?fields=issue_title,status&pagination=cursor')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'issue_title', 'status'})
+        sql = queries.captured_queries[-1]['sql']
+        self.assertNotIn('detailed_description', sql)
+        self.assertNotIn('core_project', sql)
+
+        response = self.client.get(f'/api/issues/{Issue.objects.first().id}/?fields=project_name')
+        self.assertEqual(response.data, {'id': Issue.objects.first().id, 'project_name': 'Test Project'})
+
+    def test_expand_costs_the_same_for_any_page_size(self):
+        url = '/api/issues/?fields=issue_title&expand=project,trade,assigned_to,comments_count'
+        self.add_issues(2)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.add_issues(8)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(url)
+
+        issue = response.data['results'][0]
+        self.assertEqual(issue['project'], {'id': self.project.id, 'project_name': 'Test Project'})
+        self.assertEqual(issue['trade'], {'id': self.trade.id, 'name': 'ELECTRICAL'})
+        self.assertEqual(issue['assigned_to']['email'], 'manager@site.com')
+        self.assertEqual(issue['comments_count'], 1)
+        self.assertNotIn('detailed_description', issue)
+
+    def test_comments_and_attachments(self):
+        self.add_issues(1)
+        issue = Issue.objects.get()
+        response = self.client.get(f'/api/issues/{issue.id}/comments/?fields=content&expand=user')
+        self.assertEqual(response.data[0]['user']['username'], 'manager')
+        self.assertEqual(set(response.data[0]), {'id', 'content', 'user'})
+
+        with override_settings(MEDIA_ROOT=tempfile.mkdtemp()):
+            self.client.post(
+                f'/api/issues/{issue.id}/upload/',
+                {'file': SimpleUploadedFile('notes.txt', b'notes', content_type='text/plain')}, format='multipart'
+            )
+        response = self.client.get('/api/attachments/?fields=file_name,file_size&expand=issue')
+        self.assertEqual(response.data['results'][0], {
+            'id': Attachment.objects.get().id, 'issue': {'id': issue.id, 'issue_title': 'Issue 0'},
+            'file_name': 'notes.txt', 'file_size': 5,
+        })
+
+    def test_writes_return_everything(self):
+        self.add_issues(1)
+        issue = Issue.objects.get()
+        response = self.client.patch(f'/api/issues/{issue.id}/?fields=status', {'status': 'RESOLVED'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('detailed_description', response.data)
+
+    @override_settings(RESPONSE_CACHE=True)
+    def test_cached_comments_count_follows_new_comments(self):
+        self.add_issues(1)
+        issue = Issue.objects.get()
+        url = f'/api/issues/{issue.id}/?expand=comments_count'
+        response = self.client.get(url)
+        self.assertEqual(response.data['comments_count'], 1)
+        etag = response['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(issue=issue, user=self.manager, content='Fixed')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['comments_count'], 2)
+        self.assertNotIn('Last-Modified', response)
+
+
+class TradeRegistryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user(
+            username='manager', email='manager@site.com', password='testpass123', role='PROJECT MANAGER'
+        )
+        self.client.force_authenticate(user=self.manager)
+        self.electrical = Trade.objects.create(name='ELECTRICAL')
+        self.plumbing = Trade.objects.create(name='PLUMBING')
+        self.project = Project.objects.create(
+            project_name='Test Project',
+            description='Test Description',
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=365)
+        )
+        self.issue = Issue.objects.create(
+            project=self.project, trade=self.electrical, issue_title='Test Issue',
+            detailed_description='Test Description', priority='LOW',
+            due_date=date.today() + timedelta(days=7), status='OPEN'
+        )
+
+    def test_lookups_need_no_query_once_loaded(self):
+        trades.all()
+        with self.assertNumQueries(0):
+            self.assertEqual(trades.by_name('PLUMBING'), self.plumbing)
+            self.assertEqual(trades.by_id(self.electrical.id), self.electrical)
+            self.assertEqual(trades.get(str(self.plumbing.id)), self.plumbing)
+            self.assertEqual(trades.get('electrical'), self.electrical)
+            self.assertIsNone(trades.get(True))
+            self.assertEqual(trades.names(), {self.electrical.id: 'ELECTRICAL', self.plumbing.id: 'PLUMBING'})
+
+    def test_writes_are_seen_here_at_once_and_elsewhere_after_commit(self):
+        trades.all()
+        with self.captureOnCommitCallbacks(execute=True):
+            painting = Trade.objects.create(name='PAINTING')
+            # This process dropped its copy right away
+            self.assertEqual(trades.by_name('PAINTING'), painting)
+            version = cache.get(trades.VERSION_KEY)
+        # ...and other processes see the version move once it committed
+        self.assertNotEqual(cache.get(trades.VERSION_KEY), version)
+
+        trades.all()
+        with override_settings(TRADE_REGISTRY_CHECK_SECONDS=0):
+            # Another process renaming a trade
+            Trade.objects.filter(pk=painting.pk).update(name='GENERAL')
+            cache.incr(trades.VERSION_KEY)
+            self.assertEqual(trades.by_id(painting.pk).name, 'GENERAL')
+
+    def test_add_trade_to_project_links_the_trade(self):
+        response = self.client.post(
+            f'/api/projects/{self.project.id}/add_trade/', {'trade_name': 'PLUMBING'}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['trade_id'], self.plumbing.id)
+        self.assertEqual(list(self.project.trades.all()), [self.plumbing])
+
+        response = self.client.post(
+            f'/api/projects/{self.project.id}/add_trade/', {'trade_name': 'PLUMBING'}, format='json'
+        )
+        self.assertIn('already exists', response.data['message'])
+        self.assertEqual(self.project.trades.count(), 1)
+
+        response = self.client.post(
+            f'/api/projects/{self.project.id}/add_trade/', {'trade_name': 'JUGGLING'}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_assign_issue_resolves_the_trade_without_a_query(self):
+        trades.all()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                f'/api/issues/{self.issue.id}/assign/', {'assigned_trade': 'PLUMBING'}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['old_assignment'], 'ELECTRICAL')
+        self.assertFalse([query for query in queries if 'core_trade' in query['sql']])
+        self.issue.refresh_from_db()
+        self.assertEqual(self.issue.trade_id, self.plumbing.id)
+
+    def test_trade_filter_and_sub_contractor_scope_use_ids(self):
+        Issue.objects.create(
+            project=self.project, trade=self.plumbing, issue_title='Leak',
+            detailed_description='Test Description', priority='LOW',
+            due_date=date.today() + timedelta(days=7), status='OPEN'
+        )
+        response = self.client.get('/api/issues/?trade=plumbing')
+        self.assertEqual([issue['issue_title'] for issue in response.data['results']], ['Leak'])
+        response = self.client.get(f'/api/issues/?trade={self.plumbing.id + 100}')
+        self.assertEqual(response.status_code, 400)
+
+        plumber = User.objects.create_user(
+            username='plumber', email='plumber@site.com', password='testpass123',
+            role='SUB CONTRACTOR', specialty='PLUMBING'
+        )
+        self.project.assigned_users.add(plumber)
+        self.client.force_authenticate(user=plumber)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/issues/')
+        self.assertEqual([issue['issue_title'] for issue in response.data['results']], ['Leak'])
+        self.assertFalse([query for query in queries if 'core_trade' in query['sql']])
@@ -0,0 +1,146 @@
+"""
+Process-local registry of trades.
+
+There are only a handful of trades (TRADE_CHOICES) and they are hardly ever
+changed, yet most requests turn one into the other: a trade name into the
+Trade to assign an issue to, a sub-contractor's specialty into the trade id
+their issues are filtered on, an id from a request body or ``?trade=`` into
+a Trade. Each process keeps them all in memory and answers those with no
+query.
+
+A write to Trade (core.signals) drops this process's copy straight away
+and, once it commits, bumps a version counter in the cache. Other
+processes compare it at most every TRADE_REGISTRY_CHECK_SECONDS and reload
+when it moved, so that is how long they can be behind on a rename or a
+delete. A name or id they don't know makes them reload too (at most once a
+second), so a trade added elsewhere is found straight away.
+
+Other processes only see the counter move if the cache is shared between
+them (settings.SHARED_CACHE). With the default per-process memory cache
+they would keep a deleted trade for good, which is one of the reasons
+gunicorn.conf.py won't start more than one worker without a shared cache.
+
+The Trade instances handed out are shared between requests: don't modify
+them.
+"""
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Trade
+
+VERSION_KEY = 'trades:version'
+MISS_RELOAD_SECONDS = 1
+
+
+@dataclass(frozen=True)
+class _Loaded:
+    version: int
+    loaded_at: float
+    by_id: dict
+    by_name: dict
+
+
+_loaded = None
+_checked_at = 0.0
+
+
+def _current_version():
+    # A timestamp, so an evicted counter can't come back at an old value
+    cache.add(VERSION_KEY, time.time_ns(), None)
+    return cache.get(VERSION_KEY)
+
+
+def _load():
+    global _loaded, _checked_at
+    # Read the version first: a write committing meanwhile bumps it past this
+    # one, and the next check reloads
+    version = _current_version()
+    trades = list(Trade.objects.order_by('name'))
+    _loaded = _Loaded(
+        version=version,
+        loaded_at=time.monotonic(),
+        by_id={trade.id: trade for trade in trades},
+        by_name={trade.name: trade for trade in trades},
+    )
+    _checked_at = _loaded.loaded_at
+    return _loaded
+
+
+def _current():
+    global _checked_at
+    loaded = _loaded
+    if loaded is None:
+        return _load()
+    now = time.monotonic()
+    if now - _checked_at >= settings.TRADE_REGISTRY_CHECK_SECONDS:
+        _checked_at = now
+        if _current_version() != loaded.version:
+            return _load()
+    return loaded
+
+
+def _lookup(index, key):
+    loaded = _current()
+    trade = getattr(loaded, index).get(key)
+    if trade is None and time.monotonic() - loaded.loaded_at >= MISS_RELOAD_SECONDS:
+        trade = getattr(_load(), index).get(key)
+    return trade
+
+
+def all():
+    """Every trade, by name."""
+    return list(_current().by_name.values())
+
+
+def names():
+    """``{id: name}`` of every trade."""
+    return {trade_id: trade.name for trade_id, trade in _current().by_id.items()}
+
+
+def by_id(trade_id):
+    """The Trade with this id, None if there is none."""
+    return _lookup('by_id', trade_id)
+
+
+def by_name(name):
+    """The Trade called ``name`` (e.g. 'ELECTRICAL'), None if there is none."""
+    return _lookup('by_name', name)
+
+
+def get(value):
+    """The Trade ``value`` is the id (an int or digits) or the name of, None if there is none."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return by_id(value)
+    value = str(value).strip()
+    if value.isdigit():
+        return by_id(int(value))
+    return by_name(value.upper())
+
+
+def invalidate():
+    """Forget this process's copy, it is reloaded on next use."""
+    global _loaded
+    _loaded = None
+
+
+def changed():
+    """
+    A trade was written: drop this process's copy now (so it sees its own
+    write), and every other process's once the transaction commits.
+    """
+    invalidate()
+    transaction.on_commit(_bump)
+
+
+def _bump():
+    invalidate()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), None)
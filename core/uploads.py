@@ -0,0 +1,126 @@
+"""
+Chunked, resumable attachment uploads.
+
+1. POST /api/issues/<id>/uploads/ {"file_name": ..., "total_size": ...}
+   opens an UploadSession. The size limit is checked here, before any data
+   is sent.
+2. PUT /api/uploads/<uuid>/ with the raw bytes of the next chunk and an
+   ``Upload-Offset`` header saying where the chunk starts. An optional
+   ``Upload-Checksum: sha256 <hex>`` header is verified for the chunk.
+3. GET /api/uploads/<uuid>/ returns the server's offset, which is where a
+   client resumes after a dropped connection.
+
+Chunks are streamed from the request to a spool file in small blocks, so a
+chunk is never held in memory whole, and checked there. Only then is the
+session locked, for as long as it takes to copy the spooled chunk onto the
+end of the partial file: a slow client doesn't hold a transaction (and a
+database connection) open while it sends. When the last chunk arrives the
+file is saved to storage as an Attachment and the partial file removed.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+
+from .models import Attachment
+
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+MAX_CHUNK_SIZE = 2 * 1024 * 1024
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class ChunkError(Exception):
+    """The chunk was rejected. Nothing was kept, the offset is unchanged."""
+
+
+def upload_dir():
+    directory = Path(getattr(settings, 'CHUNKED_UPLOAD_DIR', Path(settings.BASE_DIR) / 'uploads_partial'))
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def partial_path(session):
+    return upload_dir() / f'{session.pk}.part'
+
+
+def spool_chunk(stream, length, checksum=None):
+    """
+    Stream ``length`` bytes from ``stream`` into a spool file and return its
+    path; the caller removes it. ``checksum`` is the expected sha256 hex
+    digest of the chunk.
+    """
+    fd, path = tempfile.mkstemp(dir=upload_dir(), suffix='.chunk')
+    digest = hashlib.sha256()
+    received = 0
+    try:
+        with os.fdopen(fd, 'wb') as spool:
+            while received < length:
+                block = stream.read(min(READ_BLOCK_SIZE, length - received)) if stream else b''
+                if not block:
+                    break
+                spool.write(block)
+                digest.update(block)
+                received += len(block)
+
+        if received != length:
+            raise ChunkError(f'Chunk incomplete: expected {length} bytes, received {received}')
+
+        if checksum and digest.hexdigest() != checksum.lower():
+            raise ChunkError('Chunk checksum does not match, send it again')
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def append_chunk(session, spooled):
+    """
+    Copy the spooled chunk onto the end of the session's partial file and
+    advance its offset. The caller must hold a lock on ``session``.
+    """
+    length = os.path.getsize(spooled)
+    with open(partial_path(session), 'ab+') as partial, open(spooled, 'rb') as chunk:
+        # Drop anything past the offset left behind by a chunk that failed halfway
+        partial.truncate(session.offset)
+        partial.seek(session.offset)
+        shutil.copyfileobj(chunk, partial, READ_BLOCK_SIZE)
+
+    session.offset += length
+    session.save(update_fields=['offset', 'updated_at'])
+
+
+def complete(session):
+    """Save the assembled file as an Attachment and remove the partial file."""
+    path = partial_path(session)
+    with transaction.atomic():
+        attachment = Attachment(issue=session.issue, user=session.user)
+        with open(path, 'rb') as assembled:
+            # Storage copies the file across in chunks
+            attachment.file.save(session.file_name, File(assembled), save=True)
+        session.attachment = attachment
+        session.save(update_fields=['attachment', 'updated_at'])
+    os.remove(path)
+    return attachment
+
+
+def discard(session):
+    """Delete an unfinished session and its partial file."""
+    path = partial_path(session)
+    if path.exists():
+        os.remove(path)
+    session.delete()
+
+
+def parse_checksum(header):
+    """``'sha256 <hex>'`` -> ``'<hex>'``. None if no header, ValueError if not sha256."""
+    if not header:
+        return None
+    algorithm, _, value = header.strip().partition(' ')
+    if algorithm.lower() != 'sha256' or not value:
+        raise ValueError('Upload-Checksum must be "sha256 <hex digest>"')
+    return value.strip()
@@ -1,8 +1,9 @@
 from django.urls import path, include
-from .views import ProjectViewSet, TradeViewSet, IssueViewSet, CommentViewSet, AttachmentViewSet, register_user, project_issues, add_trade_to_project, assign_issue, upload_attachment, issue_comments, user_profile,test_assigned_projects
+from .views import ProjectViewSet, TradeViewSet, IssueViewSet, CommentViewSet, AttachmentViewSet, register_user, project_issues, add_trade_to_project, assign_issue, upload_attachment, issue_comments, user_profile,test_assigned_projects, start_upload, upload_session, project_summary, issue_summary, issue_history, project_history, ExportView, import_issues, import_errors, sync_changes, attachment_derivative, attachment_download, signed_download
 from rest_framework.routers import DefaultRouter
-from rest_framework_simplejwt.views import TokenObtainPairView
-from .views import dashboard
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from .views import dashboard, prometheus_metrics
+from . import async_views
 
 
 router = DefaultRouter()
@@ -15,14 +16,36 @@ router.register(r'attachments', AttachmentViewSet,)
 
 urlpatterns = [
     path('dashboard/', dashboard, name='dashboard'),
+    path('metrics/', prometheus_metrics, name='metrics'),
     path('api/auth/register/', register_user, name='register'),
     path('api/auth/login/', TokenObtainPairView.as_view(), name='login'),
+    path('api/auth/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
     path('api/auth/profile/', user_profile, name='user-profile'),
     path('api/projects/<int:project_id>/issues/', project_issues, name='project-issues'),
+    path('api/projects/<int:project_id>/summary/', project_summary, name='project-summary'),
+    path('api/projects/<int:project_id>/history/', project_history, name='project-history'),
     path('api/projects/<int:project_id>/add_trade/', add_trade_to_project, name='add-trade-to-project'),
     path('api/issues/<int:issue_id>/assign/', assign_issue, name='assign-issue'),
     path('api/issues/<int:issue_id>/upload/', upload_attachment, name='upload-attachment'),
+    path('api/issues/<int:issue_id>/uploads/', start_upload, name='start-upload'),
+    path('api/uploads/<uuid:upload_id>/', upload_session, name='upload-session'),
+    path('api/attachments/<int:attachment_id>/derivatives/<str:size>/', attachment_derivative, name='attachment-derivative'),
+    path('api/attachments/<int:attachment_id>/download/', attachment_download, name='attachment-download'),
+    path('api/files/<str:token>/', signed_download, name='signed-download'),
     path('api/issues/<int:issue_id>/comments/', issue_comments, name='issue-comments'),
+    path('api/issues/<int:issue_id>/history/', issue_history, name='issue-history'),
+    path('api/summary/', issue_summary, name='issue-summary'),
+    path('api/export/<str:resource>/', ExportView.as_view(), name='export'),
+    path('api/import/issues/', import_issues, name='import-issues'),
+    path('api/import/errors/<str:token>/', import_errors, name='import-errors'),
+    path('api/sync/', sync_changes, name='sync'),
     path('api/test-assigned-projects/', test_assigned_projects, name='test-assigned-projects'),
+    # Async (ASGI) versions of the hot read paths, see core/async_views.py
+    path('api/async/auth/profile/', async_views.user_profile, name='async-user-profile'),
+    path('api/async/issues/', async_views.issue_list, name='async-issue-list'),
+    path('api/async/issues/<int:issue_id>/', async_views.issue_detail, name='async-issue-detail'),
+    path('api/async/issues/<int:issue_id>/comments/', async_views.issue_comments, name='async-issue-comments'),
+    path('api/async/projects/<int:project_id>/issues/', async_views.project_issues, name='async-project-issues'),
+    path('api/async/events/', async_views.event_stream, name='async-events'),
     path('api/', include(router.urls)),
 ]
\ No newline at end of file
@@ -1,9 +1,22 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
+from PIL import Image, UnidentifiedImageError
 from rest_framework import viewsets
-from .models import Project, Trade, Issue, Comment, Attachment
-from .serializers import ProjectSerializer, TradeSerializer, IssueSerializer, CommentSerializer, AttachmentSerializer, UserSerializer
+from .models import Project, Trade, Issue, Comment, Attachment, UploadSession, IssueHistory, TRADE_CHOICES
+from .serializers import ProjectSerializer, TradeSerializer, IssueSerializer, CommentSerializer, AttachmentSerializer, UserSerializer, IssueHistorySerializer
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework import status
@@ -12,10 +25,28 @@ from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
 from .filters import IssueFilter, CommentFilter
 from django.db.models import Q
+from django.db import transaction
+from .visibility import get_visibility
+from .pagination import KeysetPagination, PageOrCursorPagination, paginate_nested
+from . import audit, bulk, derivatives, downloads, export, importer, notifications, summary, sync, trades, uploads
+from .response_cache import CachedResponseMixin
+from .metrics import registry as metrics_registry
 
 def dashboard(request):
     return render(request, 'core/dashboard.html')
 
+def prometheus_metrics(request):
+    """
+    Request metrics in the Prometheus text format (see core/metrics.py)
+    GET /metrics/
+    When METRICS_TOKEN is set, send it as "Authorization: Bearer <token>"
+    """
+    if settings.METRICS_TOKEN:
+        sent = request.META.get('HTTP_AUTHORIZATION', '').removeprefix('Bearer ')
+        if not constant_time_compare(sent, settings.METRICS_TOKEN):
+            return HttpResponse(status=401)
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 User = get_user_model()
 
 @api_view(['POST'])
@@ -59,7 +90,9 @@ def user_profile(request):
         return Response(serializer.data)
     
     elif request.method == 'PUT':
-        serializer = UserSerializer(request.user, data=request.data, partial=True)
+        # request.user may have been built from the token's claims, save the real row
+        user = User.objects.get(pk=request.user.pk)
+        serializer = UserSerializer(user, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data)
@@ -72,27 +105,19 @@ def user_profile(request):
             status=status.HTTP_405_METHOD_NOT_ALLOWED
         )
 
-class ProjectViewSet(viewsets.ModelViewSet):
+class ProjectViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Project.objects.all()
     serializer_class = ProjectSerializer
     permission_classes = [IsAuthenticated]
+    # GETs are cached until a project (or its trades / team) changes
+    cache_models = ('project',)
     
     def get_queryset(self):
         """FILTER GLASSES for Projects"""
-        user = self.request.user
-        print(f"DEBUG: User {user.email} with role {user.role} is accessing projects")  
-        
-        # ADMIN & PROJECT MANAGER: See all projects
-        if user.role in ['ADMIN', 'PROJECT MANAGER']:
-            projects = Project.objects.all()
-            print(f"DEBUG: Showing ALL {projects.count()} projects to {user.role}")
-        
-        # EVERYONE ELSE: "Show me only assigned projects/issues"
-        else:
-            projects = user.assigned_projects.all()
-            print(f"DEBUG: Showing {projects.count()} assigned projects to {user.role}")
-            
-        return projects
+        # ADMIN & PROJECT MANAGER see all projects, everyone else only the
+        # ones they are assigned to (worked out once by the visibility index)
+        projects = get_visibility(self.request.user).project_queryset()
+        return ProjectSerializer.setup_eager_loading(projects)
     
     def create(self, request, *args, **kwargs):
         """Check permissions before allowing project creation"""
@@ -131,12 +156,17 @@ class ProjectViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        return super().destroy(request, *args, **kwargs)
+        # One insert for the "deleted" history rows of all its issues
+        with transaction.atomic(), audit.batch():
+            return super().destroy(request, *args, **kwargs)
     
-class TradeViewSet(viewsets.ModelViewSet):
+class TradeViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Trade.objects.all()
     serializer_class = TradeSerializer
     permission_classes = [IsAuthenticated]
+    # Everyone sees the same trades
+    cache_models = ('trade',)
+    cache_scoped = False
     
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -166,87 +196,87 @@ def add_trade_to_project(request, project_id):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # STEP 3: Create the trade and link it to the project
-    try:
-        # Create the trade or get existing one
-        trade, created = Trade.objects.get_or_create(
-            name=trade_name,
-            project=project
-        )
-        
-        # STEP 4: Return success message
-        if created:
-            message = f"Trade '{trade_name}' added to project '{project.project_name}'"
-        else:
-            message = f"Trade '{trade_name}' already exists in project '{project.project_name}'"
-        
-        return Response({
-            "message": message,
-            "project_id": project.id,
-            "project_name": project.project_name,
-            "trade_name": trade_name,
-            "trade_id": trade.id
-        }, status=status.HTTP_201_CREATED)
-        
-    except Exception as e:
-        return Response(
-            {"error": f"Failed to add trade: {str(e)}"}, 
-            status=status.HTTP_400_BAD_REQUEST
-        )
+    # STEP 3: Find the trade (creating it the first time a valid one is used)
+    trade = trades.by_name(trade_name)
+    if trade is None:
+        valid_trades = [choice[0] for choice in TRADE_CHOICES]
+        if trade_name not in valid_trades:
+            return Response(
+                {"error": f"Invalid trade. Must be one of: {', '.join(valid_trades)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        trade, _ = Trade.objects.get_or_create(name=trade_name)
+    
+    # STEP 4: Link it to the project
+    created = not project.trades.filter(pk=trade.pk).exists()
+    if created:
+        project.trades.add(trade)
+        message = f"Trade '{trade_name}' added to project '{project.project_name}'"
+    else:
+        message = f"Trade '{trade_name}' already exists in project '{project.project_name}'"
+    
+    # STEP 5: Return success message
+    return Response({
+        "message": message,
+        "project_id": project.id,
+        "project_name": project.project_name,
+        "trade_name": trade_name,
+        "trade_id": trade.id
+    }, status=status.HTTP_201_CREATED)
     
-class IssueViewSet(viewsets.ModelViewSet):
+class IssueViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Issue.objects.all()
     serializer_class = IssueSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    # Only the detail view is cached, it shows the project name too (and
+    # with ?expand= the trade's name and the number of comments)
+    cache_models = ('issue', 'project', 'trade', 'comment')
+    cache_actions = ('retrieve',)
+    # ?search= is handled by IssueFilter through the full-text index
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_class = IssueFilter
-    search_fields = ['issue_title', 'detailed_description']
     ordering_fields = ['priority', 'due_date', 'created_at']
+    pagination_class = PageOrCursorPagination
+    cursor_ordering = ['-created_at']
     
     def get_queryset(self):
         """
         FILTER GLASSES: Show people only what they should see
         Like giving different people different pairs of glasses
+
+        - ADMIN / PROJECT MANAGER: every issue
+        - SITE OFFICER: issues from their assigned projects
+        - SUB CONTRACTOR: their specialty's issues from their assigned projects
+        - SAFETY OFFICER: HIGH and CRITICAL issues from their assigned projects
+        - anyone else: nothing
         """
-        user = self.request.user  # "Who is asking?"
-        
-        # GLASSES 1: PROJECT MANAGER GLASSES (see everything)
-        if user.role in ['ADMIN', 'PROJECT MANAGER']:
-            return Issue.objects.all()  # "Show me ALL issues"
-        
-        # GLASSES 2: SITE OFFICER GLASSES (see assigned projects only)  
-        elif user.role == 'SITE OFFICER':
-            # "Show me issues only from MY classrooms"
-            return Issue.objects.filter(project__in=user.assigned_projects.all())
-        
-        # GLASSES 3: SUBCONTRACTOR GLASSES (see only their trade)
-        elif user.role == 'SUB CONTRACTOR' and user.specialty:
-            # "Show me only PLUMBING issues from MY classrooms"
-            return Issue.objects.filter(
-                project__in=user.assigned_projects.all(),  
-                trade=user.specialty  # Only my specialty
-            )
-        
-        # GLASSES 4: SAFETY OFFICER GLASSES (see safety issues only)
-        elif user.role == 'SAFETY OFFICER':
-            # "Show me only DANGEROUS issues from MY classrooms"
-            return Issue.objects.filter(
-                project__in=user.assigned_projects.all()  
-            ).filter(
-                Q(priority='HIGH') | Q(priority='CRITICAL') 
-            )
-        
-        # NO GLASSES: See nothing
-        else:
-            return Issue.objects.none()  
+        issues = get_visibility(self.request.user).issue_queryset()
+        # ?fields= / ?expand= decide what is loaded (SparseFieldsMixin)
+        return IssueSerializer.setup_sparse_loading(issues, self.request)
 
-@api_view(['GET', 'POST'])
+    def last_modified(self, data):
+        # A new comment changes comments_count but not the issue's updated_at
+        if isinstance(data, dict) and 'comments_count' in data:
+            return None
+        return super().last_modified(data)
+
+def project_issues_queryset(request, project_id):
+    """The issues GET /api/projects/<id>/issues/ lists."""
+    return IssueSerializer.setup_sparse_loading(Issue.objects.filter(project_id=project_id), request)
+
+@api_view(['GET', 'POST', 'PATCH'])
 @permission_classes([IsAuthenticated])
 def project_issues(request, project_id):
     """
     Handle issues for a specific project
     - GET: Get all issues for this project
-    - POST: Create a new issue in this project
+    - POST: Create a new issue in this project, or a list of issues in one go
+    - PATCH: Change status / priority / due_date of a list of issues
+      [{"id": 12, "status": "RESOLVED"}, {"id": 13, "priority": "HIGH"}]
+    
+    For lists, valid items are saved and invalid ones come back under
+    "errors" with their index. Add ?atomic=true to save nothing if any item
+    is invalid.
     """
     try:
         project = Project.objects.get(id=project_id)
@@ -257,21 +287,61 @@ def project_issues(request, project_id):
         )
         
     if request.method == 'GET':
-        issues = Issue.objects.filter(project_id=project_id)
-        serializer = IssueSerializer(issues, many=True)
+        issues = project_issues_queryset(request, project_id)
+        
+        # ?pagination=cursor pages through the issues instead of returning all of them
+        paginated = paginate_nested(request, issues, IssueSerializer, ordering=['-created_at'])
+        if paginated is not None:
+            return paginated
+        
+        serializer = IssueSerializer(issues, many=True, context={'request': request})
         return Response(serializer.data)
     
+    elif request.method == 'POST' and isinstance(request.data, list):
+        return bulk_response(request, project, bulk.create_issues, 'created', status.HTTP_201_CREATED)
+    
     elif request.method == 'POST':
-        data = request.data.copy()
-        data['project'] = project_id
-        serializer = IssueSerializer(data=data)
+        serializer = IssueSerializer(data=request.data)
         
         if serializer.is_valid():
-            serializer.save()
+            serializer.save(project=project)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+    elif request.method == 'PATCH':
+        if not isinstance(request.data, list):
+            return Response(
+                {"error": "Expected a list of issue changes"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return bulk_response(request, project, bulk.update_issues, 'updated', status.HTTP_200_OK)
+
+
+def bulk_response(request, project, operation, key, success_status):
+    """Run a bulk create/update and report what was saved and what was rejected"""
+    items = request.data
+    if len(items) > bulk.BULK_LIMIT:
+        return Response(
+            {"error": f"At most {bulk.BULK_LIMIT} issues per request"}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    atomic = request.query_params.get('atomic', '').lower() in ('1', 'true', 'yes')
+    issues, errors = operation(project, items, atomic=atomic)
+    
+    if not errors:
+        response_status = success_status
+    elif issues:
+        response_status = status.HTTP_207_MULTI_STATUS  # some saved, some rejected
+    else:
+        response_status = status.HTTP_400_BAD_REQUEST
+    
+    return Response({
+        key: IssueSerializer(issues, many=True).data,
+        "errors": errors
+    }, status=response_status)
+    
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def assign_issue(request, issue_id):
@@ -284,7 +354,7 @@ def assign_issue(request, issue_id):
     """
     # STEP 1: Check if issue exists
     try:
-        issue = Issue.objects.get(id=issue_id)
+        issue = Issue.objects.select_related('project').get(id=issue_id)
     except Issue.DoesNotExist:
         return Response(
             {"error": "Issue not found"}, 
@@ -300,31 +370,31 @@ def assign_issue(request, issue_id):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # STEP 3: Validate it's a valid trade choice
-    valid_trades = [choice[0] for choice in Issue._meta.get_field('assigned_to').choices]
-    if assigned_trade not in valid_trades:
-        return Response(
-            {"error": f"Invalid trade. Must be one of: {', '.join(valid_trades)}"}, 
-            status=status.HTTP_400_BAD_REQUEST
-        )
-    
-    # STEP 4: Create audit trail (optional)
-    try:
-        IssueHistory.objects.create(
-            issue=issue,
-            user=request.user,
-            action="assigned_trade_changed",
-            old_value=issue.assigned_to,
-            new_value=assigned_trade
-        )
-    except:
-        pass  # Skip audit if it fails
+    # STEP 3: Find the trade (creating it the first time a valid one is used)
+    trade = trades.by_name(assigned_trade)
+    if trade is None:
+        valid_trades = [choice[0] for choice in TRADE_CHOICES]
+        if assigned_trade not in valid_trades:
+            return Response(
+                {"error": f"Invalid trade. Must be one of: {', '.join(valid_trades)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        trade, _ = Trade.objects.get_or_create(name=assigned_trade)
     
-    # STEP 5: Save the old assignment and update
-    old_assignment = issue.assigned_to
-    issue.assigned_to = assigned_trade
+    # STEP 4: Save the old assignment and update (the save is recorded in
+    # the issue's history by core.audit)
+    old_trade = trades.by_id(issue.trade_id)
+    old_assignment = old_trade.name if old_trade is not None else None
+    issue.trade = trade
     issue.save()
     
+    # STEP 5: Let the project team know
+    notifications.notify(
+        issue, 'assigned',
+        f'"{issue.issue_title}" was assigned to {assigned_trade}',
+        actor=request.user
+    )
+    
     # STEP 6: Return success response
     return Response({
         "message": f"Issue #{issue_id} assigned to {assigned_trade}",
@@ -336,14 +406,29 @@ def assign_issue(request, issue_id):
     }, status=status.HTTP_200_OK)
     
 class CommentViewSet(viewsets.ModelViewSet):
-    queryset = Comment.objects.all()
+    queryset = CommentSerializer.setup_eager_loading(Comment.objects.all())
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    # ?search= is handled by CommentFilter through the full-text index
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_class = CommentFilter
-    search_fields = ['content']
     ordering_fields = ['timestamp', 'user']
-    ordering = ['-timestamp']
+    pagination_class = PageOrCursorPagination
+    cursor_ordering = ['-timestamp']
+    
+    @property
+    def ordering(self):
+        # ?search= results come best match first, don't reorder them by date
+        if self.request.query_params.get('search'):
+            return None
+        return ['-timestamp']
+    
+    def get_queryset(self):
+        return CommentSerializer.setup_sparse_loading(Comment.objects.all(), self.request)
+
+def issue_comments_queryset(request, issue):
+    """The comments GET /api/issues/<id>/comments/ lists."""
+    return CommentSerializer.setup_sparse_loading(Comment.objects.filter(issue=issue).order_by('-timestamp'), request)
 
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
@@ -364,8 +449,13 @@ def issue_comments(request, issue_id):
     
     # STEP 2: Handle GET request (view comments)
     if request.method == 'GET':
-        comments = Comment.objects.filter(issue=issue).order_by('-timestamp')
-        serializer = CommentSerializer(comments, many=True)
+        comments = issue_comments_queryset(request, issue)
+        
+        paginated = paginate_nested(request, comments, CommentSerializer, ordering=['-timestamp'])
+        if paginated is not None:
+            return paginated
+        
+        serializer = CommentSerializer(comments, many=True, context={'request': request})
         return Response(serializer.data)
     
     # STEP 3: Handle POST request (add comment)
@@ -402,9 +492,14 @@ def issue_comments(request, issue_id):
             )
     
 class AttachmentViewSet(viewsets.ModelViewSet):
-    queryset = Attachment.objects.all()
+    queryset = AttachmentSerializer.setup_eager_loading(Attachment.objects.all())
     serializer_class = AttachmentSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = PageOrCursorPagination
+    cursor_ordering = ['-uploaded_at']
+    
+    def get_queryset(self):
+        return AttachmentSerializer.setup_sparse_loading(Attachment.objects.all(), self.request)
     
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -415,7 +510,16 @@ def upload_attachment(request, issue_id):
     Form Data:
     - file: (the actual file - image, PDF, etc.)
     """
-    # STEP 1: Check if issue exists
+    # STEP 1: Refuse oversized uploads from the Content-Length header,
+    # before the body is read (leave room for the multipart boundaries)
+    content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    if content_length > uploads.MAX_UPLOAD_SIZE + 64 * 1024:
+        return Response(
+            {"error": "File too large. Maximum size is 10MB"}, 
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+    
+    # STEP 2: Check if issue exists
     try:
         issue = Issue.objects.get(id=issue_id)
     except Issue.DoesNotExist:
@@ -424,24 +528,24 @@ def upload_attachment(request, issue_id):
             status=status.HTTP_404_NOT_FOUND
         )
     
-    # STEP 2: Check if file was provided
+    # STEP 3: Check if file was provided
     if 'file' not in request.FILES:
         return Response(
             {"error": "No file provided"}, 
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # STEP 3: Get the uploaded file
+    # STEP 4: Get the uploaded file
     uploaded_file = request.FILES['file']
     
-    # STEP 4: Validate file size (optional - 10MB limit)
-    if uploaded_file.size > 10 * 1024 * 1024:
+    # STEP 5: Validate file size (optional - 10MB limit)
+    if uploaded_file.size > uploads.MAX_UPLOAD_SIZE:
         return Response(
             {"error": "File too large. Maximum size is 10MB"}, 
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # STEP 5: Create the attachment
+    # STEP 6: Create the attachment
     try:
         attachment = Attachment.objects.create(
             issue=issue,
@@ -452,7 +556,7 @@ def upload_attachment(request, issue_id):
         return Response({
             "message": "File uploaded successfully",
             "attachment_id": attachment.id,
-            "file_url": attachment.file.url,
+            "file_url": downloads.signed_url(attachment, request),
             "file_name": uploaded_file.name,
             "file_size": uploaded_file.size,
             "uploaded_by": request.user.username,
@@ -467,6 +571,508 @@ def upload_attachment(request, issue_id):
             status=status.HTTP_400_BAD_REQUEST
         )
         
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def start_upload(request, issue_id):
+    """
+    Start a chunked (resumable) upload for an issue
+    POST /api/issues/15/uploads/
+    {
+        "file_name": "drawings.pdf",
+        "total_size": 9437184
+    }
+    Then PUT the chunks to the returned upload_url, see core/uploads.py
+    """
+    try:
+        issue = Issue.objects.get(id=issue_id)
+    except Issue.DoesNotExist:
+        return Response(
+            {"error": "Issue not found"}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    file_name = request.data.get('file_name')
+    try:
+        total_size = int(request.data.get('total_size'))
+    except (TypeError, ValueError):
+        total_size = None
+    
+    if not file_name or total_size is None or total_size <= 0:
+        return Response(
+            {"error": "file_name and a positive total_size are required"}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    # The size limit is enforced before a single byte of the file is sent
+    if total_size > uploads.MAX_UPLOAD_SIZE:
+        return Response(
+            {"error": "File too large. Maximum size is 10MB"}, 
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+    
+    session = UploadSession.objects.create(
+        issue=issue,
+        user=request.user,
+        file_name=os.path.basename(file_name),
+        total_size=total_size
+    )
+    
+    return Response({
+        "upload_id": session.id,
+        "upload_url": request.build_absolute_uri(f'/api/uploads/{session.id}/'),
+        "offset": session.offset,
+        "total_size": session.total_size,
+        "max_chunk_size": uploads.MAX_CHUNK_SIZE
+    }, status=status.HTTP_201_CREATED)
+
+@api_view(['GET', 'PUT', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def upload_session(request, upload_id):
+    """
+    Resume, send or cancel a chunked upload
+    GET    /api/uploads/<id>/ - where to resume from ("offset")
+    PUT    /api/uploads/<id>/ - raw chunk bytes, headers:
+           Upload-Offset: <byte the chunk starts at>
+           Upload-Checksum: sha256 <hex digest of the chunk>   (optional)
+    DELETE /api/uploads/<id>/ - give up and remove the partial file
+    """
+    sessions = UploadSession.objects.filter(user=request.user)
+    
+    if request.method == 'GET':
+        try:
+            session = sessions.get(id=upload_id)
+        except UploadSession.DoesNotExist:
+            return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(upload_status(session))
+    
+    if request.method == 'DELETE':
+        try:
+            session = sessions.get(id=upload_id, attachment__isnull=True)
+        except UploadSession.DoesNotExist:
+            return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+        uploads.discard(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    # PUT: check everything from the headers before reading the body
+    try:
+        length = int(request.META['CONTENT_LENGTH'])
+        offset = int(request.headers['Upload-Offset'])
+        checksum = uploads.parse_checksum(request.headers.get('Upload-Checksum'))
+    except (KeyError, ValueError) as e:
+        return Response(
+            {"error": f"Content-Length and Upload-Offset headers are required ({e})"}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        session = sessions.get(id=upload_id)
+    except UploadSession.DoesNotExist:
+        return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+    
+    rejected = check_chunk(session, offset, length)
+    if rejected is not None:
+        return rejected
+    
+    # Read the chunk before locking anything, the client may be slow to send it
+    try:
+        spooled = uploads.spool_chunk(request.stream, length, checksum)
+    except uploads.ChunkError as e:
+        return Response(
+            {"error": str(e), **upload_status(session)}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        with transaction.atomic():
+            # Lock the session so two chunks can't be written at once, and check
+            # again: another request may have written this chunk meanwhile
+            session = sessions.select_for_update().get(id=upload_id)
+            rejected = check_chunk(session, offset, length)
+            if rejected is not None:
+                return rejected
+            uploads.append_chunk(session, spooled)
+    except UploadSession.DoesNotExist:
+        return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+    finally:
+        os.remove(spooled)
+    
+    if session.offset < session.total_size:
+        return Response(upload_status(session))
+    
+    attachment = uploads.complete(session)
+    return Response({
+        "message": "File uploaded successfully",
+        **upload_status(session),
+        "file_url": downloads.signed_url(attachment, request)
+    }, status=status.HTTP_201_CREATED)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def attachment_download(request, attachment_id):
+    """
+    Download an attachment (Range requests resume an interrupted download)
+    GET /api/attachments/7/download/
+    Its "download_url" does the same without the auth header, until it expires.
+    """
+    # STEP 1: Check the attachment exists and the user can see its issue
+    attachment = Attachment.objects.filter(
+        get_visibility(request.user).issue_filter('issue__'), id=attachment_id
+    ).only('id', 'file', 'file_name', 'content_type', 'sha256').first()
+    if attachment is None:
+        return Response(
+            {"error": "Attachment not found"}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    # STEP 2: Send it (or have the web server send it)
+    try:
+        return downloads.send(
+            request, attachment.file.name, attachment.file_name, attachment.content_type, attachment.sha256
+        )
+    except FileNotFoundError:
+        return Response(
+            {"error": "File not found"}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def signed_download(request, token):
+    """
+    Download through a signed URL from AttachmentSerializer.download_url, no auth header needed
+    GET /api/files/<token>/
+    """
+    # The signature is the permission check, nothing is looked up
+    found = downloads.read_token(token)
+    if found is None:
+        return Response(
+            {"error": "Download link is invalid or has expired"}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    name, file_name, content_type, sha256, expires = found
+    try:
+        return downloads.send(
+            request, name, file_name, content_type, sha256, max_age=max(int(expires - time.time()), 0)
+        )
+    except FileNotFoundError:
+        return Response(
+            {"error": "File not found"}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def attachment_derivative(request, attachment_id, size):
+    """
+    A resized copy of an image attachment, JPEG
+    GET /api/attachments/7/derivatives/thumb/    (320px)
+    GET /api/attachments/7/derivatives/preview/  (1280px)
+    The URLs are listed under "derivatives" on the attachment.
+    """
+    # STEP 1: Check the attachment exists, the user can see its issue and it has this size
+    attachment = Attachment.objects.filter(
+        get_visibility(request.user).issue_filter('issue__'), id=attachment_id
+    ).first()
+    if attachment is None or size not in derivatives.SIZES or not derivatives.has_derivatives(attachment):
+        return Response(
+            {"error": "Not found"}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    # STEP 2: Answer from the client's copy if the content hasn't changed
+    etag = f'"{attachment.sha256}-{size}"'
+    if attachment.sha256 and request.headers.get('If-None-Match') == etag:
+        return HttpResponse(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    
+    # STEP 3: Find it on disk, or have it rendered now
+    try:
+        path = derivatives.get(attachment, size)
+    except derivatives.NotReady:
+        return Response(
+            {"error": "Preview is still being generated, try again shortly"}, 
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': '5'}
+        )
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        # Missing original, or not an image Pillow can (safely) read
+        return Response(
+            {"error": "No preview for this file"}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    response = FileResponse(open(path, 'rb'), content_type='image/jpeg')
+    response['ETag'] = f'"{attachment.sha256}-{size}"'  # known now if it wasn't before
+    response['Cache-Control'] = 'private, max-age=86400'
+    return response
+
+def upload_status(session):
+    return {
+        "upload_id": session.id,
+        "offset": session.offset,
+        "total_size": session.total_size,
+        "complete": session.attachment_id is not None,
+        "attachment_id": session.attachment_id
+    }
+
+def check_chunk(session, offset, length):
+    """The response rejecting a chunk of ``length`` bytes at ``offset``, None if it fits."""
+    if session.attachment_id:
+        return Response(upload_status(session), status=status.HTTP_409_CONFLICT)
+    
+    if offset != session.offset:
+        return Response(
+            {"error": "Upload-Offset does not match the server, resume from 'offset'", **upload_status(session)}, 
+            status=status.HTTP_409_CONFLICT
+        )
+    
+    if length > uploads.MAX_CHUNK_SIZE or session.offset + length > session.total_size:
+        return Response(
+            {"error": "Chunk too large", **upload_status(session)}, 
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+    return None
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def project_summary(request, project_id):
+    """
+    Issue counts for one project, as the dashboard shows them
+    GET /api/projects/5/summary/
+    """
+    # STEP 1: Check the project exists and the user can open it
+    scope = get_visibility(request.user)
+    if not Project.objects.filter(scope.project_filter(), id=project_id).exists():
+        return Response(
+            {"error": "Project not found"}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    # STEP 2: Read the counts from the summary tables (only issues this role can see)
+    return Response({
+        "project_id": project_id,
+        **summary.build_summary(scope, project_id=project_id)
+    })
+
+def history_page(request, history):
+    """One keyset page of IssueHistory rows, newest first"""
+    paginator = KeysetPagination(ordering=['-timestamp'])
+    page = paginator.paginate_queryset(IssueHistorySerializer.setup_eager_loading(history), request)
+    return paginator.get_paginated_response(IssueHistorySerializer(page, many=True).data)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def issue_history(request, issue_id):
+    """
+    Every recorded change to an issue, newest first, a page at a time
+    GET /api/issues/15/history/
+    Follow the "next" link for older changes
+    """
+    # STEP 1: Check the issue exists and the user can see it
+    if not get_visibility(request.user).issue_queryset().filter(id=issue_id).exists():
+        return Response(
+            {"error": "Issue not found"}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    # STEP 2: Page through its history on (issue, timestamp, id)
+    return history_page(request, IssueHistory.objects.filter(issue_id=issue_id))
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def project_history(request, project_id):
+    """
+    Changes to the issues of a project that the user can see, newest first
+    GET /api/projects/5/history/
+    """
+    # STEP 1: Check the project exists and the user can open it
+    scope = get_visibility(request.user)
+    if not Project.objects.filter(scope.project_filter(), id=project_id).exists():
+        return Response(
+            {"error": "Project not found"}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    # STEP 2: Page through it on (project, timestamp, id), limited to the issues this role sees
+    return history_page(request, IssueHistory.objects.filter(scope.issue_filter('issue__'), project_id=project_id))
+
+class ExportView(APIView):
+    """
+    Stream every issue, comment or history row the user can see as CSV (default) or NDJSON
+    GET /api/export/issues/?output=ndjson
+    GET /api/export/comments/?project=5&status=OPEN
+    Takes ?project= and the same filters as /api/issues/ (trade, priority,
+    status, search); comments and history are those of the matching issues.
+    """
+    permission_classes = [IsAuthenticated]
+    # The format comes from ?output=, error responses are always JSON
+    content_negotiation_class = export.IgnoreClientContentNegotiation
+    
+    def get(self, request, resource):
+        # STEP 1: Check what is being asked for
+        if resource not in export.RESOURCES:
+            return Response(
+                {"error": f"Unknown export. Must be one of: {', '.join(export.RESOURCES)}"}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        output = request.query_params.get('output', 'csv')
+        if output not in export.OUTPUTS:
+            return Response(
+                {"error": f"Invalid output. Must be one of: {', '.join(export.OUTPUTS)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # STEP 2: The issues this user can see, narrowed down like IssueViewSet does
+        scope = get_visibility(request.user)
+        issues = scope.issue_queryset()
+        project_id = request.query_params.get('project')
+        if project_id is not None:
+            if not project_id.isdigit() or not Project.objects.filter(scope.project_filter(), id=project_id).exists():
+                return Response(
+                    {"error": "Project not found"}, 
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            issues = issues.filter(project_id=project_id)
+        
+        filterset = IssueFilter(request.query_params, queryset=issues, request=request)
+        if not filterset.is_valid():
+            return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+        issues = filterset.qs
+        
+        # STEP 3: Stream the rows
+        if resource == 'issues':
+            rows = issues
+        else:
+            model = export.RESOURCES[resource][0]
+            narrowed = project_id is not None or any(name in request.query_params for name in IssueFilter.base_filters)
+            if narrowed:
+                rows = model.objects.filter(issue_id__in=issues.order_by().values('id'))
+            else:
+                rows = model.objects.filter(scope.issue_filter('issue__'))
+        return export.export_response(request, resource, rows, output)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def import_issues(request):
+    """
+    Import issues from a CSV file (see core/importer.py for the columns)
+    POST /api/import/issues/
+    Form Data:
+    - file: the CSV
+    - project: (optional) project id for rows without a project column
+    - mapping: (optional) JSON, {"CSV header": "issue field"}
+    - atomic: (optional) "true" to import nothing if any row is invalid
+    - allow_past_due: (optional) "true" to accept due dates in the past
+    Rows that fail are listed in the CSV at "error_file" (for the importing user only, expires).
+    """
+    # STEP 1: Check a file was sent
+    if 'file' not in request.FILES:
+        return Response(
+            {"error": "No file provided"}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    # STEP 2: Rows may only go into projects the user can open
+    projects = get_visibility(request.user).project_queryset()
+    default_project = None
+    project_id = str(request.data.get('project', ''))
+    if project_id:
+        default_project = projects.filter(id=project_id).first() if project_id.isdigit() else None
+        if default_project is None:
+            return Response(
+                {"error": "Project not found"}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+    
+    try:
+        mapping = json.loads(request.data.get('mapping') or '{}')
+    except ValueError:
+        mapping = None
+    if not isinstance(mapping, dict):
+        return Response(
+            {"error": "mapping must be a JSON object"}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    # STEP 3: Import, collecting the failed rows in a temporary file
+    atomic, allow_past_due = (
+        str(request.data.get(name, '')).lower() in ('1', 'true', 'yes') for name in ('atomic', 'allow_past_due')
+    )
+    import_job = importer.IssueImporter(
+        projects=projects, default_project=default_project, mapping=mapping, actor=request.user,
+        atomic=atomic, allow_past_due=allow_past_due,
+    )
+    text_file = io.TextIOWrapper(request.FILES['file'], encoding='utf-8-sig', newline='')
+    with tempfile.TemporaryFile('w+', newline='') as error_file:
+        try:
+            result = import_job.run(text_file, error_file)
+        except (importer.ImportFileError, UnicodeDecodeError, csv.Error) as e:
+            return Response(
+                {"error": f"Import failed: {e}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # STEP 4: Keep the error file for a while, only this user can download it
+        data = result.as_dict()
+        if result.errors:
+            name = importer.save_error_file(error_file)
+            data['error_file'] = importer.error_file_url(name, request.user, request)
+    
+    if not result.errors:
+        response_status = status.HTTP_201_CREATED
+    elif result.imported:
+        response_status = status.HTTP_207_MULTI_STATUS  # some imported, some rejected
+    else:
+        response_status = status.HTTP_400_BAD_REQUEST
+    return Response(data, status=response_status)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def import_errors(request, token):
+    """
+    Download the rejected rows of an import
+    GET /api/import/errors/<token>/ (the "error_file" an import returned)
+    """
+    # STEP 1: Only the user who ran the import, until the link expires
+    name = importer.read_error_token(token, request.user)
+    if name is None or not default_storage.exists(name):
+        return Response(
+            {"error": "Error file not found or expired"}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    # STEP 2: Send it
+    return downloads.send(request, name, filename='import-errors.csv', content_type='text/csv')
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def sync_changes(request):
+    """
+    What changed since the client last synced, for offline tablets
+    GET /api/sync/                 -> {"token": ..., "reset": true}: download everything, then
+    GET /api/sync/?since=<token>   -> the projects, issues, comments and attachments that changed
+    Deleted objects (and ones the user can no longer see) come back with "deleted": true.
+    Keep the returned token for next time; fetch again straight away while "has_more" is true.
+    Projects listed in "resync_projects" are new to the user, download their issues in full.
+    """
+    # STEP 1: Read the token, start over if there is none or it is too old
+    since = sync.read_token(request.query_params.get('since'))
+    if since is None:
+        return Response(sync.reset())
+    
+    # STEP 2: The changes after it, scoped like IssueViewSet
+    return Response(sync.feed(request, request.user, get_visibility(request.user), since))
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def issue_summary(request):
+    """
+    Issue counts across every project the user can see
+    GET /api/summary/
+    """
+    return Response(summary.build_summary(get_visibility(request.user)))
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def test_assigned_projects(request):
@@ -476,7 +1082,9 @@ def test_assigned_projects(request):
     """
     user = request.user
     all_projects = Project.objects.all()
-    assigned_projects = user.assigned_projects.all()
+    assigned_projects = ProjectSerializer.setup_eager_loading(Project.objects.filter(
+        id__in=sorted(get_visibility(user).assigned_project_ids)
+    ))
     
     return Response({
         'user_info': {
@@ -0,0 +1,152 @@
+"""
+Per-user visibility index.
+
+Works out once which projects a user is assigned to and which issues their
+role lets them see, then keeps the project ids in the cache until the user's
+assignments or role change. Every role-scoped query (projects, issues and
+anything hanging off an issue) should go through here instead of rebuilding
+the scope from ``user.assigned_projects`` on each request.
+
+The version counter that invalidates an entry is bumped in the cache by the
+process that saw the change, so other processes only see it move when the
+cache is shared between them (settings.SHARED_CACHE, which gunicorn.conf.py
+insists on for more than one worker).
+"""
+import time
+from dataclasses import dataclass
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from . import trades
+from .models import Issue, Project
+
+FULL_ACCESS_ROLES = ('ADMIN', 'PROJECT MANAGER')
+SAFETY_PRIORITIES = ('HIGH', 'CRITICAL')
+
+# The version counter is what invalidates entries, the timeout only stops
+# idle users from filling the cache.
+CACHE_TIMEOUT = 60 * 60
+
+
+@dataclass(frozen=True)
+class Visibility:
+    role: str
+    specialty: str | None
+    assigned_project_ids: frozenset
+
+    @property
+    def see_all(self):
+        return self.role in FULL_ACCESS_ROLES
+
+    def project_filter(self, prefix=''):
+        """
+        Q limiting projects to the ones this user can open. The prefix must
+        lead to a Project: none on a Project queryset, ``'project__'`` to
+        scope issues or anything else with a ``project`` relation.
+        """
+        if self.see_all:
+            return Q()
+        return Q(**{f'{prefix}id__in': sorted(self.assigned_project_ids)})
+
+    def issue_filter(self, prefix=''):
+        """
+        Q limiting issues to the ones this role can see. Pass a prefix such
+        as ``'issue__'`` to scope comments, attachments or history instead.
+        """
+        if self.see_all:
+            return Q()
+
+        in_my_projects = Q(**{f'{prefix}project_id__in': sorted(self.assigned_project_ids)})
+
+        if self.role == 'SITE OFFICER':
+            return in_my_projects
+
+        if self.role == 'SUB CONTRACTOR' and self.specialty:
+            # By id, so the query doesn't join the trade table
+            trade = trades.by_name(self.specialty)
+            if trade is None:
+                return Q(**{f'{prefix}pk__in': []})
+            return in_my_projects & Q(**{f'{prefix}trade_id': trade.id})
+
+        if self.role == 'SAFETY OFFICER':
+            return in_my_projects & Q(**{f'{prefix}priority__in': SAFETY_PRIORITIES})
+
+        # No role we recognise: see nothing
+        return Q(**{f'{prefix}pk__in': []})
+
+    def can_see_issue(self, issue):
+        """The same rules as issue_filter(), for an issue already in memory."""
+        # Only sub-contractors need the trade's name
+        trade = trades.by_id(issue.trade_id) if self.role == 'SUB CONTRACTOR' else None
+        trade_name = trade.name if trade is not None else None
+        return self.can_see(issue.project_id, trade_name, issue.priority)
+
+    def can_see(self, project_id, trade_name, priority):
+        """The same rules as issue_filter(), for an issue's project, trade name and priority."""
+        if self.see_all:
+            return True
+        if project_id not in self.assigned_project_ids:
+            return False
+        if self.role == 'SITE OFFICER':
+            return True
+        if self.role == 'SUB CONTRACTOR' and self.specialty:
+            return trade_name == self.specialty
+        if self.role == 'SAFETY OFFICER':
+            return priority in SAFETY_PRIORITIES
+        return False
+
+    def project_queryset(self):
+        return Project.objects.filter(self.project_filter())
+
+    def issue_queryset(self):
+        return Issue.objects.filter(self.issue_filter())
+
+
+def _version_key(user_id):
+    return f'visibility:version:{user_id}'
+
+
+def _entry_key(user_id, version):
+    return f'visibility:{user_id}:{version}'
+
+
+def _current_version(user_id):
+    # Start from a timestamp rather than 1 so a version counter that was
+    # evicted can never collide with entries written under an older one.
+    key = _version_key(user_id)
+    cache.add(key, time.time_ns(), None)
+    return cache.get(key)
+
+
+def get_visibility(user):
+    """Return the cached :class:`Visibility` for ``user``, building it if needed."""
+    # Users authenticated from a scoped token bring theirs (core.authentication)
+    from_token = getattr(user, 'token_visibility', None)
+    if from_token is not None:
+        return from_token
+
+    version = _current_version(user.pk)
+    key = _entry_key(user.pk, version)
+
+    cached = cache.get(key)
+    if cached is not None and cached[0] == user.role and cached[1] == user.specialty:
+        project_ids = cached[2]
+    else:
+        project_ids = list(user.assigned_projects.values_list('id', flat=True))
+        cache.set(key, (user.role, user.specialty, project_ids), CACHE_TIMEOUT)
+
+    return Visibility(
+        role=user.role,
+        specialty=user.specialty,
+        assigned_project_ids=frozenset(project_ids),
+    )
+
+
+def invalidate(*user_ids):
+    """Drop the cached index for these users by bumping their version."""
+    for user_id in user_ids:
+        try:
+            cache.incr(_version_key(user_id))
+        except ValueError:
+            cache.set(_version_key(user_id), time.time_ns(), None)
@@ -0,0 +1,47 @@
+"""
+Gunicorn settings for the containers:
+
+    gunicorn siteflow.asgi:application -c gunicorn.conf.py
+
+Gunicorn manages the processes and Uvicorn workers run the ASGI application
+in each of them, so the async views (core/async_views.py) are served from an
+event loop and a slow client does not tie up a whole worker. The sync views
+still work, Django runs them in a thread pool.
+
+Everything can be overridden from the environment, e.g. the WSGI path for
+comparison:
+
+    GUNICORN_WORKER_CLASS=sync gunicorn siteflow.wsgi:application -c gunicorn.conf.py
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'uvicorn_worker.UvicornWorker')
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+reload = os.environ.get('GUNICORN_RELOAD', 'False') == 'True'
+accesslog = '-'
+
+
+def on_starting(server):
+    # Workers learn about each other's changes (roles and project assignments,
+    # trades) through version counters in the cache, which the default memory
+    # cache doesn't share
+    if server.cfg.workers > 1:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'siteflow.settings')
+        from django.conf import settings
+        if not settings.SHARED_CACHE:
+            raise RuntimeError(
+                f'{server.cfg.workers} workers need a shared cache: set CACHE_BACKEND and '
+                'CACHE_LOCATION (e.g. redis), or run a single worker (GUNICORN_WORKERS=1)'
+            )
+
+
+def worker_exit(server, worker):
+    # Write the notifications still queued in this worker (core/notifications.py)
+    from core.notifications import dispatcher
+    dispatcher.shutdown()
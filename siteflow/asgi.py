@@ -2,6 +2,8 @@
 ASGI config for siteflow project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+This is what the containers serve (see gunicorn.conf.py), so the async views
+in core/async_views.py run on the event loop.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -9,8 +11,15 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'siteflow.settings')
 
 application = get_asgi_application()
+
+if settings.DEBUG:
+    # runserver used to serve static files (admin, browsable API) in development
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+
+    application = ASGIStaticFilesHandler(application)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+from importlib.util import find_spec
 from pathlib import Path
 import os
 from dotenv import load_dotenv
@@ -50,7 +51,7 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.ScopedJWTAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -58,10 +59,29 @@ REST_FRAMEWORK = {
         'rest_framework.filters.OrderingFilter',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 20
+    'PAGE_SIZE': 20,
+    # Picked from the Accept header, JSON by default (core/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.ORJSONRenderer',
+        *(['core.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.renderers.ORJSONParser',
+        *(['core.renderers.MessagePackParser'] if find_spec('msgpack') else []),
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+# Responses of this many bytes or more are sent brotli or gzip compressed
+# to clients that accept it (core.middleware.CompressionMiddleware)
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'core.metrics.MetricsMiddleware',
+    'core.middleware.CompressionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -70,6 +90,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.CurrentRequestMiddleware',
 ]
 
 ROOT_URLCONF = 'siteflow.urls'
@@ -107,6 +128,96 @@ DATABASES = {
 }
 
 
+# Notifications
+# Issue events are written to Notification by a background thread, with
+# events on the same issue inside the window coalesced into one notification.
+
+NOTIFICATION_ASYNC = os.environ.get('NOTIFICATION_ASYNC', 'True') == 'True'
+NOTIFICATION_COALESCE_SECONDS = float(os.environ.get('NOTIFICATION_COALESCE_SECONDS', 5))
+
+
+# Cache
+# Defaults to a per-process memory cache. Point CACHE_BACKEND / CACHE_LOCATION
+# at a shared cache (e.g. redis) when running more than one worker so cache
+# invalidation reaches all of them: a version bumped by the worker that saw a
+# change (a role or project assignment, core/visibility.py) is invisible to
+# the others otherwise. gunicorn.conf.py refuses to start more than one
+# worker without a shared cache.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+SHARED_CACHE = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Cached API responses (core/response_cache.py). A write bumps a version
+# counter in the cache, which only the process that made it sees unless the
+# cache is shared, so caching is off by default with the per-process one.
+# Writes invalidate entries straight away, the timeout only bounds memory
+# for idle ones.
+RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', str(SHARED_CACHE)) == 'True'
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 300))
+
+# Trades are kept in memory by each process (core/trades.py). A process sees
+# its own changes straight away and another's within this many seconds, if
+# the cache is shared.
+TRADE_REGISTRY_CHECK_SECONDS = int(os.environ.get('TRADE_REGISTRY_CHECK_SECONDS', 5))
+
+# Access tokens carry the user's role and projects (core/authentication.py).
+# Each process re-checks a user's tokens against the database at most every
+# SCOPED_TOKEN_RECHECK_SECONDS, so that is how long a token can outlive a
+# change made through another process.
+SIMPLE_JWT = {
+    'TOKEN_OBTAIN_SERIALIZER': 'core.authentication.ScopedTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'core.authentication.ScopedTokenRefreshSerializer',
+}
+SCOPED_TOKEN_RECHECK_SECONDS = float(os.environ.get('SCOPED_TOKEN_RECHECK_SECONDS', 60))
+SCOPED_TOKEN_MAX_PROJECTS = int(os.environ.get('SCOPED_TOKEN_MAX_PROJECTS', 500))
+
+# Sync change feed (core/sync.py). Sync tokens stop short of changes younger
+# than SYNC_SETTLE_SECONDS so transactions still committing aren't skipped;
+# changes older than SYNC_RETENTION_DAYS are removed by prune_changes and
+# clients that haven't synced for that long download everything again.
+SYNC_SETTLE_SECONDS = float(os.environ.get('SYNC_SETTLE_SECONDS', 5))
+SYNC_RETENTION_DAYS = int(os.environ.get('SYNC_RETENTION_DAYS', 30))
+
+# Live events (core/events.py). EVENTS_BACKEND is a broker class path; empty
+# picks LISTEN/NOTIFY on PostgreSQL (shared by every worker) and an
+# in-process broker otherwise. Streams close after EVENTS_STREAM_SECONDS and
+# the client reconnects with its current token.
+EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', '')
+EVENTS_STREAM_SECONDS = float(os.environ.get('EVENTS_STREAM_SECONDS', 300))
+
+
+# Request metrics (core/metrics.py)
+# Queries slower than SLOW_QUERY_MS are logged with their route. Set
+# METRICS_TOKEN to require "Authorization: Bearer <token>" on /metrics/.
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        'core': {'handlers': ['console'], 'level': os.environ.get('LOG_LEVEL', 'INFO')},
+        # One line per request, turn down with REQUEST_LOG_LEVEL=WARNING
+        'core.metrics.requests': {'level': os.environ.get('REQUEST_LOG_LEVEL', 'INFO')},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -144,6 +255,34 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Chunked (resumable) attachment uploads keep their partial files here
+# until the last chunk arrives
+CHUNKED_UPLOAD_DIR = os.environ.get('CHUNKED_UPLOAD_DIR', BASE_DIR / 'uploads_partial')
+
+# Thumbnails and previews of image attachments (core/derivatives.py), rendered
+# by DERIVATIVE_WORKERS processes and cached here by content
+DERIVATIVE_DIR = os.environ.get('DERIVATIVE_DIR', BASE_DIR / 'derivatives')
+DERIVATIVE_WORKERS = int(os.environ.get('DERIVATIVE_WORKERS', 2))
+DERIVATIVE_WAIT_SECONDS = float(os.environ.get('DERIVATIVE_WAIT_SECONDS', 10))
+
+# Attachment downloads (core/downloads.py). DOWNLOAD_OFFLOAD = 'nginx' sends
+# X-Accel-Redirect to DOWNLOAD_ACCEL_PREFIX + file name, 'sendfile' sends
+# X-Sendfile, '' has Django send the file. Signed download URLs are valid
+# for DOWNLOAD_URL_SECONDS.
+DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD', '')
+DOWNLOAD_ACCEL_PREFIX = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/protected/')
+DOWNLOAD_URL_SECONDS = int(os.environ.get('DOWNLOAD_URL_SECONDS', 300))
+
+# The rejected rows of an API import (core/importer.py) can be downloaded by
+# the importing user for this long, then they are deleted.
+IMPORT_ERROR_FILE_SECONDS = int(os.environ.get('IMPORT_ERROR_FILE_SECONDS', 24 * 60 * 60))
+
+# Attachment files are stored once per content (core/storage.py). Blobs no
+# attachment refers to any more are deleted in the background, and by the
+# gc_blobs command, once nothing has used them for BLOB_GC_GRACE_SECONDS
+BLOB_GC_ASYNC = os.environ.get('BLOB_GC_ASYNC', 'True') == 'True'
+BLOB_GC_GRACE_SECONDS = int(os.environ.get('BLOB_GC_GRACE_SECONDS', 3600))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 